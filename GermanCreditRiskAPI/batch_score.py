@@ -0,0 +1,216 @@
+"""
+Scoring offline de archivos grandes de solicitantes (CSV o Parquet).
+
+Lee la entrada por bloques, reparte los bloques en un pool de procesos (cada
+worker carga el modelo una sola vez) y escribe el resultado en el orden de
+entrada con las mismas reglas de riesgo y recomendación que la API.
+
+    python batch_score.py cartera.parquet cartera_scored.parquet --workers 8
+    python batch_score.py cartera.csv scored.csv --chunk-size 200000 --resume
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import mlflow.sklearn
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from predict_logic import reglas_negocio, construir_matriz, FEATURES, MODEL_NAME, MODEL_ALIAS
+from columnar import validar_columnas
+from serving.model_store import AlmacenModelos, checksum_directorio
+
+def _es_parquet(ruta: str) -> bool:
+    return ruta.lower().endswith((".parquet", ".pq"))
+
+def leer_bloques(ruta: str, tamano: int):
+    """Itera DataFrames de `tamano` filas sin cargar el archivo completo."""
+    if _es_parquet(ruta):
+        for lote in pq.ParquetFile(ruta).iter_batches(batch_size=tamano):
+            yield lote.to_pandas()
+    else:
+        yield from pd.read_csv(ruta, chunksize=tamano)
+
+def validar_bloque(df: pd.DataFrame) -> tuple:
+    """
+    Valida el bloque con los límites de ClienteInput (igual que la API).
+    Devuelve la matriz de features, la máscara de filas válidas y el error
+    de cada fila (None si es válida).
+    """
+    faltantes = [f for f in FEATURES if f not in df.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas en la entrada: {faltantes}")
+    X, errores = validar_columnas({f: df[f].to_numpy() for f in FEATURES})
+    por_fila = [None] * len(df)
+    for e in errores:
+        campo, fila = e["loc"][1], e["loc"][2]
+        mensaje = f"{campo}: {e['msg']}"
+        por_fila[fila] = mensaje if por_fila[fila] is None else f"{por_fila[fila]}; {mensaje}"
+    validas = np.array([e is None for e in por_fila], dtype=bool)
+    return X, validas, por_fila
+
+# Estado por worker: el modelo se carga una vez por proceso
+_modelo = None
+
+def _inicializar_worker(ruta_modelo: str):
+    global _modelo
+    logging.basicConfig(level=logging.WARNING)
+    _modelo = mlflow.sklearn.load_model(ruta_modelo)
+    # Un hilo por worker: el paralelismo lo da el pool de procesos
+    if hasattr(_modelo, "set_params"):
+        _modelo.set_params(n_jobs=1)
+
+def _puntuar_bloque(indice: int, df: pd.DataFrame, ruta_parte: str) -> tuple[int, int, int]:
+    X, validas, errores = validar_bloque(df)
+    # Las filas inválidas quedan con predicción vacía y el motivo en `error`
+    columnas = {
+        "risk": np.full(len(df), None, dtype=object),
+        "probability_good": np.full(len(df), np.nan),
+        "probability_bad": np.full(len(df), np.nan),
+        "recommendation": np.full(len(df), None, dtype=object),
+    }
+    if validas.any():
+        resultado = reglas_negocio(_modelo.predict_proba(construir_matriz(X[validas])))
+        for nombre, valores in resultado.items():
+            columnas[nombre][validas] = valores
+    # dtype "string" fija el esquema Parquet aunque un bloque no tenga filas válidas
+    salida = df.reset_index(drop=True).assign(
+        risk=pd.Series(columnas["risk"], dtype="string"),
+        probability_good=columnas["probability_good"],
+        probability_bad=columnas["probability_bad"],
+        recommendation=pd.Series(columnas["recommendation"], dtype="string"),
+        error=pd.Series(errores, dtype="string"),
+    )
+    tmp = f"{ruta_parte}.tmp"
+    salida.to_parquet(tmp, index=False)
+    os.replace(tmp, ruta_parte)
+    return indice, len(df), int((~validas).sum())
+
+def _ruta_parte(directorio: str, indice: int) -> str:
+    return os.path.join(directorio, f"part-{indice:06d}.parquet")
+
+def _meta(entrada: str, tamano_bloque: int, version_modelo: str) -> dict:
+    # Lo que tiene que coincidir para reanudar: un archivo de salida no mezcla versiones del modelo
+    return {"entrada": os.path.abspath(entrada), "chunk_size": tamano_bloque,
+            "modelo": MODEL_NAME, "version": version_modelo}
+
+def _preparar_directorio(directorio: str, meta: dict, reanudar: bool):
+    ruta_meta = os.path.join(directorio, "meta.json")
+    if reanudar and os.path.isfile(ruta_meta):
+        with open(ruta_meta, encoding="utf-8") as f:
+            anterior = json.load(f)
+        if anterior != meta:
+            raise SystemExit(f"No se puede reanudar: la ejecución previa usó {anterior} y esta usa {meta}. "
+                             "Sin --resume la corrida empieza de nuevo.")
+        return
+    shutil.rmtree(directorio, ignore_errors=True)
+    os.makedirs(directorio)
+    with open(ruta_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+def unir_partes(directorio: str, n_partes: int, salida: str):
+    """Concatena las partes en orden de entrada, una a la vez."""
+    tmp = f"{salida}.tmp"
+    if _es_parquet(salida):
+        writer = None
+        for i in range(n_partes):
+            tabla = pq.read_table(_ruta_parte(directorio, i))
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, tabla.schema)
+            writer.write_table(tabla)
+        if writer is None:
+            pq.write_table(pa.table({}), tmp)
+        else:
+            writer.close()
+    else:
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            for i in range(n_partes):
+                pd.read_parquet(_ruta_parte(directorio, i)).to_csv(f, index=False, header=(i == 0))
+    os.replace(tmp, salida)
+
+def modelo_por_defecto() -> tuple[str, str]:
+    """(ruta, versión) de producción desde la cache local de artefactos (la descarga si hace falta)."""
+    version, ruta, origen = AlmacenModelos().resolver(MODEL_NAME, MODEL_ALIAS)
+    logging.info(f"Modelo {MODEL_NAME} v{version} ({origen})")
+    return ruta, version
+
+def puntuar_archivo(entrada: str, salida: str, ruta_modelo: str, tamano_bloque: int = 100_000,
+                    workers: int | None = None, reanudar: bool = False, version_modelo: str | None = None) -> dict:
+    """
+    `version_modelo` identifica el modelo en los metadatos de reanudación; un
+    modelo local sin versión se identifica por el checksum de su directorio.
+    """
+    workers = workers or os.cpu_count() or 1
+    version_modelo = version_modelo or f"sha256:{checksum_directorio(ruta_modelo)}"
+    directorio = f"{salida}.partes"
+    _preparar_directorio(directorio, _meta(entrada, tamano_bloque, version_modelo), reanudar)
+
+    inicio = time.perf_counter()
+    filas = invalidas = saltados = n_partes = 0
+    pendientes = set()
+    # spawn: los workers no heredan hilos ni locks del proceso padre
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=contexto, initializer=_inicializar_worker,
+                             initargs=(ruta_modelo,)) as pool:
+        def recoger(bloqueante: bool):
+            nonlocal filas, invalidas, pendientes
+            hechos, pendientes = wait(pendientes, timeout=None if bloqueante else 0,
+                                      return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                indice, n, n_invalidas = futuro.result()
+                filas += n
+                invalidas += n_invalidas
+                transcurrido = time.perf_counter() - inicio
+                print(f"bloque {indice}: {n} filas | {filas:,} total | {filas / transcurrido:,.0f} filas/s",
+                      flush=True)
+
+        for indice, df in enumerate(leer_bloques(entrada, tamano_bloque)):
+            n_partes = indice + 1
+            parte = _ruta_parte(directorio, indice)
+            if os.path.isfile(parte):
+                saltados += 1
+                continue
+            # A lo sumo 2 bloques en vuelo por worker: la memoria no depende del archivo
+            while len(pendientes) >= 2 * workers:
+                recoger(bloqueante=True)
+            pendientes.add(pool.submit(_puntuar_bloque, indice, df, parte))
+        while pendientes:
+            recoger(bloqueante=True)
+
+    unir_partes(directorio, n_partes, salida)
+    shutil.rmtree(directorio, ignore_errors=True)
+    transcurrido = time.perf_counter() - inicio
+    resumen = {
+        "filas": filas,
+        "filas_invalidas": invalidas,
+        "bloques": n_partes,
+        "bloques_reanudados": saltados,
+        "segundos": round(transcurrido, 2),
+        "filas_por_segundo": round(filas / transcurrido) if transcurrido > 0 else 0,
+    }
+    print(f"Listo: {filas:,} filas ({invalidas:,} inválidas) en {transcurrido:.1f}s "
+          f"({resumen['filas_por_segundo']:,} filas/s) -> {salida}")
+    return resumen
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scoring offline de archivos de solicitantes")
+    parser.add_argument("entrada", help="Archivo CSV o Parquet con las columnas de ClienteInput")
+    parser.add_argument("salida", help="Archivo CSV o Parquet de salida (según la extensión)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Filas por bloque")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos (default: núcleos disponibles)")
+    parser.add_argument("--model-path", default=None,
+                        help="Directorio de un modelo MLflow local (default: producción desde la cache)")
+    parser.add_argument("--resume", action="store_true", help="Reanuda desde los bloques ya completados")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    ruta_modelo, version = (args.model_path, None) if args.model_path else modelo_por_defecto()
+    return puntuar_archivo(args.entrada, args.salida, ruta_modelo, args.chunk_size, args.workers, args.resume,
+                           version)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import queue
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as EsperaVencida
+from fastapi import HTTPException
+
+# Configuración del coalescer (opt-in)
+COALESCE_ENABLED     = os.getenv("COALESCE_ENABLED", "0") == "1"
+COALESCE_MAX_BATCH   = int(os.getenv("COALESCE_MAX_BATCH", "64"))
+COALESCE_MAX_WAIT_MS = float(os.getenv("COALESCE_MAX_WAIT_MS", "2"))
+COALESCE_TIMEOUT_S   = float(os.getenv("COALESCE_TIMEOUT_S", "10"))
+
+class MicroBatcher:
+    """
+    Agrupa solicitudes individuales concurrentes en un solo llamado por lote.
+
+    Cada hilo que llama a `enviar` encola su entrada y espera su resultado.
+    Un hilo de fondo toma la primera entrada de la cola, junta todo lo que
+    llegue hasta completar `max_batch` o hasta que la primera entrada lleve
+    `max_wait_ms` esperando, y ejecuta `funcion_lote` una sola vez. Con carga
+    baja la latencia extra está acotada por `max_wait_ms`; con carga alta los
+    lotes crecen solos mientras el modelo está ocupado.
+
+    Ninguna espera es indefinida: pasados `timeout_s` sin resultado, `enviar`
+    responde 503 y libera su hilo. Si el hilo de fondo no está vivo, el
+    siguiente envío lo vuelve a arrancar.
+    """
+
+    def __init__(self, funcion_lote, max_batch: int = COALESCE_MAX_BATCH,
+                 max_wait_ms: float = COALESCE_MAX_WAIT_MS, timeout_s: float = COALESCE_TIMEOUT_S):
+        self.funcion_lote = funcion_lote
+        self.max_batch    = max(1, max_batch)
+        self.max_wait     = max(0.0, max_wait_ms) / 1000
+        self.timeout      = max(0.001, timeout_s)
+        self._cola  = queue.SimpleQueue()
+        self._lock  = threading.Lock()
+        self._stats = {
+            "lotes": 0,
+            "solicitudes": 0,
+            "max_lote": 0,
+            "espera_total_ms": 0.0,
+            "max_espera_ms": 0.0,
+            "histograma_lote": {},
+            "timeouts": 0,
+            "reinicios": 0,
+        }
+        # El hilo arranca en el primer envío de cada proceso: un worker creado
+        # con fork (serving/prefork.py) no hereda los hilos del padre
+        self._hilo  = None
+        self._pid   = None
+        self._lock_hilo = threading.Lock()
+
+    def _vivo(self) -> bool:
+        return self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive()
+
+    def _arrancar(self):
+        with self._lock_hilo:
+            if self._vivo():
+                return
+            if self._pid != os.getpid():
+                # Proceso nuevo: la cola heredada del padre no la atiende nadie
+                self._cola = queue.SimpleQueue()
+            else:
+                # Mismo proceso: lo encolado sigue en la cola y lo atiende el hilo nuevo
+                logging.error("El hilo del coalescer no estaba vivo; se vuelve a arrancar")
+                with self._lock:
+                    self._stats["reinicios"] += 1
+            self._hilo = threading.Thread(target=self._bucle, name="coalescer", daemon=True)
+            self._hilo.start()
+            self._pid = os.getpid()
+
+    def enviar(self, item):
+        """Encola una entrada y bloquea hasta tener su resultado (503 si no llega a tiempo)."""
+        if not self._vivo():
+            self._arrancar()
+        futuro = Future()
+        self._cola.put((item, futuro, time.perf_counter()))
+        try:
+            return futuro.result(timeout=self.timeout)
+        except EsperaVencida:
+            # Si el lote todavía no salió, cancelar evita puntuar una entrada que nadie espera
+            futuro.cancel()
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise HTTPException(status_code=503, detail="El coalescer no respondió a tiempo")
+
+    def _bucle(self):
+        while True:
+            lote = []
+            try:
+                self._juntar(lote)
+                self._despachar(lote)
+            except Exception as e:
+                # El hilo no muere por un lote: se falla solo lo que quedó sin resolver
+                logging.exception("Error inesperado en el coalescer")
+                for _, futuro, _ in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+
+    def _juntar(self, lote):
+        primero = self._cola.get()
+        lote.append(primero)
+        limite  = primero[2] + self.max_wait
+        while len(lote) < self.max_batch:
+            restante = limite - time.perf_counter()
+            try:
+                if restante > 0:
+                    lote.append(self._cola.get(timeout=restante))
+                else:
+                    lote.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+
+    def _despachar(self, lote):
+        # Las entradas canceladas por timeout no se puntúan; las demás ya no se pueden cancelar
+        lote[:] = [entrada for entrada in lote if entrada[1].set_running_or_notify_cancel()]
+        if not lote:
+            return
+        inicio = time.perf_counter()
+        try:
+            resultados = self.funcion_lote([item for item, _, _ in lote])
+        except Exception as e:
+            for _, futuro, _ in lote:
+                futuro.set_exception(e)
+        else:
+            for (_, futuro, _), resultado in zip(lote, resultados):
+                futuro.set_result(resultado)
+        self._registrar(lote, inicio)
+
+    def _registrar(self, lote, inicio):
+        esperas = [inicio - encolado for _, _, encolado in lote]
+        with self._lock:
+            s = self._stats
+            s["lotes"]       += 1
+            s["solicitudes"] += len(lote)
+            s["max_lote"]     = max(s["max_lote"], len(lote))
+            s["espera_total_ms"] += sum(esperas) * 1000
+            s["max_espera_ms"]    = max(s["max_espera_ms"], max(esperas) * 1000)
+            cubeta = 1
+            while cubeta < len(lote):
+                cubeta *= 2
+            s["histograma_lote"][cubeta] = s["histograma_lote"].get(cubeta, 0) + 1
+
+    def estadisticas(self) -> dict:
+        """Tamaño de lote y tiempo de espera acumulados, para ajustar la configuración."""
+        with self._lock:
+            s = dict(self._stats)
+            s["histograma_lote"] = {f"<={k}": v for k, v in sorted(s["histograma_lote"].items())}
+        lotes, solicitudes = s["lotes"], s["solicitudes"]
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "lotes": lotes,
+            "solicitudes": solicitudes,
+            "lote_promedio": round(solicitudes / lotes, 2) if lotes else 0.0,
+            "max_lote": s["max_lote"],
+            "espera_promedio_ms": round(s["espera_total_ms"] / solicitudes, 3) if solicitudes else 0.0,
+            "max_espera_ms": round(s["max_espera_ms"], 3),
+            "histograma_lote": s["histograma_lote"],
+            "timeouts": s["timeouts"],
+            "reinicios": s["reinicios"],
+        }
@@ -0,0 +1,99 @@
+import operator
+from typing import Annotated
+import numpy as np
+from annotated_types import Ge, Gt, Le, Lt
+from pydantic import TypeAdapter, ValidationError
+from models import ClienteInput
+
+# Restricciones tal como están declaradas en ClienteInput: (tipo de error, atributo, comparación válida, mensaje)
+_COMPARACIONES = {
+    Ge: ("greater_than_equal", "ge", operator.ge, "greater than or equal to"),
+    Gt: ("greater_than",       "gt", operator.gt, "greater than"),
+    Le: ("less_than_equal",    "le", operator.le, "less than or equal to"),
+    Lt: ("less_than",          "lt", operator.lt, "less than"),
+}
+
+class _Campo:
+    """Tipo y límites de un campo de ClienteInput, para validar una columna entera."""
+
+    def __init__(self, nombre: str, info):
+        self.nombre  = nombre
+        self.entero  = info.annotation is int
+        self.limites = [
+            (*_COMPARACIONES[type(m)], getattr(m, _COMPARACIONES[type(m)][1]))
+            for m in info.metadata if type(m) in _COMPARACIONES
+        ]
+        # Validador de Pydantic para celdas que no son números (null, strings, objetos)
+        self.adaptador = TypeAdapter(Annotated[(info.annotation, *info.metadata)])
+
+    def _error_celda(self, fila: int, valor, error: dict) -> dict:
+        detalle = {"type": error["type"], "loc": ["body", self.nombre, fila],
+                   "msg": error["msg"], "input": valor}
+        if "ctx" in error:
+            detalle["ctx"] = error["ctx"]
+        return detalle
+
+    def _validar_celdas(self, valores: list) -> tuple[np.ndarray, list[dict]]:
+        """Camino lento, celda por celda con Pydantic (mismos mensajes que ClienteInput)."""
+        columna = np.zeros(len(valores), dtype=np.float64)
+        errores = []
+        for fila, valor in enumerate(valores):
+            try:
+                columna[fila] = self.adaptador.validate_python(valor)
+            except ValidationError as e:
+                errores.extend(self._error_celda(fila, valor, err) for err in e.errors())
+        return columna, errores
+
+    def validar(self, valores) -> tuple[np.ndarray, list[dict]]:
+        """Devuelve la columna en float64 y los errores por fila."""
+        try:
+            crudo = np.asarray(valores)
+        except ValueError:
+            crudo = None
+        if crudo is None or crudo.ndim != 1 or crudo.dtype.kind not in "biuf":
+            return self._validar_celdas(list(valores))
+
+        columna = crudo.astype(np.float64)
+        errores = {}
+        if self.entero and crudo.dtype.kind == "f":
+            for fila in np.flatnonzero(columna != np.floor(columna)).tolist():
+                errores[fila] = {"type": "int_from_float",
+                                 "msg": "Input should be a valid integer, got a number with a fractional part"}
+        for tipo, atributo, valido, texto, limite in self.limites:
+            for fila in np.flatnonzero(~valido(columna, limite)).tolist():
+                # Pydantic informa el primer error por celda: el de tipo antes que los límites
+                errores.setdefault(fila, {"type": tipo, "msg": f"Input should be {texto} {limite}",
+                                          "ctx": {atributo: limite}})
+        return columna, [self._error_celda(fila, crudo[fila].item(), errores[fila]) for fila in sorted(errores)]
+
+CAMPOS = [_Campo(nombre, info) for nombre, info in ClienteInput.model_fields.items()]
+
+def validar_columnas(datos: dict) -> tuple[np.ndarray, list[dict]]:
+    """
+    Valida un lote en formato columnar (`{"Age": [...], "Sex": [...], ...}`)
+    columna por columna con NumPy, usando los límites declarados en
+    ClienteInput. Devuelve la matriz (filas x features, en el orden de
+    ClienteInput) y los errores con el formato de Pydantic y `loc`
+    `["body", campo, fila]`. Si hay errores, la matriz no debe usarse.
+    """
+    faltantes = [c.nombre for c in CAMPOS if c.nombre not in datos]
+    if faltantes:
+        return np.empty((0, len(CAMPOS))), [
+            {"type": "missing", "loc": ["body", nombre], "msg": "Field required", "input": None}
+            for nombre in faltantes
+        ]
+    largos = {len(datos[c.nombre]) for c in CAMPOS}
+    if len(largos) > 1:
+        return np.empty((0, len(CAMPOS))), [{
+            "type": "value_error", "loc": ["body"], "input": None,
+            "msg": f"Todas las columnas deben tener el mismo largo (recibido: {sorted(largos)})",
+        }]
+    matriz = np.empty((largos.pop(), len(CAMPOS)), dtype=np.float64)
+    errores = []
+    for j, campo in enumerate(CAMPOS):
+        matriz[:, j], errores_campo = campo.validar(datos[campo.nombre])
+        errores.extend(errores_campo)
+    # Mismo orden que la validación por objetos: por fila y dentro de la fila por campo
+    orden = {c.nombre: j for j, c in enumerate(CAMPOS)}
+    errores.sort(key=lambda e: (e["loc"][2], orden[e["loc"][1]]))
+    return matriz, errores
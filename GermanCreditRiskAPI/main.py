@@ -1,14 +1,53 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from models import ClienteInput, PrediccionOutput, BatchPrediccionOutput
-from predict_logic import realizar_prediccion, model, MODEL_NAME, MODEL_ALIAS
+from fastapi.responses import PlainTextResponse
+from models import ClienteInput, PrediccionOutput, BatchPrediccionOutput, ExplicacionOutput, BatchExplicacionOutput
+import predict_logic
+from predict_logic import realizar_prediccion, realizar_prediccion_batch, filas_clientes, puntuar_filas, explicar_clientes, cache_predicciones, cache_explicaciones, cargador, auditoria, monitor_drift, pool_shards, MODEL_NAME, MODEL_ALIAS
+from coalescer import MicroBatcher, COALESCE_ENABLED
+from columnar import validar_columnas
+from streaming import puntuar_stream, formato_desde_content_type, RespuestaStreamBidireccional, STREAM_CHUNK_ROWS
+from serving.admission import MiddlewareAdmision, limitadores
+from serving import metrics
+from serving.profiling import MiddlewareProfiling, Perfilador, router_profiling
+from serving.respuestas import RespuestaLote
+from serving.prefork import estado_workers
+from serving.websocket import CanalPuntuacion
+from contextlib import asynccontextmanager
+import logging
 import uvicorn
 
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Carga del modelo en segundo plano: el servidor queda disponible de inmediato.
+    # Montada en el gateway (app.py de la raíz) no corre: el registro carga el modelo en el primer uso.
+    cargador.iniciar()
+    auditoria.iniciar()
+    yield
+    cargador.detener()
+    auditoria.detener()
+
 app = FastAPI(
     title="German Credit Risk API",
     description="API de predicción de riesgo crediticio — Maestría IA USA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=ciclo_de_vida
 )
+# Marca inicio y fin de cada handler para separar parseo, handler y serialización en /metrics
+app.router.route_class = metrics.RutaInstrumentada
+# Control de admisión por endpoint: concurrencia acotada, cola acotada (429) y deadline del cliente
+admision = limitadores(["/predict", "/predict/batch", "/predict/batch/columns", "/predict/stream",
+                        "/predict/explain", "/predict/explain/batch"])
+app.add_middleware(MiddlewareAdmision, limitadores=admision)
+# Profiling bajo pedido (X-Profile o /admin/profiles/arm) y muestreo opcional
+perfilador = Perfilador()
+app.add_middleware(MiddlewareProfiling, perfilador=perfilador)
+app.add_middleware(metrics.MiddlewareMetricas, api="german")
+app.include_router(router_profiling(perfilador))
+metrics.gauges_modelo(cargador)
+metrics.gauges_admision(admision)
+metrics.gauges_auditoria(auditoria)
+metrics.gauges_drift(monitor_drift)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -16,34 +55,170 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Coalescer opcional: agrupa solicitudes /predict concurrentes en un solo predict_proba
+coalescer = MicroBatcher(realizar_prediccion_batch) if COALESCE_ENABLED else None
+if coalescer is not None:
+    logging.info(f"Coalescer activo: max_batch={coalescer.max_batch}, max_wait_ms={coalescer.max_wait * 1000}")
+
 @app.post("/predict", response_model=PrediccionOutput)
 def predict(cliente: ClienteInput):
+    if coalescer is not None:
+        return coalescer.enviar(cliente)
     return realizar_prediccion(cliente)
 
+# Los endpoints batch devuelven las filas ya codificadas (RespuestaLote) en lugar
+# de un BatchPrediccionOutput: mismos bytes, sin validar ni serializar cada fila
+CAMPOS_FLOAT = ("probability_good", "probability_bad")
+
 @app.post("/predict/batch", response_model=BatchPrediccionOutput)
 def predict_batch(clientes: list[ClienteInput]):
+    metrics.observar_lote(len(clientes))
     try:
-        resultados = [realizar_prediccion(c) for c in clientes]
-        return BatchPrediccionOutput(total=len(resultados), predicciones=resultados)
+        filas = filas_clientes(clientes)
+        with metrics.etapa("codificacion"):
+            return RespuestaLote(filas, CAMPOS_FLOAT)
     except HTTPException as e:
         raise e
     except Exception as e:
-        import logging
         logging.error(f"Error en predicción batch: {e}")
         raise HTTPException(status_code=500, detail="Error interno en la predicción batch")
 
+@app.post("/predict/batch/columns", response_model=BatchPrediccionOutput)
+def predict_batch_columns(datos: dict[str, list] = Body(..., examples=[{
+    "Age": [35, 52], "Sex": [1, 0], "Job": [2, 1], "Housing": [1, 2], "Saving_accounts": [1, 0],
+    "Checking_account": [1, 3], "Credit_amount": [1500.0, 7200.0], "Duration": [12, 36], "Purpose": [4, 1],
+}])):
+    """
+    Lote en formato columnar: un arreglo por feature. Se valida columna por
+    columna con NumPy (mismos límites y mensajes que ClienteInput, 422 con
+    `loc` = campo y fila) y la matriz pasa directo al modelo.
+    """
+    with metrics.etapa("validacion_columnar"):
+        X, errores = validar_columnas(datos)
+    metrics.observar_lote(len(X))
+    if errores:
+        raise HTTPException(status_code=422, detail=errores)
+    try:
+        filas = puntuar_filas(X)
+        with metrics.etapa("codificacion"):
+            return RespuestaLote(filas, CAMPOS_FLOAT)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Error en predicción batch columnar: {e}")
+        raise HTTPException(status_code=500, detail="Error interno en la predicción batch")
+
+@app.post("/predict/explain", response_model=ExplicacionOutput)
+def predict_explain(cliente: ClienteInput):
+    """
+    Predicción con la contribución de cada feature (TreeSHAP nativo de
+    XGBoost) en log-odds hacia "good": las negativas empujan hacia el rechazo.
+    """
+    return explicar_clientes([cliente])[0]
+
+@app.post("/predict/explain/batch", response_model=BatchExplicacionOutput)
+def predict_explain_batch(clientes: list[ClienteInput]):
+    """Contribuciones de todo el lote en una sola llamada al booster."""
+    metrics.observar_lote(len(clientes))
+    try:
+        filas = explicar_clientes(clientes)
+        with metrics.etapa("codificacion"):
+            # Las contribuciones van redondeadas a 4 decimales: orjson las escribe igual que json
+            return RespuestaLote(filas, CAMPOS_FLOAT)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Error en explicación batch: {e}")
+        raise HTTPException(status_code=500, detail="Error interno en la explicación batch")
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request, chunk_size: int = Query(STREAM_CHUNK_ROWS, ge=1, le=100_000)):
+    """
+    Puntuación masiva en streaming. El cuerpo es NDJSON (un ClienteInput por
+    línea) o CSV con encabezado (`Content-Type: text/csv`). Se procesa en
+    bloques de `chunk_size` filas y la respuesta es NDJSON con una línea por
+    fila (`row` + predicción o `error`) y una línea final con el total.
+    """
+    if predict_logic.modelo_activo()[0] is None:
+        raise HTTPException(status_code=503, detail="Modelo no disponible")
+    formato = formato_desde_content_type(request.headers.get("content-type"))
+    return RespuestaStreamBidireccional(
+        puntuar_stream(request.stream(), formato, chunk_size),
+        media_type="application/x-ndjson"
+    )
+
+# Canal WebSocket para clientes internos: frames con id de correlación, agrupados entre sí
+canal_ws = CanalPuntuacion("german", ClienteInput, filas_clientes)
+
+@app.websocket("/predict/ws")
+async def predict_ws(websocket: WebSocket):
+    """
+    Puntuación por una conexión persistente. Cada frame es
+    `{"id": ..., "input": ClienteInput}` o `{"id": ..., "inputs": [...]}` y se
+    responde con `{"id": ..., "result": ...}`, `{"id": ..., "results": [...]}`
+    o `{"id": ..., "error": ...}`, no necesariamente en orden de llegada.
+    """
+    await canal_ws.atender(websocket)
+
 @app.get("/")
 def root():
     return {
         "api":    "German Credit Risk API",
         "version": "1.0.0",
         "model":  f"{MODEL_NAME}@{MODEL_ALIAS}",
+        "model_version": cargador.version,
+        "last_swap": cargador.ultimo_cambio,
         "status": "running"
     }
 
 @app.get("/health")
 def health():
-    return {"status": "healthy", "model_loaded": model is not None}
+    estado = {
+        "status": "healthy",
+        "model_loaded": predict_logic.model is not None,
+        "model": cargador.estado(),
+        "cache": cache_predicciones.estadisticas(),
+        "explain_cache": cache_explicaciones.estadisticas(),
+    }
+    estado["admission"] = {ruta: l.estadisticas() for ruta, l in admision.items()}
+    estado["audit"] = auditoria.estadisticas()
+    estado["websocket"] = canal_ws.estadisticas()
+    if coalescer is not None:
+        estado["coalescer"] = coalescer.estadisticas()
+    if pool_shards.activo:
+        estado["shards"] = pool_shards.estadisticas()
+    # Servida con serving/prefork.py: estado agregado de todos los workers
+    workers = estado_workers()
+    if workers is not None:
+        estado["workers"] = workers
+    return estado
+
+@app.get("/drift")
+def drift():
+    """
+    Drift de cada feature y de probability_good contra el perfil de referencia
+    del modelo activo: PSI y KS de las últimas filas puntuadas (ventana en
+    curso y anterior) y acumulados desde que se cargó la versión.
+    """
+    return monitor_drift.reporte()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metricas():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.registro.exportar(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+def liveness():
+    """El proceso responde; no depende del modelo."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness(response: Response):
+    """Listo para recibir tráfico solo cuando el modelo terminó de cargar."""
+    listo = predict_logic.model is not None
+    if not listo:
+        response.status_code = 503
+    return {"ready": listo, "model": cargador.estado()}
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
@@ -20,3 +20,12 @@ class PrediccionOutput(BaseModel):
 class BatchPrediccionOutput(BaseModel):
     total: int
     predicciones: list[PrediccionOutput]
+
+class ExplicacionOutput(PrediccionOutput):
+    # Contribuciones en log-odds hacia "good": base_value + suma = logit(probability_good)
+    base_value:    float
+    contributions: dict[str, float]
+
+class BatchExplicacionOutput(BaseModel):
+    total: int
+    predicciones: list[ExplicacionOutput]
@@ -1,46 +1,482 @@
-import mlflow
-import mlflow.sklearn
-import pandas as pd
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
 import logging
 from fastapi import HTTPException
 from models import ClienteInput, PrediccionOutput
 
+# Paquete compartido serving/ en la raíz del repositorio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.tree_engine import EnsambleCompilado, compilar_modelo, indexar_umbrales
+from serving.model_store import CargadorModelo
+from serving.metrics import etapa, ruta_actual
+from serving.audit import Auditoria, esquema_auditoria
+from serving.drift import MonitorDrift, cargar_perfil, filtrar_perfil
+from serving.slim import MODEL_SLIM_DIR
+from serving.sharding import PoolShards
+
 MLFLOW_TRACKING_URI = "http://44.211.88.225:5000"
 MODEL_NAME          = "GermanCreditRisk-XGBoost"
 MODEL_ALIAS         = "production"
-mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+# "sklearn": modelo MLflow tal cual; "native": ensamble compilado en NumPy
+INFERENCE_ENGINE    = os.getenv("INFERENCE_ENGINE", "sklearn")
+# Por encima de este tamaño de lote el predictor C++ de XGBoost es más rápido
+NATIVE_MAX_ROWS     = int(os.getenv("NATIVE_MAX_ROWS", "256"))
+# Cache de predicciones: 0 entradas la desactiva; TTL 0 = sin expiración
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL  = float(os.getenv("PREDICTION_CACHE_TTL", "0"))
+# Cache de contribuciones de /predict/explain (mismo TTL); 0 entradas la desactiva
+EXPLAIN_CACHE_SIZE    = int(os.getenv("EXPLAIN_CACHE_SIZE", "0"))
+# Con artefactos ligeros (MODEL_SLIM_DIR, ver serving/slim.py) el proceso no
+# importa MLflow, pandas ni XGBoost: pandas y XGBoost se importan recién donde
+# hacen falta (modelo MLflow, contribuciones).
+if not MODEL_SLIM_DIR:
+    import mlflow
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
-try:
-    logging.info(f"Cargando modelo {MODEL_NAME}@{MODEL_ALIAS}...")
-    model = mlflow.sklearn.load_model(f"models:/{MODEL_NAME}@{MODEL_ALIAS}")
-    logging.info("Modelo cargado correctamente")
-except Exception as e:
-    logging.error(f"Error cargando el modelo: {e}")
-    model = None
+
+# El modelo se publica desde el hilo de carga en segundo plano (ver activar_modelo).
+# Se leen y reemplazan juntos bajo _lock_modelo para que cada solicitud use una
+# sola versión de principio a fin.
+model         = None
+engine        = None
+MODEL_VERSION = None
+_lock_modelo  = threading.Lock()
+
+def modelo_activo():
+    """Instantánea consistente de (modelo, motor nativo, versión)."""
+    with _lock_modelo:
+        return model, engine, MODEL_VERSION
+
+def preparar_motor(modelo):
+    """Compila el modelo a arreglos NumPy si INFERENCE_ENGINE=native; None si no aplica."""
+    if isinstance(modelo, EnsambleCompilado):
+        return modelo   # artefacto ligero: el modelo ya es el motor nativo
+    if modelo is None or INFERENCE_ENGINE != "native":
+        return None
+    try:
+        motor = compilar_modelo(modelo)
+        logging.info("Motor nativo de árboles compilado")
+        return motor
+    except Exception as e:
+        logging.warning(f"Motor nativo no disponible, se usa el modelo MLflow: {e}")
+        return None
+
+# Orden y tipos de las features tal como se entrenó el modelo
+FEATURES = list(ClienteInput.model_fields)
+TIPOS_FEATURES = {f: np.int64 if info.annotation is int else np.float64
+                  for f, info in ClienteInput.model_fields.items()}
+# Columnas que observa el monitor de drift; las demás del perfil se descartan
+COLUMNAS_DRIFT = FEATURES + ["probability_good"]
+
+# Índice 0: alto riesgo, 1: riesgo moderado, 2: bajo riesgo
+RECOMENDACIONES = np.array([
+    "Rechazar credito — alto riesgo",
+    "Revisar manualmente — riesgo moderado",
+    "Aprobar credito — bajo riesgo",
+], dtype=object)
+# Índice 0: argmax en la clase mala, 1: en la buena
+RIESGOS = np.array(["bad", "good"], dtype=object)
+
+class CachePredicciones:
+    """
+    Cache LRU acotada de predicciones, con TTL opcional y deduplicación en vuelo.
+
+    Se invalida completa cuando cambia el modelo o su versión (`sincronizar`).
+    Si una clave ya se está calculando, las solicitudes idénticas esperan ese
+    resultado en lugar de volver a llamar al modelo.
+    """
+
+    def __init__(self, max_entradas: int, ttl_segundos: float = 0):
+        self.max_entradas = max_entradas
+        self.ttl          = ttl_segundos
+        self._datos       = OrderedDict()   # clave -> (resultado, expira)
+        self._en_vuelo    = {}              # clave -> Future
+        self._lock        = threading.Lock()
+        self._modelo      = None
+        self._version     = None
+        self._generacion  = 0
+        self.hits = self.misses = self.evictions = 0
+        self.expiraciones = self.deduplicadas = self.invalidaciones = 0
+
+    @property
+    def activa(self) -> bool:
+        return self.max_entradas > 0
+
+    def sincronizar(self, modelo, version):
+        """Vacía la cache si el modelo cargado ya no es con el que se llenó."""
+        with self._lock:
+            if modelo is self._modelo and version == self._version:
+                return
+            if self._datos or self._en_vuelo:
+                self.invalidaciones += 1
+            self._datos.clear()
+            self._en_vuelo.clear()
+            self._modelo, self._version = modelo, version
+            self._generacion += 1
+
+    def _buscar(self, clave, ahora):
+        # Debe llamarse con el lock tomado
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            return None
+        resultado, expira = entrada
+        if expira is not None and expira <= ahora:
+            del self._datos[clave]
+            self.expiraciones += 1
+            return None
+        self._datos.move_to_end(clave)
+        self.hits += 1
+        return resultado
+
+    def _guardar(self, clave, resultado, generacion):
+        # Debe llamarse con el lock tomado
+        if generacion != self._generacion:
+            return
+        expira = time.monotonic() + self.ttl if self.ttl > 0 else None
+        self._datos[clave] = (resultado, expira)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+            self.evictions += 1
+
+    def obtener(self, clave, calcular):
+        """Devuelve el resultado cacheado o lo calcula una sola vez para todos los que lo piden."""
+        with self._lock:
+            resultado = self._buscar(clave, time.monotonic())
+            if resultado is not None:
+                return resultado
+            futuro = self._en_vuelo.get(clave)
+            en_curso = futuro is not None
+            if en_curso:
+                self.deduplicadas += 1
+            else:
+                futuro = self._en_vuelo[clave] = Future()
+                generacion = self._generacion
+                self.misses += 1
+        if en_curso:
+            return futuro.result()
+        try:
+            resultado = calcular()
+        except Exception as e:
+            with self._lock:
+                if self._en_vuelo.get(clave) is futuro:
+                    del self._en_vuelo[clave]
+            futuro.set_exception(e)
+            raise
+        with self._lock:
+            self._guardar(clave, resultado, generacion)
+            if self._en_vuelo.get(clave) is futuro:
+                del self._en_vuelo[clave]
+        futuro.set_result(resultado)
+        return resultado
+
+    def obtener_lote(self, claves: list, calcular_lote) -> list:
+        """Resuelve un lote: aciertos desde la cache y las claves faltantes (sin repetir) en una sola llamada."""
+        resultados = [None] * len(claves)
+        faltantes  = {}   # clave -> índices del lote
+        with self._lock:
+            ahora = time.monotonic()
+            for i, clave in enumerate(claves):
+                if clave in faltantes:
+                    faltantes[clave].append(i)
+                    continue
+                resultado = self._buscar(clave, ahora)
+                if resultado is None:
+                    faltantes[clave] = [i]
+                    self.misses += 1
+                else:
+                    resultados[i] = resultado
+            generacion = self._generacion
+        if faltantes:
+            calculados = calcular_lote([indices[0] for indices in faltantes.values()])
+            with self._lock:
+                for (clave, indices), resultado in zip(faltantes.items(), calculados):
+                    self._guardar(clave, resultado, generacion)
+                    for i in indices:
+                        resultados[i] = resultado
+        return resultados
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "activa": self.activa,
+                "version_modelo": self._version,
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expiraciones": self.expiraciones,
+                "deduplicadas": self.deduplicadas,
+                "invalidaciones": self.invalidaciones,
+            }
+
+cache_predicciones = CachePredicciones(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+# Las contribuciones de TreeSHAP solo dependen del camino por cada árbol: las
+# claves por bins de umbrales de claves_cache también valen para esta cache.
+cache_explicaciones = CachePredicciones(EXPLAIN_CACHE_SIZE, PREDICTION_CACHE_TTL)
+
+# Registro de auditoría de cada cliente puntuado (apagado sin AUDIT_DIR); lo inicia main.py
+auditoria = Auditoria("german", esquema_auditoria(ClienteInput, PrediccionOutput))
+# Drift de las features y de probability_good contra el perfil de referencia del modelo
+monitor_drift = MonitorDrift("german", observadas=COLUMNAS_DRIFT)
+
+# Lotes de al menos SHARD_MIN_ROWS filas se reparten entre procesos (serving/sharding.py)
+pool_shards = PoolShards("german")
+
+# Índices de umbrales de los dos últimos modelos (el activo y el saliente durante un cambio)
+_indices = OrderedDict()   # id(modelo) -> (modelo, índice)
+_lock_indices = threading.Lock()
+
+def indice_umbrales(modelo):
+    """Índice de umbrales de split del modelo; se construye una vez por modelo."""
+    with _lock_indices:
+        entrada = _indices.get(id(modelo))
+        if entrada is not None and entrada[0] is modelo:
+            return entrada[1]
+    indice = None
+    try:
+        indice = indexar_umbrales(modelo)
+        logging.info(f"Índice de umbrales construido: {indice.total_bins} bins")
+    except Exception as e:
+        logging.warning(f"Índice de umbrales no disponible, la cache usa features crudas: {e}")
+    with _lock_indices:
+        _indices[id(modelo)] = (modelo, indice)
+        while len(_indices) > 2:
+            _indices.popitem(last=False)
+    return indice
+
+def claves_cache(X: np.ndarray, modelo, version) -> list[tuple]:
+    """
+    Clave de cache por fila: versión del modelo más el vector de bins de
+    umbrales, de modo que los clientes que caen en las mismas hojas comparten
+    resultado. Sin índice se usa la tupla de features.
+    """
+    indice = indice_umbrales(modelo)
+    if indice is None:
+        return [(version, fila) for fila in map(tuple, X.tolist())]
+    return [(version, clave) for clave in indice.claves(_columnas(X, indice.feature_names))]
+
+def matriz_clientes(clientes: list[ClienteInput]) -> np.ndarray:
+    """Matriz float64 filas x features (orden de FEATURES) para todo el lote."""
+    return np.array([[getattr(c, f) for f in FEATURES] for c in clientes], dtype=np.float64).reshape(-1, len(FEATURES))
+
+def _columnas(X: np.ndarray, nombres) -> np.ndarray:
+    """Reordena las columnas si el modelo se entrenó con otro orden de features."""
+    if not nombres or list(nombres) == FEATURES:
+        return X
+    return X[:, [FEATURES.index(f) for f in nombres]]
+
+def construir_matriz(X: np.ndarray):
+    """DataFrame con los nombres y tipos de ClienteInput, como se entrenó el modelo."""
+    import pandas as pd
+    return pd.DataFrame({f: X[:, j].astype(TIPOS_FEATURES[f]) for j, f in enumerate(FEATURES)})
+
+def _probabilidades(X: np.ndarray, modelo, motor) -> np.ndarray:
+    if motor is not None and pool_shards.aplica(len(X)):
+        return pool_shards.predict_proba(motor, _columnas(X, motor.feature_names))
+    if motor is not None and (motor is modelo or len(X) <= NATIVE_MAX_ROWS):
+        return motor.predict_proba(_columnas(X, motor.feature_names))
+    return modelo.predict_proba(construir_matriz(X))
+
+def reglas_negocio(proba: np.ndarray) -> dict[str, list]:
+    """
+    Riesgo, probabilidades redondeadas y recomendación a partir de predict_proba.
+    Única definición de las reglas: la usan la API y el scoring offline.
+    """
+    proba     = np.asarray(proba, dtype=np.float64)
+    prob_good = proba[:, 1]
+    nivel     = (prob_good >= 0.50).astype(np.int8) + (prob_good >= 0.75)
+    return {
+        "risk": RIESGOS[(proba.argmax(axis=1) == 1).astype(np.int8)].tolist(),
+        "probability_good": [round(p, 4) for p in prob_good.tolist()],
+        "probability_bad": [round(p, 4) for p in proba[:, 0].tolist()],
+        "recommendation": RECOMENDACIONES[nivel].tolist(),
+    }
+
+def _puntuar(X: np.ndarray, modelo, motor) -> list[dict]:
+    # Una sola llamada al modelo: la clase se deriva de las probabilidades.
+    # Las filas son dicts con las claves de PrediccionOutput; risk y
+    # recommendation apuntan a los mismos str de RIESGOS y RECOMENDACIONES.
+    with etapa("modelo"):
+        proba = _probabilidades(X, modelo, motor)
+    with etapa("reglas"):
+        r = reglas_negocio(proba)
+        return [
+            {"risk": risk, "probability_good": pg, "probability_bad": pb, "recommendation": rec}
+            for risk, pg, pb, rec in zip(r["risk"], r["probability_good"],
+                                         r["probability_bad"], r["recommendation"])
+        ]
 
 def realizar_prediccion(cliente: ClienteInput) -> PrediccionOutput:
-    if model is None:
+    with etapa("matriz"):
+        X = matriz_clientes([cliente])
+    return PrediccionOutput(**puntuar_filas(X)[0])
+
+def realizar_prediccion_batch(clientes: list[ClienteInput]) -> list[PrediccionOutput]:
+    """Puntúa todo el lote con una sola llamada a predict_proba."""
+    return [PrediccionOutput(**f) for f in filas_clientes(clientes)]
+
+def filas_clientes(clientes: list[ClienteInput]) -> list[dict]:
+    """Como realizar_prediccion_batch, pero devuelve las filas sin crear un PrediccionOutput por fila."""
+    if not clientes:
+        return []
+    with etapa("matriz"):
+        X = matriz_clientes(clientes)
+    return puntuar_filas(X)
+
+def _instantanea_cargada() -> tuple:
+    instantanea = modelo_activo()
+    if instantanea[0] is None:
         logging.error("Modelo no cargado")
         raise HTTPException(status_code=503, detail="Modelo no disponible")
+    return instantanea
+
+def puntuar_filas(X: np.ndarray, instantanea: tuple | None = None) -> list[dict]:
+    """
+    Puntúa una matriz ya validada (filas x FEATURES). Es el camino común de
+    /predict, /predict/batch y el formato columnar, que llega aquí sin crear
+    un ClienteInput por fila. Devuelve una fila por cliente (dict con las
+    claves de PrediccionOutput) que los endpoints batch serializan directo.
+    La cache comparte estas filas entre solicitudes y no deben modificarse.
+    `instantanea` fija el (modelo, motor, versión) a usar; por defecto, el activo.
+    """
+    if len(X) == 0:
+        return []
+    modelo, motor, version = instantanea or _instantanea_cargada()
     try:
-        data  = pd.DataFrame([cliente.model_dump()])
-        pred  = model.predict(data)[0]
-        proba = model.predict_proba(data)[0]
-        risk      = "good" if pred == 1 else "bad"
-        prob_good = float(proba[1])
-        prob_bad  = float(proba[0])
-        if prob_good >= 0.75:
-            recommendation = "Aprobar credito — bajo riesgo"
-        elif prob_good >= 0.50:
-            recommendation = "Revisar manualmente — riesgo moderado"
+        if not cache_predicciones.activa:
+            filas = _puntuar(X, modelo, motor)
+        elif len(X) == 1:
+            cache_predicciones.sincronizar(modelo, version)
+            filas = [cache_predicciones.obtener(
+                claves_cache(X, modelo, version)[0], lambda: _puntuar(X, modelo, motor)[0]
+            )]
         else:
-            recommendation = "Rechazar credito — alto riesgo"
-        return PrediccionOutput(
-            risk=risk,
-            probability_good=round(prob_good, 4),
-            probability_bad=round(prob_bad, 4),
-            recommendation=recommendation
-        )
+            cache_predicciones.sincronizar(modelo, version)
+            filas = cache_predicciones.obtener_lote(
+                claves_cache(X, modelo, version),
+                lambda indices: _puntuar(X[indices], modelo, motor)
+            )
     except Exception as e:
         logging.error(f"Error en predicción: {e}")
         raise HTTPException(status_code=500, detail="Error interno en la predicción")
+    # El monitoreo nunca hace fallar la predicción: un error se registra y la respuesta sale igual
+    try:
+        if auditoria.activa:
+            auditoria.registrar(len(X), time.time(), version, ruta_actual(), dict(zip(FEATURES, X.T)), filas)
+        if monitor_drift.activo:
+            valores = dict(zip(FEATURES, X.T))
+            valores["probability_good"] = [f["probability_good"] for f in filas]
+            monitor_drift.observar(valores, len(X))
+    except Exception as e:
+        logging.error(f"Error en auditoría o drift: {e}")
+    return filas
+
+def _contribuciones(X: np.ndarray, modelo) -> list[tuple[float, dict]]:
+    # Una sola llamada al booster cargado (get_booster no lo copia) para todo el lote
+    import xgboost as xgb
+    booster = modelo.get_booster()
+    nombres = booster.feature_names or FEATURES
+    with etapa("contribuciones"):
+        matriz = xgb.DMatrix(_columnas(X, booster.feature_names), feature_names=booster.feature_names,
+                             feature_types=booster.feature_types)
+        contrib = booster.predict(matriz, pred_contribs=True)
+    if contrib.ndim == 3:
+        contrib = contrib[:, 1, :]   # multiclase: contribuciones hacia la clase buena
+    orden = [nombres.index(f) for f in FEATURES] + [len(nombres)]
+    with etapa("reglas"):
+        valores = np.round(contrib[:, orden].astype(np.float64), 4).tolist()
+        return [(fila[-1], dict(zip(FEATURES, fila))) for fila in valores]
+
+def explicar_filas(X: np.ndarray) -> list[dict]:
+    """
+    Predicción más la contribución de cada feature (TreeSHAP nativo de
+    XGBoost, `pred_contribs`), en log-odds hacia "good": `base_value` más
+    la suma de las contribuciones da el logit de probability_good. Todo el
+    lote se resuelve con una llamada al booster y la misma versión del
+    modelo que la predicción.
+    """
+    if len(X) == 0:
+        return []
+    instantanea = _instantanea_cargada()
+    modelo, _, version = instantanea
+    if not hasattr(modelo, "get_booster"):
+        raise HTTPException(status_code=501, detail="El modelo activo no tiene contribuciones nativas")
+    filas = puntuar_filas(X, instantanea)
+    try:
+        if not cache_explicaciones.activa:
+            explicaciones = _contribuciones(X, modelo)
+        else:
+            cache_explicaciones.sincronizar(modelo, version)
+            explicaciones = cache_explicaciones.obtener_lote(
+                claves_cache(X, modelo, version), lambda indices: _contribuciones(X[indices], modelo)
+            )
+    except Exception as e:
+        logging.error(f"Error calculando contribuciones: {e}")
+        raise HTTPException(status_code=500, detail="Error interno en la explicación")
+    return [{**fila, "base_value": base, "contributions": contribuciones}
+            for fila, (base, contribuciones) in zip(filas, explicaciones)]
+
+def explicar_clientes(clientes: list[ClienteInput]) -> list[dict]:
+    with etapa("matriz"):
+        X = matriz_clientes(clientes)
+    return explicar_filas(X)
+
+# Entradas representativas para calentar un modelo nuevo antes de publicarlo
+EJEMPLOS_CALENTAMIENTO = [
+    ClienteInput(Age=age, Sex=sex, Job=job, Housing=housing, Saving_accounts=ahorro,
+                 Checking_account=cuenta, Credit_amount=monto, Duration=duracion, Purpose=proposito)
+    for age, sex, job, housing, ahorro, cuenta, monto, duracion, proposito in [
+        (22, 0, 1, 0, 0, 0,   700.0,  6, 0),
+        (35, 1, 2, 1, 1, 1,  1500.0, 12, 4),
+        (45, 1, 3, 2, 2, 2,  4500.0, 24, 2),
+        (60, 0, 2, 1, 4, 3, 12000.0, 48, 7),
+    ]
+]
+
+def activar_modelo(nuevo, version: str):
+    """
+    Prepara un modelo recién cargado (motor nativo, índice de umbrales y
+    calentamiento) y solo entonces lo publica de forma atómica. Las
+    solicitudes en curso terminan con la instantánea que ya tomaron.
+    """
+    global model, engine, MODEL_VERSION
+    motor = preparar_motor(nuevo)
+    indice_umbrales(nuevo)
+    X = matriz_clientes(EJEMPLOS_CALENTAMIENTO)
+    _puntuar(X, nuevo, motor)
+    if motor is not None and motor is not nuevo:
+        _puntuar(X, nuevo, None)
+    pool_shards.publicar(motor)
+    with _lock_modelo:
+        model, engine, MODEL_VERSION = nuevo, motor, version
+    cache_predicciones.sincronizar(nuevo, version)
+    cache_explicaciones.sincronizar(nuevo, version)
+
+def leer_perfil_drift(ruta: str, version: str):
+    """Referencia de drift de la versión: su drift_reference.json o, si no trae, DRIFT_REFERENCE_FILE."""
+    monitor_drift.fijar_referencia(filtrar_perfil(cargar_perfil(ruta), COLUMNAS_DRIFT, "german"), version)
+
+def descargar_modelo():
+    """Retira el modelo publicado y lo que depende de él (cache e índice de umbrales)."""
+    global model, engine, MODEL_VERSION
+    with _lock_modelo:
+        model, engine, MODEL_VERSION = None, None, None
+    cache_predicciones.sincronizar(None, None)
+    cache_explicaciones.sincronizar(None, None)
+    with _lock_indices:
+        _indices.clear()
+    pool_shards.retirar()
+
+# Carga no bloqueante (la inicia main.py al arrancar, o el registro del gateway en
+# el primer uso): el servidor responde 503 en /predict mientras el modelo se carga
+# y después un vigilante cambia de versión sin reiniciar.
+cargador = CargadorModelo(MODEL_NAME, MODEL_ALIAS, activar_modelo, al_descargar=descargar_modelo,
+                          al_leer_artefacto=leer_perfil_drift)
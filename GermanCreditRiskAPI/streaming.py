@@ -0,0 +1,139 @@
+import io
+import os
+import csv
+import json
+import logging
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from models import ClienteInput
+from predict_logic import filas_clientes
+from serving.metrics import observar_lote
+
+# Filas por bloque: fija la memoria pico del endpoint /predict/stream
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+
+class RespuestaStreamBidireccional(StreamingResponse):
+    """
+    StreamingResponse que no escucha `http.disconnect` en paralelo.
+
+    La respuesta se emite mientras todavía se lee el cuerpo de la solicitud;
+    el listener de desconexión de Starlette consumiría esos mensajes del
+    cuerpo. Una desconexión igual se detecta al leer `request.stream()`.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+def formato_desde_content_type(content_type: str | None) -> str:
+    """'csv' para text/csv; cualquier otro tipo se lee como NDJSON."""
+    return "csv" if content_type and "csv" in content_type.lower() else "ndjson"
+
+def describir_error(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in err['loc']) or 'fila'}: {err['msg']}" for err in e.errors()
+        )
+    return str(e)
+
+BOM = b"\xef\xbb\xbf"
+
+async def _lineas(stream, formato: str):
+    """
+    Parte el cuerpo en registros crudos (bytes) a medida que llegan. En CSV un
+    campo entre comillas puede tener saltos de línea: mientras las comillas
+    de un registro no cierren, la línea siguiente es parte del mismo registro.
+    Acá solo se cortan bytes; decodificar y validar se hace en el threadpool.
+    """
+    resto = b""
+    abierto = b""
+    async for bloque in stream:
+        resto += bloque
+        *lineas, resto = resto.split(b"\n")
+        for linea in lineas:
+            if formato == "csv":
+                abierto += linea
+                # Las comillas escapadas ("") no cambian la paridad
+                if abierto.count(b'"') % 2:
+                    abierto += b"\n"
+                    continue
+                linea, abierto = abierto, b""
+            yield linea
+    if abierto or resto:
+        yield abierto + resto
+
+def _registro(crudo: bytes, formato: str, encabezado: list | None):
+    """dict de una fila, o la excepción que describe por qué no se pudo leer."""
+    try:
+        linea = crudo.decode("utf-8")
+        if formato == "csv":
+            valores = next(csv.reader(io.StringIO(linea)))
+            if len(valores) != len(encabezado):
+                raise ValueError(f"se esperaban {len(encabezado)} columnas y llegaron {len(valores)}")
+            return ClienteInput.model_validate(dict(zip(encabezado, valores)))
+        registro = json.loads(linea)
+        if not isinstance(registro, dict):
+            raise ValueError("cada línea debe ser un objeto JSON")
+        return ClienteInput.model_validate(registro)
+    except Exception as e:
+        return e
+
+def _linea(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+def _puntuar_bloque(bloque: list, formato: str, encabezado: list | None) -> tuple[bytes, int]:
+    """
+    Lee, valida y puntúa un bloque de registros crudos con una sola llamada
+    al modelo. Corre en el threadpool: el event loop solo corta bytes.
+    Devuelve las líneas NDJSON en orden y la cantidad de filas inválidas.
+    """
+    registros = [(fila, _registro(crudo, formato, encabezado)) for fila, crudo in bloque]
+    validos = [(fila, c) for fila, c in registros if isinstance(c, ClienteInput)]
+    observar_lote(len(validos))
+    resultados = filas_clientes([c for _, c in validos])
+    por_fila = {fila: r for (fila, _), r in zip(validos, resultados)}
+    salida = []
+    for fila, c in registros:
+        if fila in por_fila:
+            salida.append(_linea({"row": fila, **por_fila[fila]}))
+        else:
+            salida.append(_linea({"row": fila, "error": describir_error(c)}))
+    return b"".join(salida), len(registros) - len(validos)
+
+async def puntuar_stream(stream, formato: str, tamano_bloque: int = STREAM_CHUNK_ROWS):
+    """
+    Lee el cuerpo en bloques de `tamano_bloque` filas y emite NDJSON a medida
+    que cada bloque termina. Las filas inválidas se informan en línea con su
+    número sin cortar el stream; la última línea resume el total.
+    """
+    total = errores = 0
+    encabezado = None
+    primera = True
+    bloque = []
+    try:
+        async for crudo in _lineas(stream, formato):
+            if primera and crudo.startswith(BOM):
+                crudo = crudo[len(BOM):]
+            primera = False
+            if not crudo.strip():
+                continue
+            if formato == "csv" and encabezado is None:
+                encabezado = next(csv.reader(io.StringIO(crudo.strip().decode("utf-8"))))
+                continue
+            total += 1
+            bloque.append((total, crudo.strip()))
+            if len(bloque) >= tamano_bloque:
+                salida, invalidas = await run_in_threadpool(_puntuar_bloque, bloque, formato, encabezado)
+                errores += invalidas
+                yield salida
+                bloque = []
+        if bloque:
+            salida, invalidas = await run_in_threadpool(_puntuar_bloque, bloque, formato, encabezado)
+            errores += invalidas
+            yield salida
+    except Exception as e:
+        detalle = getattr(e, "detail", None) or "Error interno en la predicción"
+        logging.error(f"Error en predicción stream: {e}")
+        yield _linea({"error": detalle, "filas_procesadas": total - len(bloque)})
+        return
+    yield _linea({"total": total, "errores": errores})
@@ -1,9 +1,50 @@
+import os
+import sys
+import json
+import threading
+import time
+import mlflow.sklearn
+import numpy as np
+import pandas as pd
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from xgboost import XGBClassifier
+import main
+import predict_logic
+from coalescer import MicroBatcher
+from serving.tree_engine import compilar_modelo, indexar_umbrales
+from serving.model_store import AlmacenModelos, CargadorModelo, checksum_directorio
 from main import app
 from models import ClienteInput
+from predict_logic import CachePredicciones
 
 client = TestClient(app)
+FEATURES_IDX = {f: i for i, f in enumerate(ClienteInput.model_fields)}
+
+def _clientes_sinteticos(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Age":              rng.integers(18, 101, n),
+        "Sex":              rng.integers(0, 2, n),
+        "Job":              rng.integers(0, 4, n),
+        "Housing":          rng.integers(0, 3, n),
+        "Saving_accounts":  rng.integers(0, 5, n),
+        "Checking_account": rng.integers(0, 4, n),
+        "Credit_amount":    rng.uniform(250, 20000, n).round(2),
+        "Duration":         rng.integers(4, 73, n),
+        "Purpose":          rng.integers(0, 8, n),
+    })
+
+@pytest.fixture
+def modelo_local(monkeypatch):
+    """Modelo XGBoost entrenado localmente con el mismo esquema que ClienteInput."""
+    X = _clientes_sinteticos(500)
+    y = ((X["Checking_account"] >= 2) | (X["Credit_amount"] < 4000)).astype(int)
+    modelo = XGBClassifier(n_estimators=20, max_depth=4, random_state=42)
+    modelo.fit(X, y)
+    monkeypatch.setattr(predict_logic, "model", modelo)
+    return modelo
 
 def test_root():
     response = client.get("/")
@@ -59,3 +100,721 @@ def test_predict_batch_valid():
         assert isinstance(data["predicciones"], list)
     else:
         assert response.json()["detail"] == "Modelo no disponible"
+
+def test_predict_batch_vectorizado_igual_a_individual(modelo_local):
+    payload = _clientes_sinteticos(50, seed=1).to_dict(orient="records")
+    response = client.post("/predict/batch", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 50
+    individuales = [client.post("/predict", json=p).json() for p in payload]
+    assert data["predicciones"] == individuales
+
+def test_predict_risk_coincide_con_model_predict(modelo_local):
+    X = _clientes_sinteticos(50, seed=2)
+    resultados = predict_logic.realizar_prediccion_batch(
+        [ClienteInput(**r) for r in X.to_dict(orient="records")])
+    esperado = np.where(modelo_local.predict(X) == 1, "good", "bad")
+    assert [r.risk for r in resultados] == esperado.tolist()
+
+def test_coalescer_agrupa_solicitudes_concurrentes():
+    llamadas = []
+    def duplicar(lote):
+        llamadas.append(len(lote))
+        return [x * 2 for x in lote]
+    batcher = MicroBatcher(duplicar, max_batch=16, max_wait_ms=50)
+    resultados = [None] * 40
+    def trabajo(i):
+        resultados[i] = batcher.enviar(i)
+    hilos = [threading.Thread(target=trabajo, args=(i,)) for i in range(40)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert resultados == [i * 2 for i in range(40)]
+    stats = batcher.estadisticas()
+    assert stats["solicitudes"] == 40
+    assert stats["lotes"] == len(llamadas) < 40
+    assert max(llamadas) <= 16
+
+def test_coalescer_acota_la_espera_y_reinicia_el_hilo():
+    liberar = threading.Event()
+    def lento(lote):
+        liberar.wait(5)
+        return lote
+    batcher = MicroBatcher(lento, max_wait_ms=0, timeout_s=0.05)
+    with pytest.raises(HTTPException) as error:
+        batcher.enviar(1)
+    assert error.value.status_code == 503
+    liberar.set()
+    assert batcher.enviar(2) == 2
+    # Un hilo muerto (p. ej. por un error fuera del lote) se vuelve a arrancar en el siguiente envío
+    batcher._hilo = threading.Thread(target=lambda: None)
+    batcher._hilo.start()
+    batcher._hilo.join()
+    assert batcher.enviar(3) == 3
+    stats = batcher.estadisticas()
+    assert stats["timeouts"] == 1 and stats["reinicios"] == 1
+
+def test_predict_con_coalescer(modelo_local, monkeypatch):
+    monkeypatch.setattr(main, "coalescer", MicroBatcher(predict_logic.realizar_prediccion_batch, max_wait_ms=1))
+    payload = _clientes_sinteticos(1, seed=3).to_dict(orient="records")[0]
+    esperado = predict_logic.realizar_prediccion(ClienteInput(**payload)).model_dump()
+    response = client.post("/predict", json=payload)
+    assert response.status_code == 200
+    assert response.json() == esperado
+    assert client.get("/health").json()["coalescer"]["solicitudes"] == 1
+
+def test_motor_nativo_paridad_con_xgboost(modelo_local):
+    X = _clientes_sinteticos(300, seed=4)
+    motor = compilar_modelo(modelo_local)
+    np.testing.assert_allclose(motor.predict_proba(X.to_numpy()), modelo_local.predict_proba(X), atol=1e-6)
+    np.testing.assert_array_equal(motor.predict(X.to_numpy()), modelo_local.predict(X))
+
+def test_predict_batch_con_motor_nativo(modelo_local, monkeypatch):
+    payload = _clientes_sinteticos(20, seed=5).to_dict(orient="records")
+    monkeypatch.setattr(predict_logic, "cache_predicciones", CachePredicciones(0))
+    esperado = client.post("/predict/batch", json=payload).json()
+    monkeypatch.setattr(predict_logic, "engine", compilar_modelo(modelo_local))
+    data = client.post("/predict/batch", json=payload).json()
+    for nativo, sk in zip(data["predicciones"], esperado["predicciones"]):
+        assert nativo["risk"] == sk["risk"]
+        assert nativo["recommendation"] == sk["recommendation"]
+        assert nativo["probability_good"] == pytest.approx(sk["probability_good"], abs=1e-4)
+
+def test_cache_lru_y_ttl():
+    cache = CachePredicciones(max_entradas=2, ttl_segundos=0.05)
+    cache.sincronizar(object(), "1")
+    assert cache.obtener("a", lambda: 1) == 1
+    assert cache.obtener("a", lambda: 99) == 1
+    cache.obtener("b", lambda: 2)
+    cache.obtener("c", lambda: 3)  # expulsa "a", la menos usada
+    assert cache.obtener("a", lambda: 4) == 4
+    time.sleep(0.06)
+    assert cache.obtener("a", lambda: 5) == 5
+    stats = cache.estadisticas()
+    assert (stats["hits"], stats["evictions"], stats["expiraciones"]) == (1, 2, 1)
+
+def test_cache_deduplica_en_vuelo():
+    cache = CachePredicciones(max_entradas=10)
+    llamadas = []
+    def lento():
+        llamadas.append(1)
+        time.sleep(0.05)
+        return "resultado"
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(cache.obtener("k", lento))) for _ in range(8)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert resultados == ["resultado"] * 8
+    assert len(llamadas) == 1
+    assert cache.estadisticas()["deduplicadas"] == 7
+
+def test_cache_se_invalida_al_cambiar_modelo(modelo_local, monkeypatch):
+    cache = CachePredicciones(max_entradas=100)
+    monkeypatch.setattr(predict_logic, "cache_predicciones", cache)
+    payload = _clientes_sinteticos(5, seed=6).to_dict(orient="records")
+    client.post("/predict/batch", json=payload + payload)
+    distintas = set(predict_logic.claves_cache(predict_logic.matriz_clientes([ClienteInput(**p) for p in payload]), modelo_local, None))
+    assert cache.estadisticas()["misses"] == len(distintas)
+    client.post("/predict", json=payload[0])
+    assert cache.estadisticas()["hits"] == 1
+    monkeypatch.setattr(predict_logic, "MODEL_VERSION", "nueva")
+    client.post("/predict", json=payload[0])
+    stats = cache.estadisticas()
+    assert stats["invalidaciones"] == 1
+    assert stats["entradas"] == 1
+    assert stats["version_modelo"] == "nueva"
+    assert "hits" in client.get("/health").json()["cache"]
+
+def test_indice_umbrales_probabilidades_identicas(modelo_local):
+    X = _clientes_sinteticos(500, seed=7).astype(np.float64)
+    indice = indexar_umbrales(modelo_local)
+    bins = indice.bins(X.to_numpy())
+    # Mover cada valor al borde inferior de su bin no cambia el vector de bins
+    X_borde = X.copy()
+    for j, umbrales in enumerate(indice.umbrales):
+        con_umbral = bins[:, j] > 0
+        X_borde.iloc[con_umbral, j] = umbrales[bins[con_umbral, j] - 1]
+    np.testing.assert_array_equal(indice.bins(X_borde.to_numpy()), bins)
+    np.testing.assert_array_equal(modelo_local.predict_proba(X_borde), modelo_local.predict_proba(X))
+
+def test_cache_comparte_resultado_entre_clientes_del_mismo_bin(modelo_local, monkeypatch):
+    cache = CachePredicciones(max_entradas=100)
+    monkeypatch.setattr(predict_logic, "cache_predicciones", cache)
+    umbrales = indexar_umbrales(modelo_local).umbrales[FEATURES_IDX["Credit_amount"]]
+    base = _clientes_sinteticos(1, seed=8).to_dict(orient="records")[0]
+    a = dict(base, Credit_amount=float(umbrales[0]) + 0.001)
+    b = dict(base, Credit_amount=float(np.nextafter(umbrales[1], np.float32(0))))
+    assert client.post("/predict", json=a).json() == client.post("/predict", json=b).json()
+    assert cache.estadisticas()["hits"] == 1
+    directo = modelo_local.predict_proba(pd.DataFrame([b]))[0, 1]
+    assert client.post("/predict", json=b).json()["probability_good"] == round(float(directo), 4)
+
+def test_liveness_y_readiness(modelo_local, monkeypatch):
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/health/ready").status_code == 200
+    monkeypatch.setattr(predict_logic, "model", None)
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["ready"] is False
+
+def _cachear_modelo(almacen, nombre, version, modelo, perfil_drift=None):
+    ruta = f"{almacen.directorio}/{nombre}/{version}"
+    mlflow.sklearn.save_model(modelo, ruta)
+    if perfil_drift is not None:
+        with open(f"{ruta}/drift_reference.json", "w") as f:
+            json.dump(perfil_drift, f)
+    manifiesto = {"alias": {"production": version},
+                  "versiones": {version: {"checksum": checksum_directorio(ruta)}}}
+    with open(f"{almacen.directorio}/{nombre}/manifest.json", "w") as f:
+        json.dump(manifiesto, f)
+    return ruta
+
+def test_carga_offline_desde_cache_local(modelo_local, tmp_path):
+    almacen = AlmacenModelos(str(tmp_path))
+    _cachear_modelo(almacen, "GermanCredit", "3", modelo_local)
+    cargados = []
+    cargador = CargadorModelo("GermanCredit", "production", lambda m, v: cargados.append((m, v)),
+                              almacen, offline=True)
+    cargador.iniciar()
+    assert cargador.esperar(timeout=30)
+    assert cargador.estado()["fase"] == "listo"
+    assert cargador.estado()["origen"] == "cache local (offline)"
+    modelo, version = cargados[0]
+    assert version == "3"
+    X = _clientes_sinteticos(10, seed=9)
+    np.testing.assert_array_equal(modelo.predict_proba(X), modelo_local.predict_proba(X))
+
+def test_cache_local_descarta_checksum_invalido(modelo_local, tmp_path):
+    almacen = AlmacenModelos(str(tmp_path))
+    ruta = _cachear_modelo(almacen, "GermanCredit", "3", modelo_local)
+    assert almacen.ruta_local("GermanCredit", "3") == ruta
+    with open(f"{ruta}/MLmodel", "a") as f:
+        f.write("# alterado\n")
+    assert almacen.ruta_local("GermanCredit", "3") is None
+    with pytest.raises(RuntimeError):
+        almacen.resolver("GermanCredit", "production", offline=True)
+
+def test_cambio_en_caliente_por_archivo_de_alias(modelo_local, tmp_path):
+    almacen = AlmacenModelos(str(tmp_path / "cache"))
+    _cachear_modelo(almacen, "GermanCredit", "1", modelo_local)
+    X = _clientes_sinteticos(300)
+    otro = XGBClassifier(n_estimators=5, max_depth=2, random_state=0).fit(X, (X["Age"] > 40).astype(int))
+    ruta = f"{almacen.directorio}/GermanCredit/2"
+    mlflow.sklearn.save_model(otro, ruta)
+    manifiesto = almacen.manifiesto("GermanCredit")
+    manifiesto["versiones"]["2"] = {"checksum": checksum_directorio(ruta)}
+    almacen._guardar_manifiesto("GermanCredit", manifiesto)
+    archivo = tmp_path / "alias.txt"
+    archivo.write_text("1")
+
+    activos = []
+    cargador = CargadorModelo("GermanCredit", "production", lambda m, v: activos.append(v),
+                              almacen, intervalo=0.05, archivo_alias=str(archivo))
+    cargador.iniciar()
+    try:
+        assert cargador.esperar(timeout=30)
+        assert cargador.version == "1"
+        archivo.write_text("2")
+        limite = time.monotonic() + 30
+        while cargador.version != "2" and time.monotonic() < limite:
+            time.sleep(0.05)
+    finally:
+        cargador.detener()
+    assert activos == ["1", "2"]
+    assert cargador.estado()["cambios"] == 2
+    assert cargador.estado()["ultimo_cambio"] is not None
+
+def test_activar_modelo_publica_version(modelo_local, monkeypatch):
+    monkeypatch.setattr(predict_logic, "engine", None)
+    monkeypatch.setattr(predict_logic, "MODEL_VERSION", None)
+    anterior = predict_logic.modelo_activo()
+    predict_logic.activar_modelo(modelo_local, "7")
+    assert anterior[0] is modelo_local and anterior[2] is None
+    assert predict_logic.modelo_activo() == (modelo_local, None, "7")
+    payload = _clientes_sinteticos(1, seed=10).to_dict(orient="records")[0]
+    assert client.post("/predict", json=payload).status_code == 200
+
+def test_predict_stream_ndjson_con_filas_invalidas(modelo_local):
+    filas = _clientes_sinteticos(5, seed=11).to_dict(orient="records")
+    filas[2]["Age"] = 12
+    cuerpo = "\n".join(json.dumps(f) for f in filas[:4]) + "\nno es json\n" + json.dumps(filas[4])
+    response = client.post("/predict/stream?chunk_size=2", content=cuerpo,
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    lineas = [json.loads(l) for l in response.text.splitlines()]
+    assert [l.get("row") for l in lineas[:-1]] == [1, 2, 3, 4, 5, 6]
+    assert "Age" in lineas[2]["error"] and "error" in lineas[4]
+    validas = [filas[i] for i in (0, 1, 3, 4)]
+    esperado = client.post("/predict/batch", json=validas).json()["predicciones"]
+    assert [{k: v for k, v in l.items() if k != "row"} for l in lineas if "risk" in l] == esperado
+    assert lineas[-1] == {"total": 6, "errores": 2}
+
+def test_predict_stream_csv(modelo_local):
+    X = _clientes_sinteticos(4, seed=12)
+    response = client.post("/predict/stream", content=X.to_csv(index=False),
+                           headers={"Content-Type": "text/csv"})
+    lineas = [json.loads(l) for l in response.text.splitlines()]
+    assert [l["row"] for l in lineas[:-1]] == [1, 2, 3, 4]
+    assert all("probability_good" in l for l in lineas[:-1])
+    assert lineas[-1] == {"total": 4, "errores": 0}
+
+def test_predict_stream_csv_con_saltos_de_linea_entre_comillas(modelo_local):
+    X = _clientes_sinteticos(3, seed=12)
+    X.insert(0, "nota", ["simple", "dos\nlíneas", 'con "comillas"\ny salto'])
+    response = client.post("/predict/stream?chunk_size=2", content=X.to_csv(index=False).encode("utf-8"),
+                           headers={"Content-Type": "text/csv"})
+    lineas = [json.loads(l) for l in response.text.splitlines()]
+    assert [l["row"] for l in lineas[:-1]] == [1, 2, 3]
+    assert all("probability_good" in l for l in lineas[:-1])
+    assert lineas[-1] == {"total": 3, "errores": 0}
+
+def test_websocket_agrupa_frames_y_responde_por_id(modelo_local, monkeypatch):
+    monkeypatch.setattr(main.canal_ws, "max_wait", 0.2)
+    filas = _clientes_sinteticos(5, seed=14).to_dict(orient="records")
+    esperado = client.post("/predict/batch", json=filas).json()["predicciones"]
+    antes = main.canal_ws.estadisticas()
+    with client.websocket_connect("/predict/ws") as ws:
+        ws.send_text(json.dumps({"id": "a", "input": filas[0]}))
+        ws.send_text(json.dumps({"id": 7, "inputs": filas[1:4]}))
+        ws.send_bytes(json.dumps({"id": "c", "input": filas[4]}).encode())
+        ws.send_text(json.dumps({"id": "d", "input": {**filas[0], "Age": 12}}))
+        ws.send_text("no es json")
+        respuestas = {r["id"]: r for r in (ws.receive_json() for _ in range(5))}
+    # Los errores de validación se responden antes que el lote agrupado
+    assert "Age" in respuestas["d"]["error"] and "JSON" in respuestas[None]["error"]
+    assert respuestas["a"]["result"] == esperado[0]
+    assert respuestas[7]["results"] == esperado[1:4]
+    assert respuestas["c"]["result"] == esperado[4]
+    despues = main.canal_ws.estadisticas()
+    assert despues["lotes"] - antes["lotes"] == 1 and despues["filas"] - antes["filas"] == 5
+    assert despues["errores"] - antes["errores"] == 2 and despues["conexiones_activas"] == 0
+
+def test_batch_score_cli_con_reanudacion(modelo_local, tmp_path):
+    import batch_score
+    ruta_modelo = str(tmp_path / "modelo")
+    mlflow.sklearn.save_model(modelo_local, ruta_modelo)
+    X = _clientes_sinteticos(50, seed=13)
+    entrada, salida = tmp_path / "entrada.parquet", tmp_path / "salida.csv"
+    X.to_parquet(entrada, index=False)
+    argv = [str(entrada), str(salida), "--chunk-size", "8", "--workers", "2", "--model-path", ruta_modelo]
+    resumen = batch_score.main(argv)
+    assert resumen["filas"] == 50 and resumen["bloques"] == 7
+    resultado = pd.read_csv(salida)
+    esperado = client.post("/predict/batch", json=X.to_dict(orient="records")).json()["predicciones"]
+    assert resultado[list(esperado[0])].to_dict(orient="records") == esperado
+    assert resultado["Age"].tolist() == X["Age"].tolist()
+
+    # Reanudar: solo se recalculan los bloques que falten
+    primera = resultado
+    version = f"sha256:{checksum_directorio(ruta_modelo)}"
+    batch_score._preparar_directorio(f"{salida}.partes", batch_score._meta(str(entrada), 8, version), reanudar=False)
+    pd.read_csv(salida).iloc[:8].to_parquet(batch_score._ruta_parte(f"{salida}.partes", 0), index=False)
+    resumen = batch_score.main(argv + ["--resume"])
+    assert resumen["bloques_reanudados"] == 1 and resumen["filas"] == 42
+    pd.testing.assert_frame_equal(pd.read_csv(salida), primera)
+
+    # Con otra versión del modelo no se reanuda: la salida no mezcla versiones
+    batch_score._preparar_directorio(f"{salida}.partes", batch_score._meta(str(entrada), 8, "1"), reanudar=False)
+    with pytest.raises(SystemExit, match="No se puede reanudar"):
+        batch_score.main(argv + ["--resume"])
+
+def test_predict_batch_columnar_igual_a_batch(modelo_local):
+    X = _clientes_sinteticos(40, seed=14)
+    columnas = {f: X[f].tolist() for f in X.columns}
+    response = client.post("/predict/batch/columns", json=columnas)
+    assert response.status_code == 200
+    assert response.json() == client.post("/predict/batch", json=X.to_dict(orient="records")).json()
+
+def test_predict_batch_columnar_errores_como_pydantic(modelo_local):
+    X = _clientes_sinteticos(6, seed=15)
+    filas = X.to_dict(orient="records")
+    filas[1]["Age"] = 12
+    filas[2]["Credit_amount"] = 0
+    filas[3]["Duration"] = 6.5
+    filas[3]["Sex"] = 3
+    filas[4]["Purpose"] = None
+    filas[5]["Job"] = "dos"
+    por_objetos = client.post("/predict/batch", json=filas).json()["detail"]
+    columnas = {f: [fila[f] for fila in filas] for f in X.columns}
+    response = client.post("/predict/batch/columns", json=columnas)
+    assert response.status_code == 422
+    # Mismos errores; solo cambia loc: (fila, campo) pasa a ser (campo, fila)
+    obtenido = [dict(e, loc=["body", e["loc"][2], e["loc"][1]]) for e in response.json()["detail"]]
+    assert obtenido == [{k: v for k, v in e.items() if k != "url"} for e in por_objetos]
+
+def test_predict_batch_columnar_columnas_incompletas():
+    response = client.post("/predict/batch/columns", json={"Age": [30], "Sex": [1, 0]})
+    assert response.status_code == 422
+    assert {e["loc"][1] for e in response.json()["detail"]} == set(FEATURES_IDX) - {"Age", "Sex"}
+
+def test_batch_score_marca_filas_invalidas():
+    import batch_score
+    X = _clientes_sinteticos(4, seed=16)
+    X.loc[2, "Age"] = 150
+    _, validas, errores = batch_score.validar_bloque(X)
+    assert validas.tolist() == [True, True, False, True]
+    assert errores[2] == "Age: Input should be less than or equal to 100"
+
+def test_limitador_cola_acotada_y_deadline():
+    import asyncio
+    from serving.admission import Limitador, Rechazada, Vencida
+
+    async def escenario():
+        limitador = Limitador("/x", max_concurrentes=1, max_cola=1)
+        await limitador.entrar()
+        segunda = asyncio.create_task(limitador.entrar())
+        await asyncio.sleep(0)
+        with pytest.raises(Rechazada) as rechazo:
+            await limitador.entrar()
+        assert rechazo.value.retry_after >= 1
+        limitador.salir(0.01)
+        await segunda
+        # En cola con deadline corto: se descarta sin obtener turno
+        with pytest.raises(Vencida):
+            await limitador.entrar(time.monotonic() + 0.02)
+        limitador.salir()
+        return limitador.estadisticas()
+
+    stats = asyncio.run(escenario())
+    assert stats["admitidas"] == 2 and stats["rechazadas"] == 1 and stats["vencidas"] == 1
+    assert stats["en_curso"] == 0 and stats["en_cola"] == 0
+
+def test_predict_429_con_cola_llena_y_504_con_deadline_vencido(modelo_local, monkeypatch):
+    limitador = main.admision["/predict"]
+    payload = _clientes_sinteticos(1, seed=17).to_dict(orient="records")[0]
+    response = client.post("/predict", json=payload, headers={"X-Request-Deadline-Ms": "0"})
+    assert response.status_code == 504
+    # Apagado por defecto: sin límite de concurrencia
+    assert not limitador.activo
+    monkeypatch.setattr(limitador, "max_concurrentes", 8)
+    monkeypatch.setattr(limitador, "max_cola", 0)
+    monkeypatch.setattr(limitador, "_en_curso", limitador.max_concurrentes)
+    response = client.post("/predict", json=payload)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    stats = client.get("/health").json()["admission"]["/predict"]
+    assert stats["rechazadas"] >= 1 and stats["vencidas"] >= 1
+
+def test_deadline_se_revisa_antes_del_handler(modelo_local, monkeypatch):
+    limitador = main.admision["/predict/batch"]
+    payload = _clientes_sinteticos(5, seed=17).to_dict(orient="records")
+
+    async def admitir_sin_revisar(deadline=None):
+        # Admitida justo antes de vencer: el deadline vence durante el parseo
+        pass
+    monkeypatch.setattr(limitador, "entrar", admitir_sin_revisar)
+    antes = limitador.estadisticas()["vencidas"]
+    llamadas = []
+    monkeypatch.setattr(main, "filas_clientes", lambda *a: llamadas.append(a))
+    response = client.post("/predict/batch", json=payload, headers={"X-Request-Deadline-Ms": "0"})
+    assert response.status_code == 504 and not llamadas
+    assert limitador.estadisticas()["vencidas"] == antes + 1
+
+def test_metrics_etapas_lotes_y_estados(modelo_local):
+    from serving.metrics import Histograma
+    X = _clientes_sinteticos(30, seed=18)
+    client.post("/predict/batch", json=X.to_dict(orient="records"))
+    client.post("/predict", json={"Age": 5})
+    texto = client.get("/metrics").text
+    for etapa in ("parseo_validacion", "matriz", "modelo", "reglas", "serializacion", "total"):
+        assert f'inference_stage_seconds_count{{api="german",route="/predict/batch",stage="{etapa}"}}' in texto
+    assert 'http_requests_total{api="german",route="/predict",method="POST",status="422"}' in texto
+    assert "# TYPE model_load_seconds gauge" in texto
+    assert 'admission_queue_depth{route="/predict"} 0' in texto
+
+    h = Histograma("prueba_seconds", "prueba", ("route",), buckets=(1, 5))
+    for valor in (0.5, 1, 3, 7):
+        h.observar(valor, "/x")
+    assert h.exportar()[2:] == [
+        'prueba_seconds_bucket{route="/x",le="1"} 2',
+        'prueba_seconds_bucket{route="/x",le="5"} 3',
+        'prueba_seconds_bucket{route="/x",le="+Inf"} 4',
+        'prueba_seconds_sum{route="/x"} 11.5',
+        'prueba_seconds_count{route="/x"} 4',
+    ]
+
+def test_profiling_muestreado_y_acotado(modelo_local, monkeypatch):
+    from collections import OrderedDict
+    for atributo, valor in {"token": "secreto", "tasa": 1.0, "max_guardados": 2,
+                            "modo": "sample", "_perfiles": OrderedDict()}.items():
+        monkeypatch.setattr(main.perfilador, atributo, valor)
+    X = _clientes_sinteticos(50, seed=19).to_dict(orient="records")
+    ids = [client.post("/predict/batch", json=X).headers["X-Profile-Id"] for _ in range(3)]
+    guardados = client.get("/admin/profiles", headers={"X-Admin-Token": "secreto"}).json()["perfiles"]
+    assert [p["id"] for p in guardados] == ids[:0:-1]
+    assert guardados[0]["modo"] == "sample" and "matriz" in guardados[0]["etapas_ms"]
+    # Solo el desglose por etapa, sin perfil
+    response = client.post("/predict", json=X[0], headers={"X-Profile": "secreto", "X-Profile-Mode": "timing"})
+    assert "parseo_validacion;dur=" in response.headers["Server-Timing"]
+    assert "X-Profile-Id" not in response.headers
+    # En una ruta async cProfile mediría todo el event loop: se muestrea en su lugar
+    response = client.post("/predict/stream", content=json.dumps(X[0]),
+                           headers={"X-Profile": "secreto", "X-Profile-Mode": "cprofile"})
+    perfil = main.perfilador.obtener(response.headers["X-Profile-Id"])
+    assert perfil.modo == "sample"
+
+def _cuerpo_response_model(predicciones) -> bytes:
+    """Cuerpo que FastAPI arma al validar y serializar contra BatchPrediccionOutput."""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from models import BatchPrediccionOutput
+    lote = BatchPrediccionOutput(total=len(predicciones), predicciones=predicciones)
+    return JSONResponse(jsonable_encoder(lote)).body
+
+def test_predict_batch_bytes_identicos_al_response_model(modelo_local, monkeypatch):
+    from serving import respuestas
+    payload = _clientes_sinteticos(60, seed=17).to_dict(orient="records")
+    esperado = _cuerpo_response_model([predict_logic.realizar_prediccion(ClienteInput(**p)) for p in payload])
+    response = client.post("/predict/batch", json=payload)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == esperado
+    columnas = {f: [p[f] for p in payload] for f in FEATURES_IDX}
+    assert client.post("/predict/batch/columns", json=columnas).content == esperado
+    # Sin orjson el codificador estándar produce los mismos bytes
+    monkeypatch.setattr(respuestas, "orjson", None)
+    assert client.post("/predict/batch", json=payload).content == esperado
+
+def test_codificar_lote_floats_fuera_de_rango():
+    from serving.respuestas import codificar_lote, json_estandar
+    filas = [{"risk": "good", "probability_good": v, "probability_bad": 1.0, "recommendation": "—"}
+             for v in (0.0, 1e-05, 0.0001, 1e16, 123.5)]
+    campos = ("probability_good", "probability_bad")
+    assert codificar_lote(filas, campos) == json_estandar({"total": 5, "predicciones": filas})
+    with pytest.raises(ValueError):
+        codificar_lote(filas + [dict(filas[0], probability_good=float("nan"))], campos)
+
+def test_auditoria_escribe_parquet_y_lee_por_rango(modelo_local, monkeypatch, tmp_path):
+    from datetime import datetime, timedelta, timezone
+    from models import PrediccionOutput
+    from serving.audit import Auditoria, esquema_auditoria, leer_auditoria
+    auditoria = Auditoria("german", esquema_auditoria(ClienteInput, PrediccionOutput), str(tmp_path),
+                          intervalo=0.05, max_archivo_mb=0)
+    monkeypatch.setattr(predict_logic, "auditoria", auditoria)
+    auditoria.iniciar()
+    payload = _clientes_sinteticos(30, seed=18).to_dict(orient="records")
+    inicio = datetime.now(timezone.utc)
+    client.post("/predict", json=payload[0])
+    lote = client.post("/predict/batch", json=payload[1:]).json()["predicciones"]
+    auditoria.detener()
+    stats = auditoria.estadisticas()
+    assert stats["registradas"] == stats["escritas"] == 30 and stats["descartadas"] == 0
+    # max_archivo_mb=0 rota en cada escritura: no quedan archivos parciales
+    assert stats["archivos"] >= 1 and not list((tmp_path / "german").glob("*.parcial"))
+    df = leer_auditoria("german", inicio - timedelta(seconds=1), datetime.now(timezone.utc), str(tmp_path))
+    assert len(df) == 30
+    assert df["route"].tolist() == ["/predict"] + ["/predict/batch"] * 29
+    assert df[list(FEATURES_IDX)].to_dict(orient="records") == payload
+    assert df.iloc[1:][["risk", "probability_good", "probability_bad", "recommendation"]].to_dict(orient="records") == lote
+    assert leer_auditoria("german", hasta=inicio - timedelta(seconds=1), directorio=str(tmp_path)).empty
+
+def test_auditoria_buffer_acotado_y_politica_de_descarte():
+    from models import PrediccionOutput
+    from serving.audit import Auditoria, esquema_auditoria
+    salida = {"risk": "good", "probability_good": 0.9, "probability_bad": 0.1, "recommendation": "x"}
+    entradas = {f: [1] for f in FEATURES_IDX}
+    for politica, esperado in (("oldest", [2, 3]), ("newest", [0, 1])):
+        auditoria = Auditoria("german", esquema_auditoria(ClienteInput, PrediccionOutput), "/no/se/usa",
+                              capacidad=2, politica=politica)
+        for i in range(4):
+            auditoria.registrar(1, float(i), None, "interno", entradas, [salida])
+        assert [b[0] for _, b in auditoria._bloques] == esperado
+        assert auditoria.estadisticas()["descartadas"] == 2
+
+def test_auditoria_rota_por_bytes_escritos_y_no_importa_pyarrow_apagada(tmp_path):
+    import subprocess
+    from models import PrediccionOutput
+    from serving.audit import Auditoria, esquema_auditoria
+    salida = {"risk": "good", "probability_good": 0.9, "probability_bad": 0.1, "recommendation": "x"}
+    entradas = {f: [1] * 1000 for f in FEATURES_IDX}
+    auditoria = Auditoria("german", esquema_auditoria(ClienteInput, PrediccionOutput), str(tmp_path),
+                          max_archivo_mb=1)
+    os.makedirs(auditoria.directorio)
+    auditoria.registrar(1000, 0.0, "1", "interno", entradas, [salida] * 1000)
+    auditoria.vaciar()
+    # Por debajo del tamaño sigue abierto; los bytes escritos son la posición del destino
+    assert auditoria.estadisticas()["archivos"] == 0 and 0 < auditoria._archivo.tell() < 1024 * 1024
+    auditoria.max_archivo = auditoria._archivo.tell()
+    auditoria.registrar(1000, 1.0, "1", "interno", entradas, [salida] * 1000)
+    auditoria.vaciar()
+    assert auditoria.estadisticas()["archivos"] == 1
+    # Con AUDIT_DIR sin definir, la API no carga pyarrow
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    codigo = "import sys, serving.audit as a; a.Auditoria('x', []); print('pyarrow' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", codigo], cwd=raiz, capture_output=True,
+                          text=True).stdout.strip() == "False"
+
+def test_drift_contra_el_perfil_del_artefacto(modelo_local, monkeypatch, tmp_path):
+    from serving import metrics
+    from serving.drift import MonitorDrift, perfil_referencia
+    entrenamiento = _clientes_sinteticos(2000, seed=1)
+    perfil = perfil_referencia(entrenamiento.assign(probability_good=modelo_local.predict_proba(entrenamiento)[:, 1]))
+    monitor = MonitorDrift("german", ventana=1000, min_filas=50)
+    for modulo in (predict_logic, main):
+        monkeypatch.setattr(modulo, "monitor_drift", monitor)
+    monkeypatch.setattr(metrics, "_monitores", [monitor])
+    # El perfil viaja dentro del artefacto y se fija al cargar la versión
+    almacen = AlmacenModelos(str(tmp_path))
+    _cachear_modelo(almacen, "GermanCredit", "3", modelo_local, perfil)
+    cargador = CargadorModelo("GermanCredit", "production", lambda m, v: None, almacen, offline=True,
+                              intervalo=0, al_leer_artefacto=predict_logic.leer_perfil_drift)
+    cargador.iniciar()
+    assert cargador.esperar(timeout=30)
+    assert client.get("/drift").json()["version_modelo"] == "3"
+    # Tráfico con la distribución del entrenamiento: sin alertas
+    mismos = _clientes_sinteticos(400, seed=2).to_dict(orient="records")
+    client.post("/predict/batch", json=mismos[1:])
+    client.post("/predict", json=mismos[0])
+    reporte = client.get("/drift").json()
+    assert reporte["filas_recientes"] == 400 and reporte["alertas"] == []
+    assert reporte["columnas"]["Credit_amount"]["estado"] == "estable"
+    assert reporte["columnas"]["probability_good"]["psi"] is not None
+    # Montos cuatro veces mayores: drift en Credit_amount
+    desplazados = _clientes_sinteticos(400, seed=3).assign(Credit_amount=lambda d: d["Credit_amount"] * 4)
+    client.post("/predict/batch/columns", json=desplazados.to_dict(orient="list"))
+    reporte = client.get("/drift").json()
+    assert "Credit_amount" in reporte["alertas"] and "Age" not in reporte["alertas"]
+    assert 'drift_psi{model="german",column="Credit_amount"}' in client.get("/metrics").text
+
+def test_drift_perfil_con_columnas_de_mas_no_rompe_la_prediccion(modelo_local, monkeypatch, tmp_path):
+    from serving import drift
+    from serving.drift import MonitorDrift, perfil_referencia
+    # Un CSV de entrenamiento guardado con el índice de pandas y el target
+    entrenamiento = _clientes_sinteticos(500, seed=5).assign(Risk=1)
+    entrenamiento.to_csv(tmp_path / "train.csv")
+    perfil = perfil_referencia(entrenamiento.reset_index().rename(columns={"index": "Unnamed: 0"}))
+    monitor = MonitorDrift("german", observadas=predict_logic.COLUMNAS_DRIFT)
+    monkeypatch.setattr(predict_logic, "monitor_drift", monitor)
+    monitor.fijar_referencia(perfil, "1")
+    assert monitor.columnas == predict_logic.FEATURES
+    payload = _clientes_sinteticos(3, seed=6).to_dict(orient="records")
+    assert client.post("/predict", json=payload[0]).status_code == 200
+    assert client.post("/predict/batch", json=payload).status_code == 200
+    assert monitor.reporte()["filas_acumuladas"] == 4
+    # El perfil del artefacto también se filtra aunque el monitor no tenga `observadas`
+    monitor = MonitorDrift("german")
+    monkeypatch.setattr(predict_logic, "monitor_drift", monitor)
+    with open(tmp_path / drift.PERFIL_DRIFT, "w") as f:
+        json.dump(perfil, f)
+    predict_logic.leer_perfil_drift(str(tmp_path), "2")
+    assert "Unnamed: 0" not in monitor.columnas and "Risk" not in monitor.columnas
+    # La CLI por defecto usa solo las columnas que observa la API
+    salida = drift.main([str(tmp_path / "train.csv"), "--salida", str(tmp_path / "perfil.json")])
+    assert list(salida["features"]) == predict_logic.FEATURES
+    # Un error del monitoreo se registra y la predicción sale igual
+    def falla(valores, filas):
+        raise KeyError("Unnamed: 0")
+    monkeypatch.setattr(monitor, "observar", falla)
+    assert client.post("/predict/batch", json=payload).status_code == 200
+
+def test_drift_ventanas_y_memoria_constante():
+    from serving.drift import MonitorDrift, perfil_referencia
+    datos = _clientes_sinteticos(1000, seed=4)
+    monitor = MonitorDrift("german", ventana=100, min_filas=10)
+    monitor.fijar_referencia(perfil_referencia(datos), "1")
+    tamano = monitor._actual.nbytes
+    for inicio in range(0, 250, 50):
+        lote = datos.iloc[inicio:inicio + 50]
+        monitor.observar({c: lote[c].to_numpy() for c in lote}, len(lote))
+    monitor.observar({c: [datos[c].iloc[0]] for c in datos}, 1)
+    reporte = monitor.reporte()
+    # Rota cada 100 filas: la ventana reciente es la anterior (100) más la en curso (51)
+    assert reporte["filas_recientes"] == 151 and reporte["filas_acumuladas"] == 251
+    assert monitor._actual.nbytes == tamano
+    assert sum(monitor._acumulado + monitor._actual) == 251 * len(datos.columns)
+    # La misma versión no reinicia los conteos; otra versión sí
+    monitor.fijar_referencia(perfil_referencia(datos), "1")
+    assert monitor.reporte()["filas_acumuladas"] == 251
+    monitor.fijar_referencia(perfil_referencia(datos), "2")
+    assert monitor.reporte()["filas_acumuladas"] == 0
+
+def test_predict_explain_contribuciones_suman_el_logit(modelo_local):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from models import BatchExplicacionOutput
+    datos = _clientes_sinteticos(80, seed=19)
+    payload = datos.to_dict(orient="records")
+    response = client.post("/predict/explain/batch", json=payload)
+    assert response.status_code == 200
+    explicaciones = response.json()["predicciones"]
+    # Mismo cuerpo que validar contra el response_model, y la misma predicción que /predict/batch
+    assert response.content == JSONResponse(jsonable_encoder(BatchExplicacionOutput(**response.json()))).body
+    predicciones = client.post("/predict/batch", json=payload).json()["predicciones"]
+    assert [{k: e[k] for k in predicciones[0]} for e in explicaciones] == predicciones
+    logit = np.log(modelo_local.predict_proba(datos)[:, 1]) - np.log(modelo_local.predict_proba(datos)[:, 0])
+    sumas = [e["base_value"] + sum(e["contributions"].values()) for e in explicaciones]
+    np.testing.assert_allclose(sumas, logit, atol=5e-3)
+    assert list(explicaciones[0]["contributions"]) == list(FEATURES_IDX)
+    assert client.post("/predict/explain", json=payload[0]).json() == explicaciones[0]
+
+def test_predict_explain_cache_y_modelo_sin_booster(modelo_local, monkeypatch):
+    from sklearn.tree import DecisionTreeClassifier
+    monkeypatch.setattr(predict_logic, "cache_explicaciones", CachePredicciones(100))
+    payload = _clientes_sinteticos(20, seed=20).to_dict(orient="records")
+    primera = client.post("/predict/explain/batch", json=payload).json()
+    assert client.post("/predict/explain/batch", json=payload).json() == primera
+    stats = predict_logic.cache_explicaciones.estadisticas()
+    assert stats["hits"] >= 20 and stats["misses"] <= 20
+    X = _clientes_sinteticos(100, seed=21)
+    monkeypatch.setattr(predict_logic, "model", DecisionTreeClassifier(max_depth=2).fit(X, X["Sex"]))
+    assert client.post("/predict/explain", json=payload[0]).status_code == 501
+
+def test_artefacto_ligero_sin_mlflow(modelo_local, monkeypatch, tmp_path):
+    from serving.slim import exportar, ModeloLigero
+    exportar(modelo_local, "GermanCredit", "4", str(tmp_path))
+    cargados = []
+    cargador = CargadorModelo("GermanCredit", "production", lambda m, v: cargados.append((m, v)),
+                              intervalo=0, dir_ligero=str(tmp_path))
+    cargador.iniciar()
+    assert cargador.esperar(timeout=30)
+    assert cargador.estado()["origen"] == "artefacto ligero"
+    modelo, version = cargados[0]
+    assert isinstance(modelo, ModeloLigero) and version == "4"
+    X = _clientes_sinteticos(200, seed=22)
+    np.testing.assert_allclose(modelo.predict_proba(X.to_numpy()), modelo_local.predict_proba(X), atol=1e-6)
+    ligero, original = indexar_umbrales(modelo), indexar_umbrales(modelo_local)
+    assert all(np.array_equal(a, b) for a, b in zip(ligero.umbrales, original.umbrales))
+    payload = X.head(50).to_dict(orient="records")
+    esperado = client.post("/predict/batch", json=payload).json()
+    monkeypatch.setattr(predict_logic, "model", modelo)
+    monkeypatch.setattr(predict_logic, "engine", predict_logic.preparar_motor(modelo))
+    assert client.post("/predict/batch", json=payload).json() == esperado
+    # Las contribuciones cargan el booster del artefacto recién al pedirlas
+    explicacion = client.post("/predict/explain", json=payload[0]).json()
+    assert set(explicacion["contributions"]) == set(FEATURES_IDX)
+    # Un archivo alterado invalida el artefacto
+    with open(tmp_path / "GermanCredit" / "4" / "ensamble.npz", "ab") as f:
+        f.write(b"x")
+    with pytest.raises(ValueError, match="Checksum"):
+        cargador._activar("4", *cargador._ruta("4"))
+
+def test_lotes_grandes_repartidos_entre_procesos(modelo_local, monkeypatch):
+    from serving.sharding import PoolShards
+    motor = compilar_modelo(modelo_local)
+    monkeypatch.setattr(predict_logic, "engine", motor)
+    monkeypatch.setattr(predict_logic, "cache_predicciones", CachePredicciones(0))
+    X = _clientes_sinteticos(5000, seed=23).to_numpy(dtype=np.float64)
+    esperado = predict_logic.puntuar_filas(X)
+    pool = PoolShards("test", workers=2, min_filas=1000)
+    monkeypatch.setattr(predict_logic, "pool_shards", pool)
+    try:
+        pool.publicar(motor)
+        assert predict_logic.puntuar_filas(X) == esperado
+        # Los lotes chicos no pasan por el pool
+        assert predict_logic.puntuar_filas(X[:999]) == esperado[:999]
+        assert pool.estadisticas()["lotes"] == 1 and pool.estadisticas()["shards"] == 3
+        np.testing.assert_array_equal(pool.predict_proba(motor, X), motor.predict_proba(X))
+        # Con un worker caído el lote se puntúa en el proceso y el pool se recrea
+        for proceso in list(pool._pool._processes.values()):
+            proceso.kill()
+            proceso.join()
+        assert predict_logic.puntuar_filas(X) == esperado
+        assert pool.estadisticas()["errores"] == 1
+        assert predict_logic.puntuar_filas(X) == esperado
+        assert pool.estadisticas()["errores"] == 1
+    finally:
+        pool.cerrar()
@@ -1,15 +1,50 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from jira_models import JiraIssueInput, JiraTimePrediction, BatchJiraPrediction
-from jira_predict_logic import predecir_tiempo_jira, model, MODEL_NAME, MODEL_ALIAS
+from fastapi.responses import PlainTextResponse
+from jira_models import JiraIssueInput, JiraTimePrediction, BatchJiraPrediction, PlanTiempos
+import jira_predict_logic
+from jira_predict_logic import predecir_tiempo_jira, filas_tiempo_jira, horas_matriz, cargador, auditoria, pool_shards, MODEL_NAME, MODEL_ALIAS
+from serving.admission import MiddlewareAdmision, limitadores
+from serving import metrics
+from serving.profiling import MiddlewareProfiling, Perfilador, router_profiling
+from jira_planning import (matriz_backlog, plan_tiempos, leer_agrupaciones, leer_percentiles,
+                           AGRUPACIONES_DEFAULT, PERCENTILES_DEFAULT)
+from serving.respuestas import RespuestaLote, RespuestaJSON
+from serving.prefork import estado_workers
+from serving.websocket import CanalPuntuacion
+from contextlib import asynccontextmanager
 import uvicorn
 
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Carga del modelo en segundo plano: el servidor queda disponible de inmediato.
+    # Montada en el gateway (app.py de la raíz) no corre: el registro carga el modelo en el primer uso.
+    cargador.iniciar()
+    auditoria.iniciar()
+    yield
+    cargador.detener()
+    auditoria.detener()
+
 app = FastAPI(
     title="Jira Time Prediction API",
     description="API de predicción de tiempo de desarrollo para issues de Jira — MLOps Project",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=ciclo_de_vida
 )
 
+# Marca inicio y fin de cada handler para separar parseo, handler y serialización en /metrics
+app.router.route_class = metrics.RutaInstrumentada
+# Control de admisión por endpoint: concurrencia acotada, cola acotada (429) y deadline del cliente
+admision = limitadores(["/predict/time", "/predict/time/batch", "/predict/time/plan"])
+app.add_middleware(MiddlewareAdmision, limitadores=admision)
+# Profiling bajo pedido (X-Profile o /admin/profiles/arm) y muestreo opcional
+perfilador = Perfilador()
+app.add_middleware(MiddlewareProfiling, perfilador=perfilador)
+app.add_middleware(metrics.MiddlewareMetricas, api="jira")
+app.include_router(router_profiling(perfilador))
+metrics.gauges_modelo(cargador)
+metrics.gauges_admision(admision)
+metrics.gauges_auditoria(auditoria)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,17 +58,50 @@ def root():
         "api": "Jira Time Prediction API",
         "version": "1.0.0",
         "model": f"{MODEL_NAME}@{MODEL_ALIAS}",
+        "model_version": cargador.version,
+        "last_swap": cargador.ultimo_cambio,
         "status": "running",
         "description": "Predicción de tiempo de desarrollo por equipo y tipo de issue"
     }
 
 @app.get("/health")
 def health():
-    return {
+    estado = {
         "status": "healthy",
-        "model_loaded": model is not None,
-        "model_name": MODEL_NAME
+        "model_loaded": jira_predict_logic.model is not None,
+        "model_name": MODEL_NAME,
+        "model": cargador.estado(),
+        "admission": {ruta: l.estadisticas() for ruta, l in admision.items()},
+        "audit": auditoria.estadisticas(),
+        "websocket": canal_ws.estadisticas()
     }
+    if jira_predict_logic.tabla_tiempos is not None:
+        estado["lookup"] = jira_predict_logic.tabla_tiempos.estadisticas()
+    if pool_shards.activo:
+        estado["shards"] = pool_shards.estadisticas()
+    # Servida con serving/prefork.py: estado agregado de todos los workers
+    workers = estado_workers()
+    if workers is not None:
+        estado["workers"] = workers
+    return estado
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metricas():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.registro.exportar(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+def liveness():
+    """El proceso responde; no depende del modelo."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness(response: Response):
+    """Listo para recibir tráfico solo cuando el modelo terminó de cargar."""
+    listo = jira_predict_logic.model is not None
+    if not listo:
+        response.status_code = 503
+    return {"ready": listo, "model": cargador.estado()}
 
 @app.post("/predict/time", response_model=JiraTimePrediction)
 def predict_time(issue: JiraIssueInput):
@@ -47,14 +115,21 @@ def predict_time(issue: JiraIssueInput):
     """
     return predecir_tiempo_jira(issue)
 
+# El batch devuelve las filas ya codificadas (RespuestaLote) en lugar de un
+# BatchJiraPrediction: mismos bytes, sin validar ni serializar cada fila
+CAMPOS_FLOAT = ("story_points", "tiempo_estimado_horas", "tiempo_estimado_dias")
+
 @app.post("/predict/time/batch", response_model=BatchJiraPrediction)
 def predict_time_batch(issues: list[JiraIssueInput]):
     """
-    Predice el tiempo de desarrollo para múltiples issues de Jira.
+    Predice el tiempo de desarrollo para múltiples issues de Jira, con una
+    sola llamada al modelo para todo el lote.
     """
+    metrics.observar_lote(len(issues))
     try:
-        resultados = [predecir_tiempo_jira(issue) for issue in issues]
-        return BatchJiraPrediction(total=len(resultados), predicciones=resultados)
+        filas = filas_tiempo_jira(issues)
+        with metrics.etapa("codificacion"):
+            return RespuestaLote(filas, CAMPOS_FLOAT)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -62,6 +137,60 @@ def predict_time_batch(issues: list[JiraIssueInput]):
         logging.error(f"Error en predicción batch: {e}")
         raise HTTPException(status_code=500, detail="Error interno en la predicción batch")
 
+async def cuerpo(request: Request) -> bytes:
+    # El backlog llega crudo: jira_planning lo valida por columnas sin un JiraIssueInput por issue
+    return await request.body()
+
+@app.post("/predict/time/plan", response_model=PlanTiempos, openapi_extra={"requestBody": {
+    "required": True,
+    "content": {"application/json": {"schema": {"type": "array", "items": JiraIssueInput.model_json_schema()}}},
+}})
+def predict_time_plan(request_body: bytes = Depends(cuerpo),
+                      group_by: str = Query(AGRUPACIONES_DEFAULT,
+                                            description="Agrupaciones separadas por coma; `+` combina dimensiones, p. ej. `equipo+sprints`"),
+                      percentiles: str = Query(PERCENTILES_DEFAULT, description="Percentiles de horas, separados por coma"),
+                      detail: bool = Query(False, description="Agrega las estimaciones por issue, en columnas")):
+    """
+    Planificación de un backlog: recibe la misma lista de issues que
+    /predict/time/batch y devuelve totales y percentiles de
+    `tiempo_estimado_horas` por equipo, tipo de issue y sprints, en lugar de
+    una predicción por issue. Todo el backlog se estima con una sola llamada
+    al modelo (y la tabla de estimaciones).
+    """
+    agrupaciones = leer_agrupaciones(group_by)
+    niveles = leer_percentiles(percentiles)
+    with metrics.etapa("validacion"):
+        X = matriz_backlog(request_body)
+    metrics.observar_lote(len(X))
+    if len(X) == 0:
+        return RespuestaJSON(plan_tiempos(X, X[:, 0], None, agrupaciones, niveles, detail))
+    try:
+        with metrics.etapa("modelo"):
+            horas, version = horas_matriz(X)
+        with metrics.etapa("agregados"):
+            plan = plan_tiempos(X, horas, version, agrupaciones, niveles, detail)
+        with metrics.etapa("codificacion"):
+            return RespuestaJSON(plan)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        import logging
+        logging.error(f"Error en planificación: {e}")
+        raise HTTPException(status_code=500, detail="Error interno en la planificación")
+
+# Canal WebSocket para clientes internos: frames con id de correlación, agrupados entre sí
+canal_ws = CanalPuntuacion("jira", JiraIssueInput, filas_tiempo_jira)
+
+@app.websocket("/predict/time/ws")
+async def predict_time_ws(websocket: WebSocket):
+    """
+    Estimación por una conexión persistente. Cada frame es
+    `{"id": ..., "input": JiraIssueInput}` o `{"id": ..., "inputs": [...]}` y se
+    responde con `{"id": ..., "result": ...}`, `{"id": ..., "results": [...]}`
+    o `{"id": ..., "error": ...}`, no necesariamente en orden de llegada.
+    """
+    await canal_ws.atender(websocket)
+
 @app.get("/info/teams")
 def get_teams():
     """Retorna la lista de equipos disponibles."""
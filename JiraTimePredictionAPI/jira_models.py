@@ -31,3 +31,26 @@ class JiraTimePrediction(BaseModel):
 class BatchJiraPrediction(BaseModel):
     total: int
     predicciones: list[JiraTimePrediction]
+
+class ResumenPlan(BaseModel):
+    # Solo están las dimensiones de la agrupación (ninguna en el total)
+    equipo: str | None = None
+    tipo_issue: str | None = None
+    sprints: int | None = None
+    issues: int
+    horas_total: float
+    dias_total: float
+    horas_promedio: float
+    percentiles_horas: dict[str, float]
+
+class DetallePlan(BaseModel):
+    tiempo_estimado_horas: list[float]
+    tiempo_estimado_dias: list[float]
+    nivel_confianza: list[str]
+
+class PlanTiempos(BaseModel):
+    total_issues: int
+    model_version: str | None
+    total: ResumenPlan
+    grupos: dict[str, list[ResumenPlan]]
+    detalle: DetallePlan | None = None
@@ -0,0 +1,200 @@
+"""
+Planificación de backlogs: estimación de miles de issues con una sola
+llamada al modelo y agregados de `tiempo_estimado_horas` por equipo, tipo
+de issue y sprints, calculados en el servidor con NumPy.
+"""
+import json
+import numpy as np
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+from jira_models import JiraIssueInput
+from jira_predict_logic import (TEAM_MAPPING, TIPO_MAPPING, JIRA_FEATURES, LIMITES_DIAS, NIVELES_CONFIANZA,
+                                matriz_issues)
+from serving.respuestas import orjson
+
+_cargar = orjson.loads if orjson is not None else json.loads
+_ADAPTADOR = TypeAdapter(list[JiraIssueInput])
+_CAMPOS = JiraIssueInput.model_fields
+_REQUERIDOS = [n for n, i in _CAMPOS.items() if i.is_required()]
+
+# Dimensiones de agrupación: nombre en la respuesta (como en JiraTimePrediction) ->
+# (columna de la matriz, etiqueta de cada valor, valor de la primera etiqueta)
+DIMENSIONES = {
+    "equipo":     (JIRA_FEATURES.index("team_encoded"), sorted(TEAM_MAPPING, key=TEAM_MAPPING.get), 0),
+    "tipo_issue": (JIRA_FEATURES.index("tipo_encoded"), sorted(TIPO_MAPPING, key=TIPO_MAPPING.get), 0),
+    "sprints":    (JIRA_FEATURES.index("sprint_numbers"), list(range(1, 11)), 1),
+}
+AGRUPACIONES_DEFAULT = "equipo,tipo_issue,sprints"
+PERCENTILES_DEFAULT  = "50,80,95"
+
+def _codigos(valores: list, mapeo: dict) -> np.ndarray | None:
+    """Mapeo categórico vectorizado (strings -> códigos); None si algún valor no es una categoría."""
+    # Solo strings: una lista o un dict en una fila lo valida Pydantic (422), no NumPy
+    if not all(type(v) is str for v in valores):
+        return None
+    try:
+        crudo = np.asarray(valores)
+    except (ValueError, TypeError):
+        return None
+    if crudo.dtype.kind != "U":
+        return None
+    categorias = np.array(sorted(mapeo))
+    posicion = np.minimum(np.searchsorted(categorias, crudo), len(categorias) - 1)
+    if not np.array_equal(categorias[posicion], crudo):
+        return None
+    return np.array([mapeo[c] for c in categorias], dtype=np.float64)[posicion]
+
+def _numeros(valores: list, tipos: tuple, minimo: float, maximo: float) -> np.ndarray | None:
+    """Columna numérica vectorizada; None si algún valor no es de `tipos` (bool no cuenta) o está fuera de rango."""
+    if not all(type(v) in tipos for v in valores):
+        return None
+    try:
+        crudo = np.asarray(valores)
+    except (ValueError, TypeError):
+        return None
+    if crudo.dtype.kind not in "iuf":
+        return None
+    columna = crudo.astype(np.float64)
+    if not ((columna >= minimo) & (columna <= maximo)).all():
+        return None
+    return columna
+
+def _limites(campo: str) -> tuple[float, float]:
+    # Límites ge/le tal como están declarados en JiraIssueInput
+    metadata = _CAMPOS[campo].metadata
+    return (next(m.ge for m in metadata if hasattr(m, "ge")), next(m.le for m in metadata if hasattr(m, "le")))
+
+_LIMITES_STORY_POINTS = _limites("story_points")
+_LIMITES_SPRINTS      = _limites("sprint_numbers")
+
+def _columnas(datos) -> np.ndarray | None:
+    """Camino rápido para un backlog bien formado: columnas con NumPy, sin un JiraIssueInput por issue."""
+    if not isinstance(datos, list) or not all(type(d) is dict and all(r in d for r in _REQUERIDOS) for d in datos):
+        return None
+    equipos = _codigos([d["team"] for d in datos], TEAM_MAPPING)
+    tipos   = _codigos([d["tipo_de_issue"] for d in datos], TIPO_MAPPING)
+    story_points = _numeros([d.get("story_points", _CAMPOS["story_points"].default) for d in datos],
+                            (int, float), *_LIMITES_STORY_POINTS)
+    sprints = _numeros([d.get("sprint_numbers", _CAMPOS["sprint_numbers"].default) for d in datos],
+                       (int,), *_LIMITES_SPRINTS)
+    if equipos is None or tipos is None or story_points is None or sprints is None:
+        return None
+    columnas = {"team_encoded": equipos, "tipo_encoded": tipos,
+                "story_points": story_points, "sprint_numbers": sprints}
+    return np.column_stack([columnas[f] for f in JIRA_FEATURES])
+
+def matriz_backlog(cuerpo: bytes) -> np.ndarray:
+    """
+    Matriz issues x JIRA_FEATURES de un backlog en JSON (la misma lista que
+    /predict/time/batch). Un backlog bien formado se valida columna por
+    columna; ante cualquier valor dudoso se valida con Pydantic, que acepta
+    lo mismo que el batch y da los mismos errores (422 con `loc` = fila y campo).
+    """
+    try:
+        datos = _cargar(cuerpo)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=[
+            {"type": "json_invalid", "loc": ["body"], "msg": "JSON decode error", "input": {}}])
+    X = _columnas(datos)
+    if X is not None:
+        return X
+    try:
+        issues = _ADAPTADOR.validate_python(datos)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=[
+            {**err, "loc": ["body", *err["loc"]]} for err in e.errors(include_url=False)])
+    return matriz_issues(issues)
+
+def leer_percentiles(texto: str) -> list[float]:
+    try:
+        percentiles = [float(p) for p in texto.split(",") if p.strip()]
+    except ValueError:
+        percentiles = None
+    if not percentiles or any(not 0 <= p <= 100 for p in percentiles):
+        raise HTTPException(status_code=422, detail="percentiles: lista de números entre 0 y 100 separados por coma")
+    return percentiles
+
+def leer_agrupaciones(texto: str) -> list[tuple[str, ...]]:
+    """'equipo,equipo+sprints' -> [('equipo',), ('equipo', 'sprints')]."""
+    agrupaciones = [tuple(d.strip() for d in g.split("+")) for g in texto.split(",") if g.strip()]
+    invalidas = [d for g in agrupaciones for d in g if d not in DIMENSIONES]
+    if invalidas:
+        raise HTTPException(status_code=422,
+                            detail=f"group_by: dimensiones desconocidas {invalidas}; válidas: {list(DIMENSIONES)}")
+    return agrupaciones
+
+def _nombre_percentil(p: float) -> str:
+    return f"p{p:g}"
+
+def _resumen(horas_ordenadas: np.ndarray, inicios: np.ndarray, tamanos: np.ndarray, sumas: np.ndarray,
+             percentiles: list[float]) -> dict:
+    """Columnas del resumen de cada grupo; percentiles con interpolación lineal (como np.percentile)."""
+    resumen = {
+        "issues": tamanos,
+        "horas_total": np.round(sumas, 2),
+        "dias_total": np.round(sumas / 24, 2),
+        "horas_promedio": np.round(sumas / tamanos, 2),
+    }
+    ultimo = inicios + tamanos - 1
+    for p in percentiles:
+        posicion = inicios + (tamanos - 1) * (p / 100)
+        abajo = np.floor(posicion).astype(np.intp)
+        arriba = np.minimum(abajo + 1, ultimo)
+        fraccion = posicion - abajo
+        valor = horas_ordenadas[abajo] + (horas_ordenadas[arriba] - horas_ordenadas[abajo]) * fraccion
+        resumen[_nombre_percentil(p)] = np.round(valor, 2)
+    return resumen
+
+def _filas(etiquetas: dict, resumen: dict, percentiles: list[float]) -> list[dict]:
+    nombres = [_nombre_percentil(p) for p in percentiles]
+    columnas = {k: v.tolist() for k, v in resumen.items()}
+    etiquetas = {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in etiquetas.items()}
+    return [
+        {**{d: etiquetas[d][i] for d in etiquetas},
+         "issues": columnas["issues"][i], "horas_total": columnas["horas_total"][i],
+         "dias_total": columnas["dias_total"][i], "horas_promedio": columnas["horas_promedio"][i],
+         "percentiles_horas": {n: columnas[n][i] for n in nombres}}
+        for i in range(len(columnas["issues"]))
+    ]
+
+def agrupar(X: np.ndarray, horas: np.ndarray, dimensiones: tuple[str, ...], percentiles: list[float]) -> list[dict]:
+    """Resumen por cada combinación presente de las dimensiones, en orden de código."""
+    columnas = [X[:, DIMENSIONES[d][0]].astype(np.intp) - DIMENSIONES[d][2] for d in dimensiones]
+    clave = np.ravel_multi_index(columnas, [len(DIMENSIONES[d][1]) for d in dimensiones])
+    orden = np.lexsort((horas, clave))
+    claves_ordenadas = clave[orden]
+    claves, inicios, tamanos = np.unique(claves_ordenadas, return_index=True, return_counts=True)
+    sumas = np.bincount(clave, weights=horas)[claves]
+    resumen = _resumen(horas[orden], inicios, tamanos, sumas, percentiles)
+    codigos = np.unravel_index(claves, [len(DIMENSIONES[d][1]) for d in dimensiones])
+    etiquetas = {d: np.array(DIMENSIONES[d][1], dtype=object)[c] for d, c in zip(dimensiones, codigos)}
+    return _filas(etiquetas, resumen, percentiles)
+
+def plan_tiempos(X: np.ndarray, horas: np.ndarray, version, agrupaciones: list[tuple[str, ...]],
+                 percentiles: list[float], detalle: bool) -> dict:
+    """
+    Totales y percentiles de tiempo_estimado_horas del backlog entero y por
+    cada agrupación. Se calculan sobre las horas redondeadas a 2 decimales,
+    las mismas que devuelve /predict/time/batch por issue. Con `detalle`
+    agrega las estimaciones por issue en columnas, en el orden del backlog.
+    """
+    redondeadas = np.array([round(h, 2) for h in horas.tolist()], dtype=np.float64)
+    n = len(redondeadas)
+    plan = {"total_issues": n, "model_version": version}
+    if n:
+        ordenadas = np.sort(redondeadas)
+        cero = np.zeros(1, dtype=np.intp)
+        total = _resumen(ordenadas, cero, np.array([n]), np.array([redondeadas.sum()]), percentiles)
+        plan["total"] = _filas({}, total, percentiles)[0]
+    else:
+        plan["total"] = {"issues": 0, "horas_total": 0.0, "dias_total": 0.0, "horas_promedio": 0.0,
+                         "percentiles_horas": {}}
+    plan["grupos"] = {"+".join(g): agrupar(X, redondeadas, g, percentiles) if n else [] for g in agrupaciones}
+    if detalle:
+        dias = horas / 24
+        plan["detalle"] = {
+            "tiempo_estimado_horas": redondeadas.tolist(),
+            "tiempo_estimado_dias": [round(d, 2) for d in dias.tolist()],
+            "nivel_confianza": NIVELES_CONFIANZA[np.searchsorted(LIMITES_DIAS, dias, side="left")].tolist(),
+        }
+    return plan
@@ -1,16 +1,32 @@
-import mlflow
-import mlflow.sklearn
-import pandas as pd
+import os
+import sys
+import time
+import threading
 import numpy as np
 import logging
 from fastapi import HTTPException
 from jira_models import JiraIssueInput, JiraTimePrediction
 
+# Paquete compartido serving/ en la raíz del repositorio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.tree_engine import EnsambleCompilado, compilar_modelo
+from serving.model_store import CargadorModelo
+from serving.metrics import etapa, ruta_actual
+from serving.audit import Auditoria, esquema_auditoria
+from serving.slim import MODEL_SLIM_DIR
+from serving.sharding import PoolShards
+
 MLFLOW_TRACKING_URI = "http://44.211.88.225:5000"
 MODEL_NAME = "JiraTimePrediction"
 MODEL_ALIAS = "production"
+# "sklearn": modelo MLflow tal cual; "native": ensamble compilado en NumPy
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "sklearn")
 
-mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+# Con artefactos ligeros (MODEL_SLIM_DIR, ver serving/slim.py) no se importan
+# MLflow ni pandas: pandas solo hace falta para el modelo MLflow (matriz_jira).
+if not MODEL_SLIM_DIR:
+    import mlflow
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
 # Mapeo de equipos y tipos
@@ -28,63 +44,252 @@ TIPO_MAPPING = {
     'Xray Test': 9
 }
 
-try:
-    logging.info(f"Cargando modelo {MODEL_NAME}@{MODEL_ALIAS}...")
-    model = mlflow.sklearn.load_model(f"models:/{MODEL_NAME}@{MODEL_ALIAS}")
-    logging.info("Modelo Jira cargado correctamente")
-except Exception as e:
-    logging.error(f"Error cargando el modelo Jira: {e}")
-    model = None
+# Registro de auditoría de cada issue estimado (apagado sin AUDIT_DIR); lo inicia jira_api.py
+auditoria = Auditoria("jira", esquema_auditoria(JiraIssueInput, JiraTimePrediction))
+
+# Orden de las features tal como se entrenó el modelo
+JIRA_FEATURES = ['team_encoded', 'tipo_encoded', 'story_points', 'sprint_numbers']
+
+# Nivel de confianza y recomendación según los días estimados (hasta 7, 20, 40 y más)
+LIMITES_DIAS = np.array([7, 20, 40])
+NIVELES_CONFIANZA = np.array(["Alta", "Media", "Media-Baja", "Baja"], dtype=object)
+RECOMENDACIONES = np.array([
+    "Issue simple, desarrollo rápido esperado",
+    "Issue estándar, seguimiento normal",
+    "Issue compleja, requiere planificación detallada",
+    "Issue muy compleja, considerar dividir en subtasks",
+], dtype=object)
+
+# Lotes de al menos SHARD_MIN_ROWS issues se reparten entre procesos (serving/sharding.py)
+pool_shards = PoolShards("jira")
+
+# Tabla de estimaciones precalculadas para la grilla de entradas habituales (ver TablaTiempos)
+JIRA_LOOKUP_TABLE = os.getenv("JIRA_LOOKUP_TABLE", "1") == "1"
+# Story points de la grilla; los demás valores (p. ej. fraccionarios) se puntúan con el modelo
+JIRA_LOOKUP_STORY_POINTS = [float(v) for v in os.getenv("JIRA_LOOKUP_STORY_POINTS", "0,1,2,3,5,8,13").split(",")
+                            if v.strip()]
+# Sprints de la grilla: todo el rango que admite JiraIssueInput
+SPRINTS_GRILLA = np.arange(1, 11)
+
+# El modelo se publica desde el hilo de carga en segundo plano (ver activar_modelo).
+# Se leen y reemplazan juntos bajo _lock_modelo para que cada solicitud use una
+# sola versión de principio a fin.
+model = None
+engine = None
+MODEL_VERSION = None
+tabla_tiempos = None
+_lock_modelo = threading.Lock()
+
+def modelo_activo():
+    """Instantánea consistente de (modelo, motor nativo, versión)."""
+    with _lock_modelo:
+        return model, engine, MODEL_VERSION
+
+def preparar_motor(modelo):
+    """Compila el modelo a arreglos NumPy si INFERENCE_ENGINE=native; None si no aplica."""
+    if isinstance(modelo, EnsambleCompilado):
+        return modelo   # artefacto ligero: el modelo ya es el motor nativo
+    if modelo is None or INFERENCE_ENGINE != "native":
+        return None
+    try:
+        motor = compilar_modelo(modelo)
+        logging.info("Motor nativo de árboles compilado para el modelo Jira")
+        return motor
+    except Exception as e:
+        logging.warning(f"Motor nativo no disponible, se usa el modelo MLflow: {e}")
+        return None
+
+def matriz_jira(filas: list[dict]):
+    """DataFrame con las features en el orden de JIRA_FEATURES, para el modelo MLflow."""
+    import pandas as pd
+    return pd.DataFrame(filas, columns=JIRA_FEATURES)
+
+# Entradas representativas para calentar un modelo nuevo antes de publicarlo
+EJEMPLOS_CALENTAMIENTO = [
+    {'team_encoded': team, 'tipo_encoded': tipo, 'story_points': sp, 'sprint_numbers': sprints}
+    for team in TEAM_MAPPING.values()
+    for tipo, sp, sprints in [(0, 5.0, 1), (2, 1.0, 1), (4, 3.0, 2), (1, 13.0, 4)]
+]
+
+def activar_modelo(nuevo, version: str):
+    """
+    Prepara un modelo recién cargado (motor nativo, calentamiento y tabla de
+    estimaciones) y solo entonces lo publica de forma atómica. Las
+    solicitudes en curso terminan con la instantánea que ya tomaron.
+    """
+    global model, engine, MODEL_VERSION, tabla_tiempos
+    motor = preparar_motor(nuevo)
+    if motor is not nuevo:
+        nuevo.predict(matriz_jira(EJEMPLOS_CALENTAMIENTO))
+    if motor is not None:
+        motor.predict(np.array([[e[f] for f in motor.feature_names or JIRA_FEATURES]
+                                for e in EJEMPLOS_CALENTAMIENTO], dtype=np.float32))
+    pool_shards.publicar(motor)
+    # La tabla se arma con el modelo nuevo antes de publicarlo: nunca mezcla versiones
+    tabla = TablaTiempos(nuevo, motor, version) if JIRA_LOOKUP_TABLE else None
+    with _lock_modelo:
+        model, engine, MODEL_VERSION, tabla_tiempos = nuevo, motor, version, tabla
+
+def descargar_modelo():
+    """Retira el modelo publicado (lo usa el registro del gateway al desalojarlo)."""
+    global model, engine, MODEL_VERSION, tabla_tiempos
+    with _lock_modelo:
+        model, engine, MODEL_VERSION, tabla_tiempos = None, None, None, None
+    pool_shards.retirar()
+
+# Carga no bloqueante (la inicia jira_api.py al arrancar, o el registro del gateway
+# en el primer uso): el servidor responde 503 en /predict/time mientras el modelo
+# se carga y después un vigilante cambia de versión sin reiniciar.
+cargador = CargadorModelo(MODEL_NAME, MODEL_ALIAS, activar_modelo, al_descargar=descargar_modelo)
 
 def predecir_tiempo_jira(issue: JiraIssueInput) -> JiraTimePrediction:
-    if model is None:
+    return JiraTimePrediction(**fila_tiempo_jira(issue))
+
+def fila_tiempo_jira(issue: JiraIssueInput) -> dict:
+    """Predicción de un issue como dict con las claves de JiraTimePrediction."""
+    return filas_tiempo_jira([issue])[0]
+
+def matriz_issues(issues: list[JiraIssueInput]) -> np.ndarray:
+    """Matriz float64 issues x JIRA_FEATURES; equipos y tipos desconocidos se codifican como 0."""
+    return np.array([
+        (TEAM_MAPPING.get(i.team, 0), TIPO_MAPPING.get(i.tipo_de_issue, 0), i.story_points, i.sprint_numbers)
+        for i in issues
+    ], dtype=np.float64).reshape(-1, len(JIRA_FEATURES))
+
+def _horas(X: np.ndarray, modelo, motor) -> np.ndarray:
+    # Una sola llamada al modelo para todo el lote
+    if motor is not None:
+        columnas = [JIRA_FEATURES.index(f) for f in motor.feature_names or JIRA_FEATURES]
+        Xm = X[:, columnas].astype(np.float32)
+        if pool_shards.aplica(len(X)):
+            return pool_shards.predict(motor, Xm)
+        return motor.predict(Xm)
+    # El DataFrame del modelo MLflow se cuenta dentro de la etapa "modelo" del que llama:
+    # una etapa anidada sumaría el mismo tiempo dos veces
+    return modelo.predict(matriz_jira(X))
+
+class TablaTiempos:
+    """
+    Horas estimadas por un modelo para toda la grilla de equipos x tipos x
+    JIRA_LOOKUP_STORY_POINTS x SPRINTS_GRILLA, calculadas con una sola llamada
+    al modelo al activarlo. Los ejes se indexan con los códigos de
+    TEAM_MAPPING y TIPO_MAPPING. Guarda la salida del mismo modelo y motor
+    que puntúan en vivo, así que una búsqueda da exactamente la misma
+    estimación; las filas fuera de la grilla se puntúan con el modelo.
+    """
+
+    def __init__(self, modelo, motor, version, story_points=JIRA_LOOKUP_STORY_POINTS):
+        self.modelo  = modelo
+        self.motor   = motor
+        self.version = version
+        self.story_points = np.unique(np.asarray(story_points, dtype=np.float64))
+        inicio = time.perf_counter()
+        ejes = (np.arange(len(TEAM_MAPPING)), np.arange(len(TIPO_MAPPING)), self.story_points, SPRINTS_GRILLA)
+        grilla = np.stack(np.meshgrid(*ejes, indexing="ij"), axis=-1).reshape(-1, len(ejes)).astype(np.float64)
+        # Con el dtype de salida del modelo (float32 en XGBoost): compacta y sin redondeo
+        self.horas = np.asarray(_horas(grilla, modelo, motor)).reshape(tuple(len(e) for e in ejes))
+        self.construccion_ms = round((time.perf_counter() - inicio) * 1000, 3)
+        self._lock = threading.Lock()
+        self.aciertos = self.fallos = 0
+        logging.info(f"Tabla de estimaciones Jira: {self.horas.size} combinaciones en {self.construccion_ms} ms")
+
+    def aplica(self, modelo, motor) -> bool:
+        return self.modelo is modelo and self.motor is motor
+
+    def buscar(self, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Horas de las filas de X (en el orden de JIRA_FEATURES) que caen en la grilla, y la máscara de esas filas."""
+        story_points, sprints = X[:, 2], X[:, 3]
+        j = np.minimum(np.searchsorted(self.story_points, story_points), len(self.story_points) - 1)
+        en_grilla = ((self.story_points[j] == story_points) & (sprints >= SPRINTS_GRILLA[0])
+                     & (sprints <= SPRINTS_GRILLA[-1]) & (sprints == np.floor(sprints)))
+        horas = self.horas[X[en_grilla, 0].astype(np.intp), X[en_grilla, 1].astype(np.intp), j[en_grilla],
+                           sprints[en_grilla].astype(np.intp) - SPRINTS_GRILLA[0]]
+        aciertos = len(horas)
+        with self._lock:
+            self.aciertos += aciertos
+            self.fallos   += len(X) - aciertos
+        return horas, en_grilla
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            aciertos, fallos = self.aciertos, self.fallos
+        return {
+            "version": self.version,
+            "combinaciones": int(self.horas.size),
+            "bytes": int(self.horas.nbytes),
+            "story_points": self.story_points.tolist(),
+            "construccion_ms": self.construccion_ms,
+            "aciertos": aciertos,
+            "fallos": fallos,
+        }
+
+def _estimar(X: np.ndarray, modelo, motor) -> np.ndarray:
+    # Horas en float64: de la tabla si la fila está en la grilla, del modelo si no
+    tabla = tabla_tiempos
+    if tabla is None or not tabla.aplica(modelo, motor):
+        return np.asarray(_horas(X, modelo, motor), dtype=np.float64)
+    desde_tabla, en_grilla = tabla.buscar(X)
+    if len(desde_tabla) == len(X):
+        return desde_tabla.astype(np.float64)
+    horas = np.empty(len(X), dtype=np.float64)
+    horas[en_grilla] = desde_tabla
+    horas[~en_grilla] = _horas(X[~en_grilla], modelo, motor)
+    return horas
+
+def horas_matriz(X: np.ndarray) -> tuple[np.ndarray, str | None]:
+    """
+    Horas estimadas (mínimo 1) de una matriz issues x JIRA_FEATURES ya
+    validada, con la tabla de estimaciones y una sola llamada al modelo para
+    el resto, y la versión del modelo usado. Es el camino de /predict/time/plan.
+    """
+    modelo, motor, version = modelo_activo()
+    if modelo is None:
+        logging.error("Modelo no cargado")
+        raise HTTPException(status_code=503, detail="Modelo no disponible")
+    return np.maximum(_estimar(X, modelo, motor), 1.0), version
+
+def filas_tiempo_jira(issues: list[JiraIssueInput]) -> list[dict]:
+    """
+    Predicción de cada issue como dict con las claves de JiraTimePrediction,
+    con una sola llamada al modelo para todo el lote (solo para las filas
+    fuera de la tabla de estimaciones). /predict/time/batch
+    las serializa directo. Los textos de nivel y recomendación son
+    constantes compartidas por todas las filas.
+    """
+    if not issues:
+        return []
+    modelo, motor, version = modelo_activo()
+    if modelo is None:
         logging.error("Modelo no cargado")
         raise HTTPException(status_code=503, detail="Modelo no disponible")
-    
     try:
-        # Preparar features
-        team_encoded = TEAM_MAPPING.get(issue.team, 0)
-        tipo_encoded = TIPO_MAPPING.get(issue.tipo_de_issue, 0)
-        
-        # Crear DataFrame con las features en el orden correcto
-        data = pd.DataFrame([{
-            'team_encoded': team_encoded,
-            'tipo_encoded': tipo_encoded,
-            'story_points': issue.story_points,
-            'sprint_numbers': issue.sprint_numbers
-        }])
-        
-        # Predecir
-        tiempo_horas = float(model.predict(data)[0])
-        # Asegurar que el tiempo no sea negativo (mínimo 1 hora)
-        tiempo_horas = max(tiempo_horas, 1.0)
-        tiempo_dias = tiempo_horas / 24
-        
-        # Determinar nivel de confianza y recomendación
-        if tiempo_dias <= 7:
-            nivel = "Alta"
-            recomendacion = "Issue simple, desarrollo rápido esperado"
-        elif tiempo_dias <= 20:
-            nivel = "Media"
-            recomendacion = "Issue estándar, seguimiento normal"
-        elif tiempo_dias <= 40:
-            nivel = "Media-Baja"
-            recomendacion = "Issue compleja, requiere planificación detallada"
-        else:
-            nivel = "Baja"
-            recomendacion = "Issue muy compleja, considerar dividir en subtasks"
-        
-        return JiraTimePrediction(
-            equipo=issue.team,
-            tipo_issue=issue.tipo_de_issue,
-            story_points=issue.story_points,
-            sprints=issue.sprint_numbers,
-            tiempo_estimado_horas=round(tiempo_horas, 2),
-            tiempo_estimado_dias=round(tiempo_dias, 2),
-            nivel_confianza=nivel,
-            recomendacion=recomendacion
-        )
-    
+        with etapa("matriz"):
+            X = matriz_issues(issues)
+        with etapa("modelo"):
+            # El tiempo no puede ser negativo (mínimo 1 hora)
+            horas = np.maximum(_estimar(X, modelo, motor), 1.0)
+        with etapa("reglas"):
+            dias = horas / 24
+            nivel = np.searchsorted(LIMITES_DIAS, dias, side="left")
+            filas = [
+                {
+                    "equipo": issue.team,
+                    "tipo_issue": issue.tipo_de_issue,
+                    "story_points": issue.story_points,
+                    "sprints": issue.sprint_numbers,
+                    "tiempo_estimado_horas": round(h, 2),
+                    "tiempo_estimado_dias": round(d, 2),
+                    "nivel_confianza": n,
+                    "recomendacion": r,
+                }
+                for issue, h, d, n, r in zip(issues, horas.tolist(), dias.tolist(),
+                                             NIVELES_CONFIANZA[nivel].tolist(), RECOMENDACIONES[nivel].tolist())
+            ]
     except Exception as e:
         logging.error(f"Error en predicción Jira: {e}")
         raise HTTPException(status_code=500, detail="Error interno en la predicción")
+    if auditoria.activa:
+        auditoria.registrar(len(issues), time.time(), version, ruta_actual(),
+                            {campo: [getattr(i, campo) for i in issues] for campo in JiraIssueInput.model_fields},
+                            filas)
+    return filas
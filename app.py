@@ -1,133 +1,163 @@
+"""
+Gateway: la German Credit Risk API y la Jira Time Prediction API en un solo
+proceso, con un intérprete y una copia de pandas, MLflow y XGBoost.
 
-import mlflow
-import mlflow.sklearn
-import pandas as pd
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-
-# --- models.py ---
-# Modelos de entrada y salida para la API
-from pydantic import BaseModel, Field
-
-class ClienteInput(BaseModel):
-   Age:              int   = Field(..., ge=18, le=100, example=35)
-   Sex:              int   = Field(..., ge=0,  le=1,   example=1)
-   Job:              int   = Field(..., ge=0,  le=3,   example=2)
-   Housing:          int   = Field(..., ge=0,  le=2,   example=1)
-   Saving_accounts:  int   = Field(..., ge=0,  le=4,   example=1)
-   Checking_account: int   = Field(..., ge=0,  le=3,   example=1)
-   Credit_amount:    float = Field(..., gt=0,          example=1500)
-   Duration:         int   = Field(..., gt=0,          example=12)
-   Purpose:          int   = Field(..., ge=0,  le=7,   example=4)
-
-class PrediccionOutput(BaseModel):
-   risk:             str
-   probability_good: float
-   probability_bad:  float
-   recommendation:   str
-
-class BatchPrediccionOutput(BaseModel):
-   total: int
-   predicciones: list[PrediccionOutput]
-
-# --- predict_logic.py ---
-# Lógica de predicción separada
-import mlflow
-import mlflow.sklearn
-import pandas as pd
-import logging
-from fastapi import HTTPException
-from models import ClienteInput, PrediccionOutput
-
-MLFLOW_TRACKING_URI = "http://44.211.88.225:5000"
-MODEL_NAME          = "GermanCreditRisk-XGBoost"
-MODEL_ALIAS         = "production"
-mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
-try:
-   logging.info(f"Cargando modelo {MODEL_NAME}@{MODEL_ALIAS}...")
-   model = mlflow.sklearn.load_model(f"models:/{MODEL_NAME}@{MODEL_ALIAS}")
-   logging.info("Modelo cargado correctamente")
-except Exception as e:
-   logging.error(f"Error cargando el modelo: {e}")
-   model = None
-
-def realizar_prediccion(cliente: ClienteInput) -> PrediccionOutput:
-   if model is None:
-      logging.error("Modelo no cargado")
-      raise HTTPException(status_code=503, detail="Modelo no disponible")
-   try:
-      data  = pd.DataFrame([cliente.model_dump()])
-      pred  = model.predict(data)[0]
-      proba = model.predict_proba(data)[0]
-      risk      = "good" if pred == 1 else "bad"
-      prob_good = float(proba[1])
-      prob_bad  = float(proba[0])
-      if prob_good >= 0.75:
-         recommendation = "Aprobar credito — bajo riesgo"
-      elif prob_good >= 0.50:
-         recommendation = "Revisar manualmente — riesgo moderado"
-      else:
-         recommendation = "Rechazar credito — alto riesgo"
-      return PrediccionOutput(
-         risk=risk,
-         probability_good=round(prob_good, 4),
-         probability_bad=round(prob_bad, 4),
-         recommendation=recommendation
-      )
-   except Exception as e:
-      logging.error(f"Error en predicción: {e}")
-      raise HTTPException(status_code=500, detail="Error interno en la predicción")
-
-# --- main.py (endpoints) ---
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from models import ClienteInput, PrediccionOutput, BatchPrediccionOutput
-from predict_logic import realizar_prediccion, model, MODEL_NAME, MODEL_ALIAS
+Las rutas de cada API se sirven en su path de siempre (/predict,
+/predict/batch, /predict/time, /info/teams, ...). Los endpoints que ambas
+tienen (/, /health, /metrics, /docs, /admin/profiles) quedan bajo /german y
+/jira. /, /health y /metrics de la raíz son los del gateway. Los modelos los
+maneja un RegistroModelos (serving/registry.py): cada uno se carga en la
+primera solicitud que lo usa y se descarga tras un tiempo sin uso.
+
+    python app.py    # o: uvicorn app:app --port 8080
+"""
+import os
+import sys
+from contextlib import asynccontextmanager
+import anyio.to_thread
+from fastapi import FastAPI, Response
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute, APIWebSocketRoute
 import uvicorn
 
-app = FastAPI(
-   title="German Credit Risk API",
-   description="API de predicción de riesgo crediticio — Maestría IA USA",
-   version="1.0.0"
-)
-app.add_middleware(
-   CORSMiddleware,
-   allow_origins=["*"],
-   allow_methods=["*"],
-   allow_headers=["*"],
+# Cada API importa sus módulos planos (main, models, jira_api, ...) desde su carpeta
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+for carpeta in ("GermanCreditRiskAPI", "JiraTimePredictionAPI"):
+    sys.path.append(os.path.join(RAIZ, carpeta))
+
+import main as german_api
+import predict_logic
+import jira_api
+import jira_predict_logic
+from serving import metrics
+from serving.registry import RegistroModelos
+
+# Hilos del pool donde corren los handlers sync (la inferencia) de ambas APIs
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "40"))
+# Modelos que se cargan al arrancar en lugar de en la primera solicitud, p. ej. "german,jira"
+GATEWAY_PRELOAD   = [m.strip() for m in os.getenv("GATEWAY_PRELOAD", "").split(",") if m.strip()]
+GATEWAY_PORT      = int(os.getenv("GATEWAY_PORT", "8080"))
+
+registro_modelos = RegistroModelos()
+registro_modelos.registrar("german", predict_logic.cargador, lambda: predict_logic.modelo_activo()[0])
+registro_modelos.registrar("jira", jira_predict_logic.cargador, lambda: jira_predict_logic.modelo_activo()[0])
+metrics.gauges_registro(registro_modelos)
+# Las conexiones WebSocket duran horas: cada lote, y no solo la conexión, marca el uso del modelo
+german_api.canal_ws.antes_de_lote = lambda: registro_modelos.usar("german")
+jira_api.canal_ws.antes_de_lote = lambda: registro_modelos.usar("jira")
+
+# nombre -> (app, prefijo de sus endpoints compartidos, rutas que necesitan el modelo)
+APIS = {
+    "german": (german_api.app, "/german", set(german_api.admision)),
+    "jira":   (jira_api.app, "/jira", set(jira_api.admision)),
+}
+# Paths que existen en ambas APIs o en el gateway: solo se alcanzan con prefijo
+COMPARTIDAS = {"/", "/health", "/health/live", "/health/ready", "/metrics"}
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Un solo pool de hilos de inferencia para ambas APIs (en lugar de uno por proceso)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = INFERENCE_THREADS
+    for nombre in GATEWAY_PRELOAD:
+        registro_modelos.cargar(nombre)
+    registro_modelos.iniciar()
+    for modulo in (predict_logic, jira_predict_logic):
+        modulo.auditoria.iniciar()
+    yield
+    registro_modelos.detener()
+    for modulo in (predict_logic, jira_predict_logic):
+        modulo.auditoria.detener()
+
+gateway = FastAPI(
+    title="MLOps Gateway",
+    description="German Credit Risk API y Jira Time Prediction API en un solo proceso",
+    version="1.0.0",
+    lifespan=ciclo_de_vida
 )
 
-@app.post("/predict", response_model=PrediccionOutput)
-def predict(cliente: ClienteInput):
-   return realizar_prediccion(cliente)
-
-@app.post("/predict/batch", response_model=BatchPrediccionOutput)
-def predict_batch(clientes: list[ClienteInput]):
-   from fastapi import HTTPException
-   try:
-      resultados = [realizar_prediccion(c) for c in clientes]
-      return BatchPrediccionOutput(total=len(resultados), predicciones=resultados)
-   except HTTPException as e:
-      raise e
-   except Exception as e:
-      import logging
-      logging.error(f"Error en predicción batch: {e}")
-      raise HTTPException(status_code=500, detail="Error interno en la predicción batch")
-
-@app.get("/")
+@gateway.get("/")
 def root():
-   return {
-      "api":    "German Credit Risk API",
-      "version": "1.0.0",
-      "model":  f"{MODEL_NAME}@{MODEL_ALIAS}",
-      "status": "running"
-   }
-
-@app.get("/health")
+    return {
+        "api": "MLOps Gateway",
+        "version": "1.0.0",
+        "apis": {nombre: {"prefijo": prefijo, "docs": f"{prefijo}/docs"}
+                 for nombre, (_, prefijo, _) in APIS.items()},
+        "status": "running"
+    }
+
+@gateway.get("/health")
 def health():
-   return {"status": "healthy", "model_loaded": model is not None}
+    """Estado, versión, memoria estimada e inactividad de cada modelo del registro."""
+    return {"status": "healthy", "registro": registro_modelos.estado()}
+
+@gateway.get("/health/live")
+def liveness():
+    return {"status": "alive"}
+
+@gateway.get("/health/ready")
+def readiness(response: Response):
+    """Listo salvo que la última carga de algún modelo haya fallado; los no cargados se cargan al usarse."""
+    modelos = registro_modelos.estado()["modelos"]
+    listo = all(m["fase"] != "error" for m in modelos.values())
+    if not listo:
+        response.status_code = 503
+    return {"ready": listo, "modelos": {nombre: m["fase"] for nombre, m in modelos.items()}}
+
+@gateway.get("/metrics", response_class=PlainTextResponse)
+def metricas():
+    """Métricas de ambas APIs y del registro en formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.registro.exportar(), media_type="text/plain; version=0.0.4")
+
+def _sin_prefijo(scope, prefijo: str) -> dict:
+    # root_path hace que /docs de la API apunte a {prefijo}/openapi.json
+    ruta = scope["path"][len(prefijo):] or "/"
+    return {**scope, "path": ruta, "raw_path": ruta.encode(), "root_path": scope.get("root_path", "") + prefijo}
+
+class Gateway:
+    """
+    App ASGI del proceso. Envía cada solicitud a la API dueña del path (o del
+    prefijo), con sus propios middlewares de admisión, métricas y profiling.
+    Antes de una ruta que usa el modelo, el registro lo carga si hace falta,
+    y lo marca en uso hasta que termina la respuesta.
+    Lo demás, incluido el lifespan, va a la app del gateway.
+    """
+
+    def __init__(self, app, apis: dict, registro: RegistroModelos):
+        self.app = app
+        self.registro = registro
+        self.rutas = {}      # path -> (nombre, app)
+        self.prefijos = []   # (prefijo, nombre, app)
+        self.rutas_modelo = {nombre: rutas for nombre, (_, _, rutas) in apis.items()}
+        for nombre, (api, prefijo, _) in apis.items():
+            self.prefijos.append((prefijo, nombre, api))
+            for ruta in api.routes:
+                if (isinstance(ruta, (APIRoute, APIWebSocketRoute)) and ruta.path not in COMPARTIDAS
+                        and not ruta.path.startswith("/admin/")):
+                    if ruta.path in self.rutas:
+                        raise RuntimeError(f"{ruta.path} existe en {self.rutas[ruta.path][0]} y en {nombre}")
+                    self.rutas[ruta.path] = (nombre, api)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            destino = self.rutas.get(scope["path"])
+            if destino is None:
+                for prefijo, nombre, api in self.prefijos:
+                    if scope["path"] == prefijo or scope["path"].startswith(prefijo + "/"):
+                        scope, destino = _sin_prefijo(scope, prefijo), (nombre, api)
+                        break
+            if destino is not None:
+                nombre, api = destino
+                if scope["path"] in self.rutas_modelo[nombre]:
+                    # Hasta el último byte de la respuesta (p. ej. /predict/stream) el modelo queda en uso
+                    with self.registro.en_uso(nombre):
+                        await self.registro.usar(nombre)
+                        await api(scope, receive, send)
+                    return
+                await api(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+app = Gateway(gateway, APIS, registro_modelos)
 
 if __name__ == "__main__":
-   uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
\ No newline at end of file
+    uvicorn.run("app:app", host="0.0.0.0", port=GATEWAY_PORT, reload=False)
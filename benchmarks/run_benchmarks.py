@@ -0,0 +1,279 @@
+"""
+Benchmarks offline de los caminos de scoring de ambas APIs.
+
+No usa MLflow ni red: entrena modelos XGBoost sustitutos con el mismo esquema
+que ClienteInput y JiraIssueInput, los publica con `activar_modelo` y mide
+las funciones de predicción y los endpoints batch a través de la app ASGI.
+
+    python benchmarks/run_benchmarks.py                               # tabla de resultados
+    python benchmarks/run_benchmarks.py --quick --compare benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+
+Con `--compare`, termina con código 1 si algún caso pierde más de
+`--threshold` de throughput o su p50 crece más de `--latency-threshold`.
+El p99 se informa pero no se compara: con pocas repeticiones es muy ruidoso.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAMANOS_COMPLETO = [1, 10, 100, 1_000, 10_000, 100_000]
+TAMANOS_RAPIDO   = [1, 10, 100, 1_000]
+
+def preparar_entorno():
+    """Configura las APIs para correr sin registro ni cache antes de importarlas."""
+    os.environ["MODEL_OFFLINE"] = "1"
+    os.environ["MODEL_WATCH_INTERVAL"] = "0"
+    os.environ["MODEL_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-model-cache-")
+    # Sin cache de predicciones ni coalescer: se mide el camino completo
+    os.environ["PREDICTION_CACHE_SIZE"] = "0"
+    os.environ["COALESCE_ENABLED"] = "0"
+    os.environ.setdefault("ADMISSION_MAX_QUEUE", "1000")
+    for api in ("GermanCreditRiskAPI", "JiraTimePredictionAPI"):
+        sys.path.insert(0, os.path.join(RAIZ, api))
+
+class MedidorRSS:
+    """RSS pico del proceso durante un caso, muestreando /proc/self/statm."""
+
+    def __init__(self, intervalo: float = 0.005):
+        self.intervalo = intervalo
+        self.pico = 0
+        self._detener = threading.Event()
+        self._pagina = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._pagina
+        except OSError:
+            # Sin /proc solo queda el pico de toda la vida del proceso (KB en Linux, bytes en macOS)
+            maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maximo if platform.system() == "Darwin" else maximo * 1024
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            self.pico = max(self.pico, self._rss())
+
+    def __enter__(self):
+        self.pico = self._rss()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._detener.set()
+        self._hilo.join()
+        self.pico = max(self.pico, self._rss())
+
+def medir(funcion, filas: int, min_segundos: float, min_reps: int, max_reps: int) -> dict:
+    if filas < 10_000:
+        funcion()   # calentamiento (se omite en lotes grandes, donde el primer llamado pesa poco)
+    latencias = []
+    with MedidorRSS() as rss:
+        inicio = time.perf_counter()
+        while len(latencias) < max_reps and (len(latencias) < min_reps or time.perf_counter() - inicio < min_segundos):
+            t0 = time.perf_counter()
+            funcion()
+            latencias.append(time.perf_counter() - t0)
+        total = time.perf_counter() - inicio
+    latencias = np.array(latencias) * 1000
+    return {
+        "filas": filas,
+        "repeticiones": len(latencias),
+        "filas_por_s": round(filas * len(latencias) / total, 1),
+        "p50_ms": round(float(np.percentile(latencias, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencias, 99)), 4),
+        "rss_pico_mb": round(rss.pico / 2**20, 1),
+    }
+
+def clientes_sinteticos(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Age":              rng.integers(18, 101, n),
+        "Sex":              rng.integers(0, 2, n),
+        "Job":              rng.integers(0, 4, n),
+        "Housing":          rng.integers(0, 3, n),
+        "Saving_accounts":  rng.integers(0, 5, n),
+        "Checking_account": rng.integers(0, 4, n),
+        "Credit_amount":    rng.uniform(250, 20000, n).round(2),
+        "Duration":         rng.integers(4, 73, n),
+        "Purpose":          rng.integers(0, 8, n),
+    })
+
+def issues_sinteticos(n: int, equipos: list, tipos: list, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "team": rng.choice(equipos, n),
+        "tipo_de_issue": rng.choice(tipos, n),
+        "story_points": rng.choice([0.0, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0], n),
+        "sprint_numbers": rng.integers(1, 11, n),
+    })
+
+def modelos_sustitutos(arboles: int, profundidad: int):
+    """Modelos entrenados en el momento, con semilla fija, con el esquema de producción."""
+    from xgboost import XGBClassifier, XGBRegressor
+    from jira_predict_logic import TEAM_MAPPING, TIPO_MAPPING, JIRA_FEATURES
+    X = clientes_sinteticos(5000)
+    y = ((X["Checking_account"] >= 2) | (X["Credit_amount"] < 4000) & (X["Duration"] < 36)).astype(int)
+    credito = XGBClassifier(n_estimators=arboles, max_depth=profundidad, random_state=42).fit(X, y)
+
+    issues = issues_sinteticos(5000, list(TEAM_MAPPING), list(TIPO_MAPPING))
+    Xj = pd.DataFrame({
+        "team_encoded": issues["team"].map(TEAM_MAPPING),
+        "tipo_encoded": issues["tipo_de_issue"].map(TIPO_MAPPING),
+        "story_points": issues["story_points"],
+        "sprint_numbers": issues["sprint_numbers"],
+    })[JIRA_FEATURES]
+    yj = 24 * (Xj["story_points"] * 3 + Xj["sprint_numbers"] * 5 + Xj["tipo_encoded"])
+    jira = XGBRegressor(n_estimators=arboles, max_depth=profundidad, random_state=42).fit(Xj, yj)
+    return credito, jira
+
+def _post(cliente, ruta: str, payload) -> callable:
+    # El cuerpo se serializa una vez: se mide el servidor y no el cliente de prueba
+    cuerpo = json.dumps(payload).encode()
+    headers = {"content-type": "application/json"}
+
+    def enviar():
+        response = cliente.post(ruta, content=cuerpo, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{ruta} respondió {response.status_code}: {response.text[:200]}")
+    return enviar
+
+def _frames_ws(conexion, payload, frames: int) -> callable:
+    # `frames` entradas sueltas por la misma conexión, sin esperar cada respuesta
+    textos = [json.dumps({"id": i, "input": payload}) for i in range(frames)]
+
+    def enviar():
+        for texto in textos:
+            conexion.send_text(texto)
+        for _ in range(frames):
+            if "result" not in conexion.receive_json():
+                raise RuntimeError("el canal WebSocket respondió con error")
+    return enviar
+
+def correr(tamanos: list[int], arboles: int, profundidad: int, min_segundos: float,
+           max_filas_jira: int) -> dict:
+    from fastapi.testclient import TestClient
+    import main
+    import jira_api
+    import predict_logic
+    import jira_predict_logic
+    from models import ClienteInput
+    from jira_models import JiraIssueInput
+    from jira_predict_logic import TEAM_MAPPING, TIPO_MAPPING
+
+    credito, jira = modelos_sustitutos(arboles, profundidad)
+    predict_logic.activar_modelo(credito, "benchmark")
+    jira_predict_logic.activar_modelo(jira, "benchmark")
+    cliente_credito, cliente_jira = TestClient(main.app), TestClient(jira_api.app)
+
+    def caso(nombre, funcion, filas, max_reps=100_000):
+        # Casos grandes: pocas repeticiones alcanzan para estabilizar el throughput
+        min_reps = 1 if filas >= 10_000 else 5
+        resultado = medir(funcion, filas, min_segundos, min_reps, max_reps)
+        resultados[nombre] = resultado
+        print(f"{nombre:<42} {resultado['filas_por_s']:>14,.0f} {resultado['p50_ms']:>11.3f} "
+              f"{resultado['p99_ms']:>11.3f} {resultado['rss_pico_mb']:>9.1f}", flush=True)
+
+    resultados = {}
+    print(f"{'caso':<42} {'filas/s':>14} {'p50 ms':>11} {'p99 ms':>11} {'RSS MB':>9}")
+    cliente = ClienteInput(**clientes_sinteticos(1, seed=1).iloc[0].to_dict())
+    caso("realizar_prediccion", lambda: predict_logic.realizar_prediccion(cliente), 1)
+    issue = JiraIssueInput(**issues_sinteticos(1, list(TEAM_MAPPING), list(TIPO_MAPPING), seed=1).iloc[0].to_dict())
+    caso("predecir_tiempo_jira", lambda: jira_predict_logic.predecir_tiempo_jira(issue), 1)
+    # Una entrada por llamada: solicitud HTTP por entrada frente a frames por una conexión WebSocket
+    payload = cliente.model_dump()
+    caso("POST /predict", _post(cliente_credito, "/predict", payload), 1)
+    with cliente_credito.websocket_connect("/predict/ws") as conexion:
+        caso("WS /predict/ws [1000 frames]", _frames_ws(conexion, payload, 1000), 1000)
+
+    for n in tamanos:
+        X = clientes_sinteticos(n, seed=2)
+        caso(f"POST /predict/batch [{n}]",
+             _post(cliente_credito, "/predict/batch", X.to_dict(orient="records")), n)
+        caso(f"POST /predict/batch/columns [{n}]",
+             _post(cliente_credito, "/predict/batch/columns", {c: X[c].tolist() for c in X.columns}), n)
+        if n > max_filas_jira:
+            print(f"{f'POST /predict/time/batch [{n}]':<42} omitido (--max-jira-rows {max_filas_jira})")
+            continue
+        issues = issues_sinteticos(n, list(TEAM_MAPPING), list(TIPO_MAPPING), seed=2)
+        caso(f"POST /predict/time/batch [{n}]",
+             _post(cliente_jira, "/predict/time/batch", issues.to_dict(orient="records")), n)
+        caso(f"POST /predict/time/plan [{n}]",
+             _post(cliente_jira, "/predict/time/plan", issues.to_dict(orient="records")), n)
+    return resultados
+
+def comparar(resultados: dict, base: dict, umbral: float, umbral_latencia: float) -> list[str]:
+    """Regresiones respecto de la línea base: menos throughput o más p50 que lo tolerado."""
+    regresiones = []
+    for nombre, actual in resultados.items():
+        previo = base.get(nombre)
+        if previo is None:
+            continue
+        caida = 1 - actual["filas_por_s"] / previo["filas_por_s"]
+        if caida > umbral:
+            regresiones.append(f"{nombre}: throughput {previo['filas_por_s']:,.0f} -> "
+                               f"{actual['filas_por_s']:,.0f} filas/s (-{caida:.0%})")
+        aumento = actual["p50_ms"] / previo["p50_ms"] - 1 if previo["p50_ms"] > 0 else 0
+        if aumento > umbral_latencia:
+            regresiones.append(f"{nombre}: p50 {previo['p50_ms']:.3f} -> {actual['p50_ms']:.3f} ms (+{aumento:.0%})")
+    return regresiones
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks offline de los caminos de scoring")
+    parser.add_argument("--quick", action="store_true", help=f"Solo lotes de {TAMANOS_RAPIDO}")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=None,
+                        help="Tamaños de lote separados por coma (default: 1 a 100k)")
+    parser.add_argument("--trees", type=int, default=100, help="Árboles de los modelos sustitutos")
+    parser.add_argument("--depth", type=int, default=6, help="Profundidad de los modelos sustitutos")
+    parser.add_argument("--max-jira-rows", type=int, default=100_000,
+                        help="Tope de filas para /predict/time/batch")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="Tiempo mínimo por caso")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON de línea base contra el cual comparar")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Caída de throughput tolerada")
+    parser.add_argument("--latency-threshold", type=float, default=0.25, help="Aumento de p50 tolerado")
+    parser.add_argument("--save-baseline", metavar="BASELINE", help="Guarda los resultados como línea base")
+    parser.add_argument("--output", help="Guarda los resultados en JSON")
+    args = parser.parse_args(argv)
+
+    preparar_entorno()
+    import logging
+    # El cargador de fondo falla a propósito (cache vacía y sin registro); el modelo lo publica el benchmark
+    logging.disable(logging.ERROR)
+    tamanos = args.sizes or (TAMANOS_RAPIDO if args.quick else TAMANOS_COMPLETO)
+    resultados = correr(tamanos, args.trees, args.depth, args.min_seconds, args.max_jira_rows)
+    documento = {
+        "entorno": {"python": platform.python_version(), "maquina": platform.machine(),
+                    "cpus": os.cpu_count(), "arboles": args.trees, "profundidad": args.depth},
+        "resultados": resultados,
+    }
+    for ruta in filter(None, (args.output, args.save_baseline)):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(documento, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {ruta}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            base = json.load(f)
+        if (base["entorno"]["arboles"], base["entorno"]["profundidad"]) != (args.trees, args.depth):
+            print("Aviso: la línea base usó otros modelos sustitutos; la comparación no es válida")
+        regresiones = comparar(resultados, base["resultados"], args.threshold, args.latency_threshold)
+        if regresiones:
+            print("\nRegresiones respecto de la línea base:")
+            for r in regresiones:
+                print(f"  - {r}")
+            return 1
+        print(f"\nSin regresiones respecto de {args.compare}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
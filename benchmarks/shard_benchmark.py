@@ -0,0 +1,112 @@
+"""
+Throughput de lotes muy grandes: en el proceso frente a repartidos en shards
+entre el pool de procesos de serving/sharding.py.
+
+Publica los modelos sustitutos de run_benchmarks.py y mide `puntuar_filas`
+(German) y `filas_tiempo_jira` (Jira) con lotes de 1k, 100k y 1M filas en
+tres modos:
+
+- `xgboost`: el predictor de XGBoost, el camino por defecto para lotes grandes;
+- `numpy`:   el ensamble compilado en el hilo de la solicitud;
+- `shards`:  el mismo ensamble repartido entre `--workers` procesos más el hilo de la solicitud.
+
+El modo `numpy` se limita a `--max-numpy-rows` (100k): recorre todos los
+árboles a la vez para todo el lote, y con 1M de filas sus temporales pasan
+de varios GB. En `shards`, `--shard-rows` acota lo mismo por shard.
+
+    python benchmarks/shard_benchmark.py
+    python benchmarks/shard_benchmark.py --workers 7 --shard-rows 50000
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run_benchmarks import preparar_entorno, medir, modelos_sustitutos, clientes_sinteticos, issues_sinteticos
+
+TAMANOS = [1_000, 100_000, 1_000_000]
+MODOS = ("xgboost", "numpy", "shards")
+
+def correr(tamanos: list[int], workers: int, filas_shard: int, max_filas_numpy: int, arboles: int, profundidad: int,
+           min_segundos: float) -> dict:
+    import predict_logic
+    import jira_predict_logic
+    from jira_models import JiraIssueInput
+    from jira_predict_logic import TEAM_MAPPING, TIPO_MAPPING
+    from serving.tree_engine import compilar_modelo
+    from serving.sharding import PoolShards
+
+    credito, jira = modelos_sustitutos(arboles, profundidad)
+    predict_logic.activar_modelo(credito, "benchmark")
+    jira_predict_logic.activar_modelo(jira, "benchmark")
+    motores = {predict_logic: compilar_modelo(credito), jira_predict_logic: compilar_modelo(jira)}
+    pools = {modulo: PoolShards(modulo.__name__, workers=workers, min_filas=1, filas_shard=filas_shard) for modulo in motores}
+
+    def modo(nombre: str):
+        # Fija el motor y el pool de ambas APIs según el modo
+        predict_logic.NATIVE_MAX_ROWS = 0 if nombre == "xgboost" else 1 << 62
+        for modulo, motor in motores.items():
+            modulo.engine = None if (nombre == "xgboost" and modulo is jira_predict_logic) else motor
+            modulo.pool_shards = pools[modulo] if nombre == "shards" else PoolShards(modulo.__name__, min_filas=0)
+
+    for modulo, pool in pools.items():
+        pool.publicar(motores[modulo])
+    resultados = {}
+    print(f"{'caso':<40} {'filas/s':>14} {'p50 ms':>11} {'RSS MB':>9}")
+    try:
+        for n in tamanos:
+            X = clientes_sinteticos(n, seed=3).to_numpy(dtype=np.float64)
+            issues = [JiraIssueInput.model_construct(**i) for i in
+                      issues_sinteticos(n, list(TEAM_MAPPING), list(TIPO_MAPPING), seed=3).to_dict(orient="records")]
+            for nombre in MODOS:
+                if nombre == "numpy" and n > max_filas_numpy:
+                    print(f"{f'[{n}] numpy':<40} omitido (--max-numpy-rows {max_filas_numpy})")
+                    continue
+                modo(nombre)
+                for caso, funcion in ((f"german puntuar_filas [{n}] {nombre}", lambda: predict_logic.puntuar_filas(X)),
+                                      (f"jira filas_tiempo_jira [{n}] {nombre}",
+                                       lambda: jira_predict_logic.filas_tiempo_jira(issues))):
+                    r = medir(funcion, n, min_segundos, 1 if n >= 10_000 else 5, 1000)
+                    resultados[caso] = r
+                    print(f"{caso:<40} {r['filas_por_s']:>14,.0f} {r['p50_ms']:>11.2f} {r['rss_pico_mb']:>9.1f}",
+                          flush=True)
+            del X, issues
+    finally:
+        for pool in pools.values():
+            pool.cerrar()
+    return resultados
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Lotes muy grandes en el proceso frente a shards en un pool")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=TAMANOS)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1),
+                        help="Procesos del pool (el hilo de la solicitud puntúa un shard más)")
+    parser.add_argument("--shard-rows", type=int, default=0, help="Filas por shard (0 = partes iguales)")
+    parser.add_argument("--max-numpy-rows", type=int, default=100_000,
+                        help="Tope de filas para el ensamble NumPy en el hilo de la solicitud")
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--output", help="Guarda los resultados en JSON")
+    args = parser.parse_args(argv)
+
+    preparar_entorno()
+    import logging
+    logging.disable(logging.ERROR)
+    resultados = correr(args.sizes, args.workers, args.shard_rows, args.max_numpy_rows, args.trees, args.depth,
+                        args.min_seconds)
+    if args.output:
+        documento = {"entorno": {"python": platform.python_version(), "cpus": os.cpu_count(),
+                                 "workers": args.workers, "filas_shard": args.shard_rows,
+                                 "arboles": args.trees, "profundidad": args.depth},
+                     "resultados": resultados}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(documento, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Arranque y memoria por worker: modelo MLflow frente a artefacto ligero.
+
+Entrena los modelos sustitutos de run_benchmarks.py, los guarda en una cache
+local de MLflow y como artefactos ligeros (serving/slim.py), y para cada API
+y cada modo lanza procesos nuevos que importan la API, cargan el modelo y
+hacen una predicción. Informa la mediana de cada etapa, el RSS al final y
+qué bibliotecas pesadas quedaron importadas.
+
+Con `--workers N` además levanta cada caso con serving/prefork.py, le manda
+solicitudes y compara la memoria total de los N workers (PSS: las páginas
+compartidas se cuentan una vez) con la de un worker suelto.
+
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --repeats 5 --output arranque.json
+    python benchmarks/startup_benchmark.py --workers 16
+"""
+import os
+import sys
+import json
+import argparse
+import time
+import socket
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIBLIOTECAS = ("mlflow", "pandas", "sklearn", "scipy", "xgboost", "pyarrow")
+
+# Corre en el proceso medido: importa la API, espera el modelo y predice una vez
+SONDA = """
+import os, sys, time, json
+inicio = time.perf_counter()
+sys.path.insert(0, os.path.join({raiz!r}, {carpeta!r}))
+import {api}
+import {logica} as logica
+importado = time.perf_counter()
+logica.cargador.iniciar()
+assert logica.cargador.esperar(120) and logica.cargador.fase == "listo", logica.cargador.error
+cargado = time.perf_counter()
+{prediccion}
+predicho = time.perf_counter()
+estado = dict(l.split(":", 1) for l in open("/proc/self/status") if l.startswith(("VmRSS", "VmHWM")))
+print(json.dumps({{
+    "import_s": importado - inicio, "carga_s": cargado - importado, "prediccion_s": predicho - cargado,
+    "rss_mb": int(estado["VmRSS"].split()[0]) / 1024, "rss_pico_mb": int(estado["VmHWM"].split()[0]) / 1024,
+    "bibliotecas": [b for b in {bibliotecas!r} if b in sys.modules],
+}}))
+"""
+
+APIS = {
+    "german": ("GermanCreditRiskAPI", "main", "predict_logic",
+               "from models import ClienteInput\n"
+               "logica.realizar_prediccion(ClienteInput(Age=35, Sex=1, Job=2, Housing=1, Saving_accounts=1,"
+               " Checking_account=1, Credit_amount=1500.0, Duration=12, Purpose=4))"),
+    "jira":   ("JiraTimePredictionAPI", "jira_api", "jira_predict_logic",
+               "from jira_models import JiraIssueInput\n"
+               "logica.predecir_tiempo_jira(JiraIssueInput(team='ADP', tipo_de_issue='Historia',"
+               " story_points=5.0, sprint_numbers=1))"),
+}
+# Ruta y cuerpo de una solicitud por API, para los workers prefork
+SOLICITUDES = {
+    "german": ("/predict", {"Age": 35, "Sex": 1, "Job": 2, "Housing": 1, "Saving_accounts": 1,
+                            "Checking_account": 1, "Credit_amount": 1500.0, "Duration": 12, "Purpose": 4}),
+    "jira":   ("/predict/time", {"team": "ADP", "tipo_de_issue": "Historia", "story_points": 5.0, "sprint_numbers": 1}),
+}
+
+def preparar_modelos(directorio: str, arboles: int, profundidad: int) -> tuple[str, str]:
+    """Cache MLflow offline y artefactos ligeros de los modelos sustitutos; devuelve ambos directorios."""
+    for carpeta in ("GermanCreditRiskAPI", "JiraTimePredictionAPI"):
+        sys.path.insert(0, os.path.join(RAIZ, carpeta))
+    sys.path[:0] = [RAIZ, os.path.join(RAIZ, "benchmarks")]
+    import mlflow.sklearn
+    from run_benchmarks import modelos_sustitutos
+    from serving.model_store import AlmacenModelos, checksum_directorio
+    from serving.slim import exportar
+    from predict_logic import MODEL_NAME as GERMAN
+    from jira_predict_logic import MODEL_NAME as JIRA
+    cache, ligeros = os.path.join(directorio, "cache"), os.path.join(directorio, "ligeros")
+    almacen = AlmacenModelos(cache)
+    for nombre, modelo in zip((GERMAN, JIRA), modelos_sustitutos(arboles, profundidad)):
+        ruta = os.path.join(cache, nombre, "1")
+        mlflow.sklearn.save_model(modelo, ruta)
+        with open(os.path.join(cache, nombre, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"alias": {"production": "1"}, "versiones": {"1": {"checksum": checksum_directorio(ruta)}}}, f)
+        exportar(modelo, nombre, "1", ligeros)
+    assert almacen.version_local(GERMAN, "production") == "1"
+    return cache, ligeros
+
+def _entorno(modo: str, cache: str, ligeros: str) -> dict:
+    entorno = {k: v for k, v in os.environ.items() if k != "MODEL_SLIM_DIR"}
+    entorno.update({"MODEL_OFFLINE": "1", "MODEL_WATCH_INTERVAL": "0", "MODEL_CACHE_DIR": cache,
+                    "PYTHONPATH": RAIZ})
+    if modo == "ligero":
+        entorno["MODEL_SLIM_DIR"] = ligeros
+    return entorno
+
+def medir(api: str, modo: str, cache: str, ligeros: str, repeticiones: int) -> dict:
+    carpeta, modulo_api, logica, prediccion = APIS[api]
+    codigo = SONDA.format(raiz=RAIZ, carpeta=carpeta, api=modulo_api, logica=logica,
+                          prediccion=prediccion, bibliotecas=BIBLIOTECAS)
+    entorno = _entorno(modo, cache, ligeros)
+    corridas = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", codigo], env=entorno, capture_output=True, text=True, check=True)
+        corridas.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+    resultado = {campo: round(statistics.median(c[campo] for c in corridas), 3)
+                 for campo in ("import_s", "carga_s", "prediccion_s", "rss_mb", "rss_pico_mb")}
+    resultado["total_s"] = round(resultado["import_s"] + resultado["carga_s"] + resultado["prediccion_s"], 3)
+    resultado["bibliotecas"] = corridas[-1]["bibliotecas"]
+    return resultado
+
+def _health(puerto: int) -> dict | None:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/health", timeout=5) as r:
+            return json.load(r)
+    except OSError:
+        return None
+
+def medir_prefork(api: str, modo: str, cache: str, ligeros: str, workers: int, solicitudes: int = 200) -> dict:
+    """Memoria total de `workers` workers prefork ya calentados, según el /health agregado."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    entorno = {**_entorno(modo, cache, ligeros), "PREFORK_HEALTH_INTERVAL": "0.5"}
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen([sys.executable, "-m", "serving.prefork", api, "--workers", str(workers),
+                                "--host", "127.0.0.1", "--port", str(puerto)],
+                               env=entorno, cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        limite = time.monotonic() + 300
+        while True:
+            estado = (_health(puerto) or {}).get("workers")
+            if estado and estado["vivos"] == workers and all(w["estado_hace_s"] is not None for w in estado["detalle"]):
+                break
+            if time.monotonic() > limite or proceso.poll() is not None:
+                raise RuntimeError(f"Los workers de {api}/{modo} no arrancaron")
+            time.sleep(0.2)
+        listo = time.perf_counter() - inicio
+        ruta, cuerpo = SOLICITUDES[api]
+        for _ in range(solicitudes):
+            pedido = urllib.request.Request(f"http://127.0.0.1:{puerto}{ruta}", data=json.dumps(cuerpo).encode(),
+                                            headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(pedido, timeout=30).read()
+        time.sleep(1.5)
+        estado = _health(puerto)["workers"]
+    finally:
+        proceso.terminate()
+        proceso.wait(60)
+    return {"workers": workers, "listo_s": round(listo, 2), "rss_padre_mb": estado["rss_padre_mb"],
+            "rss_total_mb": estado["rss_total_mb"], "pss_total_mb": estado["pss_total_mb"]}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Arranque y RSS por worker: modelo MLflow frente a artefacto ligero")
+    parser.add_argument("--repeats", type=int, default=3, help="Procesos por caso (se informa la mediana)")
+    parser.add_argument("--trees", type=int, default=100, help="Árboles de los modelos sustitutos")
+    parser.add_argument("--depth", type=int, default=6, help="Profundidad de los modelos sustitutos")
+    parser.add_argument("--workers", type=int, default=0, help="También mide N workers con serving/prefork.py")
+    parser.add_argument("--output", help="Guarda los resultados en JSON")
+    args = parser.parse_args(argv)
+
+    resultados, prefork = {}, {}
+    with tempfile.TemporaryDirectory(prefix="bench-arranque-") as directorio:
+        cache, ligeros = preparar_modelos(directorio, args.trees, args.depth)
+        for api in APIS:
+            for modo in ("mlflow", "ligero"):
+                resultados[f"{api}/{modo}"] = medir(api, modo, cache, ligeros, args.repeats)
+                if args.workers:
+                    prefork[f"{api}/{modo}"] = medir_prefork(api, modo, cache, ligeros, args.workers)
+
+    print(f"{'caso':16s} {'import s':>9s} {'carga s':>8s} {'1ª pred s':>9s} {'total s':>8s} {'RSS MB':>7s} {'pico MB':>8s}  bibliotecas")
+    for caso, r in resultados.items():
+        print(f"{caso:16s} {r['import_s']:9.2f} {r['carga_s']:8.2f} {r['prediccion_s']:9.3f} {r['total_s']:8.2f} "
+              f"{r['rss_mb']:7.0f} {r['rss_pico_mb']:8.0f}  {', '.join(r['bibliotecas']) or '-'}")
+    if prefork:
+        print(f"\n{'prefork':16s} {'workers':>8s} {'listo s':>8s} {'RSS padre':>10s} {'Σ RSS MB':>9s} "
+              f"{'Σ PSS MB':>9s} {'1 worker MB':>12s}")
+        for caso, r in prefork.items():
+            print(f"{caso:16s} {r['workers']:8d} {r['listo_s']:8.2f} {r['rss_padre_mb']:10.0f} "
+                  f"{r['rss_total_mb']:9.0f} {r['pss_total_mb']:9.0f} {resultados[caso]['rss_mb']:12.0f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({**resultados, **{f"prefork/{c}": r for c, r in prefork.items()}}, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
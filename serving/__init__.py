@@ -0,0 +1 @@
+"""Componentes de serving compartidos por GermanCreditRiskAPI y JiraTimePredictionAPI."""
@@ -0,0 +1,197 @@
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from serving import metrics
+
+# Límites por defecto de cada endpoint protegido; concurrencia 0 = sin límite (apagado)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0"))
+ADMISSION_MAX_QUEUE       = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Ajustes por endpoint: "/predict=16:128,/predict/batch=2:8" (concurrencia:cola)
+ADMISSION_LIMITS          = os.getenv("ADMISSION_LIMITS", "")
+# Tiempo restante del cliente en milisegundos, relativo a la llegada de la solicitud
+DEADLINE_HEADER = "x-request-deadline-ms"
+
+class Rechazada(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+class Vencida(Exception):
+    pass
+
+class Limitador:
+    """
+    Limita las solicitudes que se ejecutan a la vez en un endpoint, con una
+    cola de espera acotada.
+
+    Con la cola llena se rechaza de inmediato (`Rechazada`, 429) en lugar de
+    dejar que la latencia crezca sin límite. Una solicitud en cola cuyo
+    deadline vence antes de obtener turno se descarta (`Vencida`) sin
+    llegar al modelo. Al salir, el turno pasa directo a la primera solicitud
+    en espera (orden FIFO). Con `max_concurrentes` = 0 no limita: solo
+    cuenta las admitidas y aplica el deadline.
+    """
+
+    def __init__(self, nombre: str, max_concurrentes: int = ADMISSION_MAX_CONCURRENCY,
+                 max_cola: int = ADMISSION_MAX_QUEUE):
+        self.nombre           = nombre
+        self.max_concurrentes = max(0, max_concurrentes)
+        self.max_cola         = max(0, max_cola)
+        self._lock     = threading.Lock()
+        self._en_curso = 0
+        self._cola     = deque()   # futures de las solicitudes en espera
+        self._duracion_media = 0.0   # EWMA del tiempo de servicio, en segundos
+        self._stats = {"admitidas": 0, "rechazadas": 0, "vencidas": 0, "max_cola": 0}
+
+    @property
+    def activo(self) -> bool:
+        return self.max_concurrentes > 0
+
+    def retry_after(self) -> int:
+        """Segundos estimados hasta que se libere lugar en la cola."""
+        espera = (len(self._cola) + 1) * self._duracion_media / self.max_concurrentes
+        return max(1, math.ceil(espera))
+
+    async def entrar(self, deadline: float | None = None):
+        """Espera turno; `deadline` es un instante de time.monotonic()."""
+        if deadline is not None and time.monotonic() >= deadline:
+            with self._lock:
+                self._stats["vencidas"] += 1
+            raise Vencida()
+        with self._lock:
+            if not self.activo or (self._en_curso < self.max_concurrentes and not self._cola):
+                self._en_curso += 1
+                self._stats["admitidas"] += 1
+                return
+            if len(self._cola) >= self.max_cola:
+                self._stats["rechazadas"] += 1
+                raise Rechazada(self.retry_after())
+            turno = asyncio.get_running_loop().create_future()
+            self._cola.append(turno)
+            self._stats["max_cola"] = max(self._stats["max_cola"], len(self._cola))
+        try:
+            restante = None if deadline is None else max(0.0, deadline - time.monotonic())
+            await asyncio.wait_for(asyncio.shield(turno), restante)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if turno in self._cola:
+                    self._cola.remove(turno)
+                    asignado = False
+                else:
+                    asignado = True   # el turno llegó junto con el timeout: se devuelve
+                if isinstance(e, asyncio.TimeoutError):
+                    self._stats["vencidas"] += 1
+            if asignado:
+                self.salir()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise Vencida()
+        with self._lock:
+            self._stats["admitidas"] += 1
+
+    def vencida(self):
+        """Cuenta una solicitud admitida cuyo deadline venció antes de llegar al handler."""
+        with self._lock:
+            self._stats["vencidas"] += 1
+
+    def salir(self, duracion: float | None = None):
+        with self._lock:
+            if duracion is not None:
+                self._duracion_media = 0.8 * self._duracion_media + 0.2 * duracion if self._duracion_media else duracion
+            if self._cola:
+                # El lugar pasa a la siguiente solicitud sin bajar _en_curso
+                turno = self._cola.popleft()
+                turno.get_loop().call_soon_threadsafe(_asignar, turno)
+            else:
+                self._en_curso -= 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "activo": self.activo,
+                "max_concurrentes": self.max_concurrentes,
+                "max_cola": self.max_cola,
+                "en_curso": self._en_curso,
+                "en_cola": len(self._cola),
+                "max_cola_observada": self._stats["max_cola"],
+                "admitidas": self._stats["admitidas"],
+                "rechazadas": self._stats["rechazadas"],
+                "vencidas": self._stats["vencidas"],
+                "duracion_media_ms": round(self._duracion_media * 1000, 3),
+            }
+
+def _asignar(turno):
+    if not turno.done():
+        turno.set_result(None)
+
+def limitadores(rutas: list[str], limites: str = ADMISSION_LIMITS) -> dict[str, Limitador]:
+    """Un Limitador por ruta con los valores por defecto, salvo lo indicado en `limites`."""
+    ajustes = {}
+    for item in filter(None, (p.strip() for p in limites.split(","))):
+        ruta, _, valores = item.partition("=")
+        concurrencia, _, cola = valores.partition(":")
+        ajustes[ruta.strip()] = (int(concurrencia), int(cola) if cola else ADMISSION_MAX_QUEUE)
+    return {ruta: Limitador(ruta, *ajustes.get(ruta, (ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE)))
+            for ruta in rutas}
+
+def _deadline(headers: list) -> float | None:
+    for nombre, valor in headers:
+        if nombre.decode("latin-1").lower() == DEADLINE_HEADER:
+            try:
+                return time.monotonic() + float(valor) / 1000
+            except ValueError:
+                return None
+    return None
+
+class MiddlewareAdmision:
+    """
+    Middleware ASGI de control de admisión. Corre en el event loop, antes de
+    que el handler ocupe un hilo del thread pool, así que las solicitudes en
+    espera no consumen hilos. Solo aplica a las rutas de `limitadores`.
+    El deadline se vuelve a revisar justo antes del handler (después del
+    parseo y la validación): una solicitud admitida con el plazo casi vencido
+    no llega al modelo.
+    """
+
+    def __init__(self, app, limitadores: dict[str, Limitador]):
+        self.app = app
+        self.limitadores = limitadores
+
+    async def __call__(self, scope, receive, send):
+        limitador = self.limitadores.get(scope.get("path")) if scope["type"] == "http" else None
+        if limitador is None:
+            await self.app(scope, receive, send)
+            return
+        deadline = _deadline(scope.get("headers", []))
+        try:
+            await limitador.entrar(deadline)
+        except Rechazada as e:
+            await _responder(send, 429, "Servidor saturado, reintente más tarde",
+                             [(b"retry-after", str(e.retry_after).encode())])
+            return
+        except Vencida:
+            logging.warning(f"Solicitud a {limitador.nombre} descartada: deadline vencido en la cola")
+            await _responder(send, 504, "Deadline de la solicitud vencido antes de procesarla")
+            return
+        metrics.marcar("admitido")
+        if deadline is not None:
+            metrics.asignar_deadline(deadline, limitador.vencida)
+        inicio = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limitador.salir(time.monotonic() - inicio)
+
+async def _responder(send, status: int, detalle: str, headers: list | None = None):
+    cuerpo = json.dumps({"detail": detalle}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(cuerpo)).encode())] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
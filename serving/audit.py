@@ -0,0 +1,293 @@
+"""
+Registro de auditoría de predicciones en Parquet.
+
+    python -m serving.audit german --desde 2026-10-01 --hasta 2026-10-02 --salida octubre.csv
+"""
+import os
+import glob
+import time
+import typing
+import argparse
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+import numpy as np
+
+# Directorio de los registros (uno por modelo adentro); sin definir, la auditoría queda apagada
+AUDIT_DIR            = os.getenv("AUDIT_DIR")
+# Cada cuántos segundos se escribe el buffer, o antes si junta AUDIT_FLUSH_ROWS filas
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "5"))
+AUDIT_FLUSH_ROWS     = int(os.getenv("AUDIT_FLUSH_ROWS", "10000"))
+# Filas que entran en el buffer en memoria; lleno, se aplica AUDIT_DROP_POLICY
+AUDIT_BUFFER_ROWS    = int(os.getenv("AUDIT_BUFFER_ROWS", "200000"))
+# "oldest": se descartan las filas más viejas del buffer; "newest": las que llegan
+AUDIT_DROP_POLICY    = os.getenv("AUDIT_DROP_POLICY", "oldest")
+# Un archivo se cierra al superar este tamaño o esta antigüedad
+AUDIT_MAX_FILE_MB    = float(os.getenv("AUDIT_MAX_FILE_MB", "64"))
+AUDIT_ROTATE_SECONDS = float(os.getenv("AUDIT_ROTATE_SECONDS", "900"))
+
+FORMATO_FECHA = "%Y%m%dT%H%M%S%fZ"
+
+def _tipo(anotacion) -> str:
+    if anotacion is int:
+        return "int64"
+    if anotacion is float:
+        return "float64"
+    if anotacion is bool:
+        return "bool"
+    return "string"   # str y Literal[...]
+
+def esquema_auditoria(modelo_entrada, modelo_salida) -> list[tuple[str, str]]:
+    """
+    Esquema de los registros como (campo, tipo Arrow): ts, versión del
+    modelo y ruta, los campos de entrada y los de salida (modelos pydantic).
+    Una salida con el mismo nombre que una entrada se guarda como
+    `salida_<campo>`. No importa pyarrow: con la auditoría apagada la API no
+    lo carga.
+    """
+    campos = [("ts", "timestamp"), ("model_version", "string"), ("route", "string")]
+    campos += [(n, _tipo(i.annotation)) for n, i in modelo_entrada.model_fields.items()]
+    campos += [(f"salida_{n}" if n in modelo_entrada.model_fields else n, _tipo(i.annotation))
+               for n, i in modelo_salida.model_fields.items()]
+    return campos
+
+def esquema_arrow(campos: list[tuple[str, str]]):
+    """pa.Schema de un esquema de esquema_auditoria."""
+    import pyarrow as pa
+    tipos = {"timestamp": pa.timestamp("us", tz="UTC"), "string": pa.string(), "int64": pa.int64(),
+             "float64": pa.float64(), "bool": pa.bool_()}
+    return pa.schema([pa.field(nombre, tipos[tipo]) for nombre, tipo in campos])
+
+class Auditoria:
+    """
+    Registro de auditoría asincrónico de un modelo.
+
+    `registrar` solo agrega el bloque (entradas y salidas de una llamada al
+    modelo) a un buffer en memoria acotado a `capacidad` filas. Un hilo de
+    fondo lo vacía cada `intervalo` segundos, o al juntar `filas_flush`
+    filas, y lo escribe como un row group en el archivo Parquet abierto
+    (`<nombre>-<apertura>-<pid>.parquet.parcial`). Al rotar, por tamaño o
+    antigüedad, el archivo se cierra y se renombra con el rango de fechas
+    que contiene: `<nombre>-<desde>-<hasta>-<pid>.parquet`. La solicitud
+    nunca espera disco; con el buffer lleno se descartan filas según
+    `politica` y se cuentan en `estadisticas()`.
+    """
+
+    def __init__(self, nombre: str, esquema: list[tuple[str, str]], directorio: str | None = AUDIT_DIR,
+                 capacidad: int = AUDIT_BUFFER_ROWS, politica: str = AUDIT_DROP_POLICY,
+                 intervalo: float = AUDIT_FLUSH_INTERVAL, filas_flush: int = AUDIT_FLUSH_ROWS,
+                 max_archivo_mb: float = AUDIT_MAX_FILE_MB, rotar_s: float = AUDIT_ROTATE_SECONDS):
+        self.nombre     = nombre
+        self.esquema    = esquema
+        self.directorio = os.path.join(directorio, nombre) if directorio else None
+        self.capacidad  = max(1, capacidad)
+        self.politica   = politica if politica in ("oldest", "newest") else "oldest"
+        self.intervalo  = intervalo
+        self.filas_flush    = filas_flush
+        self.max_archivo    = max_archivo_mb * 1024 * 1024
+        self.rotar_s        = rotar_s
+        self._bloques   = deque()   # (filas, bloque)
+        self._filas     = 0
+        self._lock      = threading.Lock()
+        self._lock_escritura = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener   = threading.Event()
+        self._hilo      = None
+        self._esquema   = None      # pa.Schema, armado al escribir por primera vez
+        self._writer    = None
+        self._archivo   = None      # destino del writer: su posición son los bytes escritos
+        self._parcial   = None
+        self._abierto   = None      # time.monotonic() de apertura del archivo
+        self._rango     = None      # (ts mínimo, ts máximo) del archivo abierto, en µs
+        self._stats = {"registradas": 0, "descartadas": 0, "escritas": 0, "archivos": 0, "errores": 0}
+
+    @property
+    def esquema_arrow(self):
+        if self._esquema is None:
+            self._esquema = esquema_arrow(self.esquema)
+        return self._esquema
+
+    @property
+    def activa(self) -> bool:
+        return self.directorio is not None
+
+    def registrar(self, filas: int, ts: float, version, ruta: str, entradas: dict, salidas: list[dict]):
+        """
+        Encola un bloque: `entradas` tiene una secuencia de `filas` valores por
+        campo de entrada y `salidas` una fila (dict) por predicción. No copia
+        nada: los arreglos no deben modificarse después.
+        """
+        if not self.activa or filas == 0:
+            return
+        bloque = (ts, version, ruta, entradas, salidas)
+        with self._lock:
+            if self._filas + filas > self.capacidad:
+                if self.politica == "newest" or filas > self.capacidad:
+                    self._stats["descartadas"] += filas
+                    return
+                while self._filas + filas > self.capacidad:
+                    n, _ = self._bloques.popleft()
+                    self._filas -= n
+                    self._stats["descartadas"] += n
+            self._bloques.append((filas, bloque))
+            self._filas += filas
+            self._stats["registradas"] += filas
+            despertar = self._filas >= self.filas_flush
+        if despertar:
+            self._despertar.set()
+
+    def iniciar(self):
+        if not self.activa or (self._hilo is not None and self._hilo.is_alive()):
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, name=f"auditoria-{self.nombre}", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Escribe lo pendiente y cierra el archivo abierto."""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _ejecutar(self):
+        while not self._detener.is_set():
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            self.vaciar()
+        self.vaciar()
+        with self._lock_escritura:
+            self._cerrar()
+
+    def vaciar(self) -> int:
+        """Escribe el contenido del buffer; devuelve las filas escritas."""
+        with self._lock:
+            bloques, self._bloques = self._bloques, deque()
+            self._filas = 0
+        with self._lock_escritura:
+            escritas = 0
+            if bloques:
+                try:
+                    tabla = self._tabla([b for _, b in bloques])
+                    self._escribir(tabla)
+                    escritas = tabla.num_rows
+                except Exception as e:
+                    perdidas = sum(n for n, _ in bloques)
+                    with self._lock:
+                        self._stats["errores"] += 1
+                        self._stats["descartadas"] += perdidas
+                    logging.error(f"Auditoría {self.nombre}: no se pudieron escribir {perdidas} filas: {e}")
+            if self._writer is not None and (time.monotonic() - self._abierto >= self.rotar_s
+                                             or self._archivo.tell() >= self.max_archivo):
+                self._cerrar()
+        return escritas
+
+    def _tabla(self, bloques: list):
+        import pyarrow as pa
+        filas = [len(b[4]) for b in bloques]
+        columnas = {
+            "ts": pa.array(np.repeat([int(b[0] * 1_000_000) for b in bloques], filas),
+                           pa.timestamp("us", tz="UTC")),
+            "model_version": np.repeat(np.array([b[1] for b in bloques], dtype=object), filas),
+            "route": np.repeat(np.array([b[2] for b in bloques], dtype=object), filas),
+        }
+        entradas = bloques[0][3].keys()
+        for campo in entradas:
+            columnas[campo] = np.concatenate([np.asarray(b[3][campo]) for b in bloques])
+        for campo in bloques[0][4][0].keys():
+            nombre = f"salida_{campo}" if campo in entradas else campo
+            columnas[nombre] = [s[campo] for b in bloques for s in b[4]]
+        return pa.table(columnas, schema=self.esquema_arrow)
+
+    def _escribir(self, tabla):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self._writer is None:
+            apertura = datetime.now(timezone.utc).strftime(FORMATO_FECHA)
+            self._parcial = os.path.join(self.directorio, f"{self.nombre}-{apertura}-{os.getpid()}.parquet.parcial")
+            self._archivo = pa.OSFile(self._parcial, "wb")
+            self._writer = pq.ParquetWriter(self._archivo, self.esquema_arrow, compression="zstd")
+            self._abierto = time.monotonic()
+            self._rango = None
+        self._writer.write_table(tabla)
+        ts = tabla.column("ts").cast(pa.int64()).to_numpy()
+        minimo, maximo = int(ts.min()), int(ts.max())
+        self._rango = (minimo, maximo) if self._rango is None else (min(self._rango[0], minimo), max(self._rango[1], maximo))
+        with self._lock:
+            self._stats["escritas"] += tabla.num_rows
+
+    def _cerrar(self):
+        # Debe llamarse con _lock_escritura tomado
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._archivo.close()
+        desde, hasta = (datetime.fromtimestamp(t / 1_000_000, timezone.utc).strftime(FORMATO_FECHA) for t in self._rango)
+        os.replace(self._parcial, os.path.join(self.directorio, f"{self.nombre}-{desde}-{hasta}-{os.getpid()}.parquet"))
+        self._writer = self._archivo = self._parcial = self._rango = None
+        with self._lock:
+            self._stats["archivos"] += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"activa": self.activa, "directorio": self.directorio, "en_buffer": self._filas,
+                    "capacidad": self.capacidad, "politica": self.politica, **self._stats}
+
+def _rango_archivo(ruta: str) -> tuple[datetime, datetime] | None:
+    partes = os.path.basename(ruta)[:-len(".parquet")].split("-")
+    try:
+        return tuple(datetime.strptime(p, FORMATO_FECHA).replace(tzinfo=timezone.utc) for p in partes[-3:-1])
+    except ValueError:
+        return None
+
+def leer_auditoria(nombre: str, desde: datetime | None = None, hasta: datetime | None = None,
+                   directorio: str | None = AUDIT_DIR, columnas: list[str] | None = None):
+    """
+    Registros de `nombre` con `desde <= ts < hasta` (None = sin límite).
+    Solo abre los archivos cerrados cuyo rango, que está en el nombre, se
+    cruza con el pedido. Dentro de cada uno, Parquet saltea los row groups
+    que quedan fuera según sus estadísticas de `ts`.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    filtros = ([("ts", ">=", desde)] if desde else []) + ([("ts", "<", hasta)] if hasta else [])
+    tablas = []
+    for ruta in sorted(glob.glob(os.path.join(directorio, nombre, f"{nombre}-*.parquet"))):
+        rango = _rango_archivo(ruta)
+        if rango is not None and ((hasta is not None and rango[0] >= hasta) or (desde is not None and rango[1] < desde)):
+            continue
+        tablas.append(pq.read_table(ruta, columns=columnas, filters=filtros or None))
+    if not tablas:
+        import pandas as pd
+        return pd.DataFrame(columns=columnas or [])
+    return pa.concat_tables(tablas).to_pandas()
+
+def _fecha(valor: str) -> datetime:
+    fecha = datetime.fromisoformat(valor)
+    return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+
+def main(argv: typing.Sequence[str] | None = None):
+    parser = argparse.ArgumentParser(description="Lee el registro de auditoría de un modelo en un rango de fechas")
+    parser.add_argument("nombre", help="Registro a leer: german o jira")
+    parser.add_argument("--dir", default=AUDIT_DIR, required=AUDIT_DIR is None, help="Directorio de auditoría (AUDIT_DIR)")
+    parser.add_argument("--desde", type=_fecha, help="Fecha ISO inclusive; sin zona = UTC")
+    parser.add_argument("--hasta", type=_fecha, help="Fecha ISO exclusiva; sin zona = UTC")
+    parser.add_argument("--columnas", help="Columnas separadas por coma")
+    parser.add_argument("--salida", help="Archivo .csv o .parquet; sin salida se imprime un resumen")
+    args = parser.parse_args(argv)
+    df = leer_auditoria(args.nombre, args.desde, args.hasta, args.dir,
+                        args.columnas.split(",") if args.columnas else None)
+    if args.salida:
+        if args.salida.endswith(".parquet"):
+            df.to_parquet(args.salida, index=False)
+        else:
+            df.to_csv(args.salida, index=False)
+    print(f"{len(df)} registros")
+    if not args.salida and len(df):
+        print(df.head(20).to_string(index=False))
+    return df
+
+if __name__ == "__main__":
+    main()
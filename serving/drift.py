@@ -0,0 +1,260 @@
+"""
+Monitor de drift de features y scores con histogramas de tamaño fijo.
+
+El perfil de referencia se arma con los datos de entrenamiento y viaja con
+el modelo (`drift_reference.json` dentro del artefacto):
+
+    python -m serving.drift train.csv --salida drift_reference.json
+"""
+import os
+import sys
+import json
+import bisect
+import typing
+import argparse
+import logging
+import threading
+import numpy as np
+
+# Nombre del perfil de referencia dentro del directorio del artefacto del modelo
+PERFIL_DRIFT         = "drift_reference.json"
+# Perfil a usar si el artefacto no trae uno
+DRIFT_REFERENCE_FILE = os.getenv("DRIFT_REFERENCE_FILE")
+# Filas por ventana: el drift reciente compara la ventana en curso más la anterior
+DRIFT_WINDOW_ROWS    = int(os.getenv("DRIFT_WINDOW_ROWS", "10000"))
+# Filas mínimas antes de calcular PSI y KS
+DRIFT_MIN_ROWS       = int(os.getenv("DRIFT_MIN_ROWS", "100"))
+# PSI a partir del cual una feature se reporta con drift (0.1 a 0.25 es moderado)
+DRIFT_PSI_ALERT      = float(os.getenv("DRIFT_PSI_ALERT", "0.25"))
+DRIFT_PSI_MODERADO   = 0.1
+# Proporción mínima por bin en el PSI, para que un bin vacío no dé infinito
+EPSILON = 1e-4
+
+def perfil_referencia(datos, bins: int = 10) -> dict:
+    """
+    Perfil de referencia de cada columna de `datos` (DataFrame o dict de
+    columnas): bordes de los bins y la
+    proporción de filas en cada uno. Las columnas con hasta `bins` valores
+    distintos (categóricas) tienen un bin por valor; las demás, bins por
+    cuantiles.
+    """
+    features, filas = {}, 0
+    for columna, valores in dict(datos).items():
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[~np.isnan(valores)]
+        filas = max(filas, len(valores))
+        unicos = np.unique(valores)
+        if len(unicos) <= bins:
+            bordes = (unicos[:-1] + unicos[1:]) / 2
+        else:
+            bordes = np.unique(np.quantile(valores, np.linspace(0, 1, bins + 1)[1:-1]))
+        conteos = np.bincount(np.searchsorted(bordes, valores, side="right"), minlength=len(bordes) + 1)
+        features[str(columna)] = {
+            "bordes": bordes.tolist(),
+            "proporciones": (conteos / max(len(valores), 1)).tolist(),
+        }
+    return {"filas": filas, "features": features}
+
+def filtrar_perfil(perfil: dict | None, columnas: typing.Iterable[str], nombre: str = "") -> dict | None:
+    """
+    Deja en el perfil solo las `columnas` que el monitor observa. Una columna
+    de más (el target, el índice de pandas) haría fallar cada `observar`.
+    """
+    if perfil is None:
+        return None
+    columnas = set(columnas)
+    features = perfil.get("features", {})
+    descartadas = [c for c in features if c not in columnas]
+    if descartadas:
+        logging.warning(f"Drift {nombre}: columnas del perfil que no se observan, descartadas: {descartadas}")
+    return {**perfil, "features": {c: v for c, v in features.items() if c in columnas}}
+
+def columnas_german() -> list[str]:
+    """Columnas que observa la German Credit Risk API: las features de ClienteInput y probability_good."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    "GermanCreditRiskAPI"))
+    from models import ClienteInput
+    return list(ClienteInput.model_fields) + ["probability_good"]
+
+def cargar_perfil(ruta_artefacto: str | None = None, archivo: str | None = DRIFT_REFERENCE_FILE) -> dict | None:
+    """Perfil que acompaña al artefacto; si no hay, el de `archivo`; None si no hay ninguno."""
+    for ruta in (os.path.join(ruta_artefacto, PERFIL_DRIFT) if ruta_artefacto else None, archivo):
+        if ruta and os.path.isfile(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                return json.load(f)
+    return None
+
+def psi(actual: np.ndarray, referencia: np.ndarray) -> float:
+    """Population Stability Index entre dos distribuciones por bin."""
+    actual, referencia = np.maximum(actual, EPSILON), np.maximum(referencia, EPSILON)
+    return float(np.sum((actual - referencia) * np.log(actual / referencia)))
+
+def ks(actual: np.ndarray, referencia: np.ndarray) -> float:
+    """Estadístico de Kolmogorov-Smirnov sobre las distribuciones por bin."""
+    return float(np.max(np.abs(np.cumsum(actual) - np.cumsum(referencia))))
+
+class MonitorDrift:
+    """
+    Compara en línea la distribución de las entradas y salidas del modelo con
+    el perfil de referencia de la versión activa.
+
+    Cada columna del perfil tiene un histograma de tamaño fijo, y todos
+    juntos viven en un solo arreglo de conteos: la memoria no depende del
+    tráfico. `observar` suma un lote con un `searchsorted` por columna y un
+    `bincount` (una fila sola va por `bisect`). Se llevan tres conteos: la
+    ventana en curso, la anterior (rotan cada `ventana` filas) y el
+    acumulado desde que se fijó la referencia. Sin perfil, el monitor está
+    apagado y `observar` no hace nada. Con `observadas`, las columnas del
+    perfil que no están en esa lista se descartan al fijar la referencia.
+    """
+
+    def __init__(self, nombre: str, ventana: int = DRIFT_WINDOW_ROWS, min_filas: int = DRIFT_MIN_ROWS,
+                 umbral_psi: float = DRIFT_PSI_ALERT, observadas: typing.Sequence[str] | None = None):
+        self.nombre     = nombre
+        self.observadas = observadas
+        self.ventana    = max(1, ventana)
+        self.min_filas  = min_filas
+        self.umbral_psi = umbral_psi
+        self.version    = None
+        self._lock      = threading.Lock()
+        with self._lock:
+            self._fijar(None)
+
+    def _fijar(self, perfil: dict | None):
+        # Debe llamarse con el lock tomado. La configuración se reemplaza
+        # entera para que `observar` use bordes y offsets de una sola referencia.
+        features = (perfil or {}).get("features", {})
+        columnas = list(features)
+        bordes   = [np.asarray(features[c]["bordes"], dtype=np.float64) for c in columnas]
+        offsets  = np.concatenate([[0], np.cumsum([len(b) + 1 for b in bordes])]).astype(np.int64)
+        self._config     = (columnas, bordes, [b.tolist() for b in bordes], offsets.tolist())
+        self._referencia = [np.asarray(features[c]["proporciones"], dtype=np.float64) for c in columnas]
+        self._actual     = np.zeros(offsets[-1], dtype=np.int64)
+        self._anterior   = np.zeros(offsets[-1], dtype=np.int64)
+        self._acumulado  = np.zeros(offsets[-1], dtype=np.int64)
+        self._filas      = [0, 0, 0]   # ventana en curso, anterior, acumulado
+
+    @property
+    def columnas(self) -> list[str]:
+        return self._config[0]
+
+    @property
+    def activo(self) -> bool:
+        return bool(self.columnas)
+
+    def fijar_referencia(self, perfil: dict | None, version=None):
+        """Usa `perfil` como referencia y reinicia los conteos; no hace nada si la versión no cambió."""
+        if self.observadas is not None:
+            perfil = filtrar_perfil(perfil, self.observadas, self.nombre)
+        with self._lock:
+            if version is not None and version == self.version and self.activo == bool(perfil):
+                return
+            self._fijar(perfil)
+            self.version = version
+        if perfil is None:
+            logging.info(f"Drift {self.nombre}: sin perfil de referencia, monitor apagado")
+        else:
+            logging.info(f"Drift {self.nombre}: referencia de v{version} con {len(self.columnas)} columnas")
+
+    def observar(self, valores: dict, filas: int):
+        """
+        Suma `filas` observaciones. `valores` tiene una secuencia de `filas`
+        valores por columna; las columnas que no están en el perfil se ignoran
+        y las del perfil deben estar todas.
+        """
+        config = self._config
+        columnas, bordes, bordes_lista, offsets = config
+        if not columnas or filas == 0:
+            return
+        if filas == 1:
+            indices = [o + bisect.bisect_right(b, float(valores[c][0]))
+                       for c, b, o in zip(columnas, bordes_lista, offsets)]
+        else:
+            indices = np.concatenate([np.searchsorted(b, np.asarray(valores[c], dtype=np.float64), side="right") + o
+                                      for c, b, o in zip(columnas, bordes, offsets)])
+            indices = np.bincount(indices, minlength=offsets[-1])
+        with self._lock:
+            if config is not self._config:
+                return   # cambió la referencia mientras se calculaban los bins
+            if filas == 1:
+                self._actual[indices] += 1
+            else:
+                self._actual += indices
+            self._contar(filas)
+
+    def _contar(self, filas: int):
+        # Debe llamarse con el lock tomado
+        self._filas[0] += filas
+        self._filas[2] += filas
+        if self._filas[0] >= self.ventana:
+            self._acumulado += self._actual
+            self._anterior, self._actual = self._actual, self._anterior
+            self._actual[:] = 0
+            self._filas[1], self._filas[0] = self._filas[0], 0
+
+    def _puntajes(self, conteos: np.ndarray, filas: int, referencias: list, offsets: list) -> list:
+        if filas < self.min_filas:
+            return [None] * len(referencias)
+        resultado = []
+        for j, referencia in enumerate(referencias):
+            actual = conteos[offsets[j]:offsets[j + 1]] / filas
+            resultado.append((round(psi(actual, referencia), 4), round(ks(actual, referencia), 4)))
+        return resultado
+
+    def _estado(self, puntaje) -> str:
+        if puntaje is None:
+            return "insuficiente"
+        if puntaje[0] >= self.umbral_psi:
+            return "drift"
+        return "moderado" if puntaje[0] >= DRIFT_PSI_MODERADO else "estable"
+
+    def reporte(self) -> dict:
+        """PSI y KS por columna: recientes (ventana en curso y anterior) y acumulados desde la referencia."""
+        with self._lock:
+            columnas, _, _, offsets = self._config
+            referencias = self._referencia
+            reciente  = self._actual + self._anterior
+            acumulado = self._acumulado + self._actual
+            filas = list(self._filas)
+            version = self.version
+        recientes  = self._puntajes(reciente, filas[0] + filas[1], referencias, offsets)
+        acumulados = self._puntajes(acumulado, filas[2], referencias, offsets)
+        detalle = {}
+        for c, r, a in zip(columnas, recientes, acumulados):
+            detalle[c] = {
+                "estado": self._estado(r),
+                "psi": r and r[0], "ks": r and r[1],
+                "psi_acumulado": a and a[0], "ks_acumulado": a and a[1],
+            }
+        return {
+            "activo": bool(columnas),
+            "version_modelo": version,
+            "filas_recientes": filas[0] + filas[1],
+            "filas_acumuladas": filas[2],
+            "ventana_filas": self.ventana,
+            "umbral_psi": self.umbral_psi,
+            "alertas": [c for c, e in detalle.items() if e["estado"] == "drift"],
+            "columnas": detalle,
+        }
+
+def main(argv: typing.Sequence[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="Arma el perfil de referencia de drift a partir de un CSV o Parquet")
+    parser.add_argument("datos", help="Datos de entrenamiento: features y, si se quiere, el score (p. ej. probability_good)")
+    parser.add_argument("--salida", default=PERFIL_DRIFT, help="Archivo JSON del perfil")
+    parser.add_argument("--columnas", help="Columnas separadas por coma (por defecto, las features de "
+                                           "ClienteInput y probability_good que haya en los datos)")
+    parser.add_argument("--bins", type=int, default=10, help="Bins por columna continua")
+    args = parser.parse_args(argv)
+    import pandas as pd
+    df = pd.read_parquet(args.datos) if args.datos.endswith(".parquet") else pd.read_csv(args.datos)
+    # Por defecto no entran el target ni el índice que pandas guarda como "Unnamed: 0"
+    columnas = args.columnas.split(",") if args.columnas else [c for c in columnas_german() if c in df.columns]
+    df = df[columnas]
+    perfil = perfil_referencia(df, args.bins)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(perfil, f, indent=2)
+    print(f"Perfil de {len(perfil['features'])} columnas y {perfil['filas']} filas en {args.salida}")
+    return perfil
+
+if __name__ == "__main__":
+    main()
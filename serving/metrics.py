@@ -0,0 +1,363 @@
+import time
+import logging
+import bisect
+import functools
+import inspect
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+
+# Límites de los histogramas (segundos y filas)
+BUCKETS_LATENCIA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_LOTE     = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000)
+
+def _etiquetas(nombres: tuple, valores: tuple) -> str:
+    if not nombres:
+        return ""
+    pares = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(nombres, valores))
+    return "{" + pares + "}"
+
+def _numero(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores, cantidad: float = 1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            series = sorted(self._valores.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        lineas += [f"{self.nombre}{_etiquetas(self.etiquetas, v)} {_numero(n)}" for v, n in series]
+        return lineas
+
+class Histograma:
+    """
+    Histograma acumulativo al estilo Prometheus. `observar` solo hace una
+    búsqueda binaria y dos sumas bajo un lock por métrica; los buckets
+    acumulados se calculan al exportar.
+    """
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self.buckets = tuple(buckets)
+        self._series = {}   # valores de etiquetas -> [conteos por bucket (+Inf al final), suma]
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *valores):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            series = sorted((v, (list(s[0]), s[1])) for v, s in self._series.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        nombres = self.etiquetas + ("le",)
+        for valores, (conteos, suma) in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                le = "+Inf" if limite == float("inf") else _numero(limite)
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(nombres, valores + (le,))} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {repr(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {acumulado}")
+        return lineas
+
+class Gauge:
+    """
+    Valor leído al exportar: `funcion()` devuelve un número o un dict
+    {valores de etiquetas: número}. Con `tipo="counter"` publica contadores
+    que ya lleva otro componente (p. ej. los rechazos del control de admisión).
+    """
+
+    def __init__(self, nombre: str, ayuda: str, funcion, etiquetas: tuple = (), tipo: str = "gauge"):
+        self.nombre, self.ayuda, self.funcion, self.etiquetas = nombre, ayuda, funcion, etiquetas
+        self.tipo = tipo
+
+    def exportar(self) -> list[str]:
+        valor = self.funcion()
+        series = valor.items() if isinstance(valor, dict) else [((), valor)]
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        lineas += [f"{self.nombre}{_etiquetas(self.etiquetas, v)} {_numero(n)}"
+                   for v, n in series if n is not None]
+        return lineas
+
+class RegistroMetricas:
+    def __init__(self):
+        self._metricas = {}
+
+    def registrar(self, metrica):
+        # Re-registrar el mismo nombre reemplaza la métrica (p. ej. al recargar un módulo)
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def exportar(self) -> str:
+        lineas = []
+        for metrica in self._metricas.values():
+            lineas += metrica.exportar()
+        return "\n".join(lineas) + "\n"
+
+registro = RegistroMetricas()
+solicitudes = registro.registrar(Contador(
+    "http_requests_total", "Solicitudes HTTP por API, ruta, método y código de estado",
+    ("api", "route", "method", "status")))
+etapas = registro.registrar(Histograma(
+    "inference_stage_seconds", "Latencia por etapa del pipeline de inferencia", ("api", "route", "stage")))
+tamanos_lote = registro.registrar(Histograma(
+    "inference_batch_size", "Filas por solicitud en los endpoints batch", ("api", "route"), BUCKETS_LOTE))
+
+# Contexto de la solicitud en curso: API, ruta y marcas de tiempo del handler.
+# Los handlers sync corren en el thread pool con una copia del contexto que
+# apunta al mismo dict, así que las marcas llegan al middleware.
+_solicitud = contextvars.ContextVar("solicitud_metricas", default=None)
+
+def marcar(clave: str):
+    """Guarda el instante actual en la solicitud en curso (lo usan el handler y la admisión)."""
+    actual = _solicitud.get()
+    if actual is not None:
+        actual[clave] = time.perf_counter()
+
+def asignar_perfil(perfil):
+    """Hace que el handler de la solicitud en curso corra dentro de `perfil` (context manager)."""
+    actual = _solicitud.get()
+    if actual is not None:
+        actual["perfil"] = perfil
+
+def asignar_deadline(deadline: float, al_vencer):
+    """
+    Deadline (time.monotonic()) de la solicitud en curso. Si vence antes de
+    que empiece el handler, se llama `al_vencer()` y se responde 504.
+    """
+    actual = _solicitud.get()
+    if actual is not None:
+        actual["deadline"] = (deadline, al_vencer)
+
+def _verificar_deadline():
+    actual = _solicitud.get()
+    deadline = actual.get("deadline") if actual is not None else None
+    if deadline is not None and time.monotonic() >= deadline[0]:
+        deadline[1]()
+        logging.warning(f"Solicitud a {actual['ruta']} descartada: deadline vencido antes del handler")
+        raise HTTPException(status_code=504, detail="Deadline de la solicitud vencido antes de procesarla")
+
+def ruta_actual() -> str:
+    actual = _solicitud.get()
+    return actual["ruta"] if actual is not None else "interno"
+
+def _api_ruta() -> tuple[str, str]:
+    # Etiquetas api y route; en el gateway ambas APIs tienen /health y /metrics
+    actual = _solicitud.get()
+    return (actual["api"], actual["ruta"]) if actual is not None else ("interno", "interno")
+
+@contextmanager
+def etapa(nombre: str):
+    """Mide un bloque como etapa de la solicitud en curso."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        actual = _solicitud.get()
+        if actual is None:
+            etapas.observar(duracion, "interno", "interno", nombre)
+        else:
+            etapas.observar(duracion, actual["api"], actual["ruta"], nombre)
+            propias = actual.setdefault("etapas", {})
+            propias[nombre] = propias.get(nombre, 0.0) + duracion
+
+def etapas_marcas(actual: dict) -> dict[str, float]:
+    """Etapas que se deducen de las marcas de admisión, handler y respuesta (en segundos)."""
+    resultado = {}
+    admitido = actual.get("admitido", actual["inicio"])
+    if "admitido" in actual:
+        resultado["cola_admision"] = admitido - actual["inicio"]
+    if "handler_inicio" in actual:
+        resultado["parseo_validacion"] = actual["handler_inicio"] - admitido
+        if "handler_fin" in actual:
+            resultado["handler"] = actual["handler_fin"] - actual["handler_inicio"]
+            if "respuesta" in actual and actual["respuesta"] >= actual["handler_fin"]:
+                resultado["serializacion"] = actual["respuesta"] - actual["handler_fin"]
+    return resultado
+
+def desglose_actual() -> dict[str, float]:
+    """Desglose por etapa de la solicitud en curso hasta este momento."""
+    actual = _solicitud.get()
+    if actual is None:
+        return {}
+    return {**etapas_marcas(actual), **actual.get("etapas", {})}
+
+def observar_lote(filas: int):
+    tamanos_lote.observar(filas, *_api_ruta())
+
+class RutaInstrumentada(APIRoute):
+    """
+    APIRoute que revisa el deadline de la solicitud y marca el inicio y fin del handler. Con eso el middleware
+    separa parseo y validación (antes del handler) de la serialización de la
+    respuesta (después). Si la solicitud trae un `perfil` (ver
+    serving/profiling.py), el handler corre dentro de él, en su propio hilo.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _marcar_handler(endpoint), **kwargs)
+
+def _marcar_handler(endpoint):
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def envoltorio(*args, **kwargs):
+            _verificar_deadline()
+            marcar("handler_inicio")
+            try:
+                with _perfil_actual():
+                    return await endpoint(*args, **kwargs)
+            finally:
+                marcar("handler_fin")
+    else:
+        @functools.wraps(endpoint)
+        def envoltorio(*args, **kwargs):
+            _verificar_deadline()
+            marcar("handler_inicio")
+            try:
+                with _perfil_actual():
+                    return endpoint(*args, **kwargs)
+            finally:
+                marcar("handler_fin")
+    return envoltorio
+
+def _perfil_actual():
+    actual = _solicitud.get()
+    perfil = actual.get("perfil") if actual is not None else None
+    return perfil if perfil is not None else nullcontext()
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que cuenta solicitudes por ruta y código y registra las
+    etapas `cola_admision`, `parseo_validacion`, `handler`, `serializacion`
+    y `total`. Va por fuera del control de admisión para contar también los
+    429 y separar la espera en cola del parseo. Las rutas que no existen en
+    la app se agrupan como "otra" para acotar la cardinalidad. `api` va como
+    etiqueta en todas las series: en el gateway separa las rutas que ambas
+    APIs tienen (/health, /metrics, ...).
+    """
+
+    def __init__(self, app, api: str):
+        self.app = app
+        self.api = api
+        self._rutas = None
+
+    def _ruta(self, scope) -> str:
+        if self._rutas is None:
+            self._rutas = {getattr(r, "path", None) for r in getattr(scope.get("app"), "routes", [])}
+        return scope["path"] if scope["path"] in self._rutas else "otra"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        ruta = self._ruta(scope)
+        actual = {"api": self.api, "ruta": ruta, "inicio": time.perf_counter()}
+        token = _solicitud.set(actual)
+        estado = {"status": 500}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["status"] = mensaje["status"]
+                actual["respuesta"] = time.perf_counter()
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            fin = time.perf_counter()
+            _solicitud.reset(token)
+            solicitudes.inc(self.api, ruta, scope["method"], str(estado["status"]))
+            etapas.observar(fin - actual["inicio"], self.api, ruta, "total")
+            for nombre, duracion in etapas_marcas(actual).items():
+                etapas.observar(duracion, self.api, ruta, nombre)
+
+# Cargadores y limitadores exportados. Se acumulan para que el gateway (app.py
+# de la raíz), que monta ambas APIs en un proceso, exporte los de las dos.
+_cargadores  = []
+_limitadores = {}
+_auditorias  = []
+_monitores   = []
+
+def gauges_modelo(cargador):
+    """Registra la duración de la última carga del modelo y la cantidad de cambios de versión."""
+    if cargador not in _cargadores:
+        _cargadores.append(cargador)
+    registro.registrar(Gauge("model_load_seconds", "Duración de la última carga del modelo",
+                             lambda: {(c.nombre, c.version or ""): c.duracion for c in _cargadores},
+                             ("model", "version")))
+    registro.registrar(Gauge("model_loads_total", "Versiones cargadas desde el arranque",
+                             lambda: {(c.nombre,): c.cambios for c in _cargadores}, ("model",), tipo="counter"))
+
+def gauges_admision(limitadores: dict):
+    """Profundidad de cola, solicitudes en curso y rechazos de cada Limitador."""
+    _limitadores.update(limitadores)
+    for campo, nombre, ayuda, tipo in [
+        ("en_cola", "admission_queue_depth", "Solicitudes esperando turno", "gauge"),
+        ("en_curso", "admission_in_flight", "Solicitudes en ejecución", "gauge"),
+        ("rechazadas", "admission_rejected_total", "Solicitudes rechazadas con 429", "counter"),
+        ("vencidas", "admission_expired_total", "Solicitudes descartadas por deadline vencido", "counter"),
+    ]:
+        registro.registrar(Gauge(nombre, ayuda, functools.partial(_campo_admision, _limitadores, campo),
+                                 ("route",), tipo))
+
+def _campo_admision(limitadores: dict, campo: str) -> dict:
+    return {(ruta,): l.estadisticas()[campo] for ruta, l in limitadores.items()}
+
+def gauges_auditoria(auditoria):
+    """Filas registradas, descartadas, escritas y en buffer de cada registro de auditoría."""
+    if auditoria not in _auditorias:
+        _auditorias.append(auditoria)
+    for campo, nombre, ayuda, tipo in [
+        ("registradas", "audit_records_total", "Filas encoladas en el registro de auditoría", "counter"),
+        ("descartadas", "audit_dropped_total", "Filas descartadas (buffer lleno o error de escritura)", "counter"),
+        ("escritas", "audit_written_total", "Filas escritas en disco", "counter"),
+        ("en_buffer", "audit_buffer_rows", "Filas en el buffer esperando escritura", "gauge"),
+    ]:
+        registro.registrar(Gauge(nombre, ayuda, functools.partial(_campo_auditoria, campo), ("log",), tipo))
+
+def _campo_auditoria(campo: str) -> dict:
+    return {(a.nombre,): a.estadisticas()[campo] for a in _auditorias if a.activa}
+
+def gauges_registro(registro_modelos):
+    """Modelos cargados, memoria estimada y desalojos del registro del gateway (serving/registry.py)."""
+    for campo, nombre, ayuda, tipo in [
+        ("cargado", "model_registry_loaded", "1 si el modelo está en memoria", "gauge"),
+        ("memoria_bytes", "model_registry_memory_bytes", "Memoria estimada del modelo cargado", "gauge"),
+        ("desalojos", "model_registry_evictions_total", "Descargas por inactividad", "counter"),
+    ]:
+        registro.registrar(Gauge(nombre, ayuda, functools.partial(_campo_registro, registro_modelos, campo),
+                                 ("model",), tipo))
+
+def _campo_registro(registro_modelos, campo: str) -> dict:
+    return {(nombre,): int(e[campo]) for nombre, e in registro_modelos.estado()["modelos"].items()}
+
+def gauges_drift(monitor):
+    """PSI y KS recientes por columna de cada monitor de drift (serving/drift.py)."""
+    if monitor not in _monitores:
+        _monitores.append(monitor)
+    for campo, nombre, ayuda in [
+        ("psi", "drift_psi", "PSI de la ventana reciente contra el perfil de referencia"),
+        ("ks", "drift_ks", "KS de la ventana reciente contra el perfil de referencia"),
+    ]:
+        registro.registrar(Gauge(nombre, ayuda, functools.partial(_campo_drift, campo), ("model", "column")))
+
+def _campo_drift(campo: str) -> dict:
+    return {(m.nombre, c): e[campo] for m in _monitores for c, e in m.reporte()["columnas"].items()}
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+from serving.slim import MODEL_SLIM_DIR, cargar_ligero, version_actual
+
+# MLflow se importa recién al usarlo: con artefactos ligeros (MODEL_SLIM_DIR)
+# el proceso de la API no lo carga nunca.
+
+# Cache local de artefactos compartida por ambas APIs
+MODEL_CACHE_DIR = os.getenv(
+    "MODEL_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".model_cache")
+)
+# MODEL_OFFLINE=1 arranca solo con la última versión cacheada, sin consultar el registro
+MODEL_OFFLINE = os.getenv("MODEL_OFFLINE", "0") == "1"
+# Cada cuántos segundos se consulta el alias para cambiar de versión en caliente (0 lo desactiva)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "60"))
+# Archivo con la versión objetivo en lugar del registro; admite {nombre} y {alias}
+MODEL_ALIAS_FILE = os.getenv("MODEL_ALIAS_FILE")
+
+def checksum_directorio(ruta: str) -> str:
+    """SHA-256 de todos los archivos del artefacto (rutas relativas y contenido)."""
+    h = hashlib.sha256()
+    for base, dirs, archivos in os.walk(ruta):
+        dirs.sort()
+        for nombre in sorted(archivos):
+            completo = os.path.join(base, nombre)
+            h.update(os.path.relpath(completo, ruta).replace(os.sep, "/").encode())
+            with open(completo, "rb") as f:
+                for bloque in iter(lambda: f.read(1 << 20), b""):
+                    h.update(bloque)
+    return h.hexdigest()
+
+class AlmacenModelos:
+    """
+    Cache versionada de artefactos MLflow en disco.
+
+    Estructura: `<directorio>/<modelo>/<version>/` con el artefacto descargado
+    y `<directorio>/<modelo>/manifest.json` con el checksum de cada versión y
+    la última versión vista para cada alias.
+    """
+
+    def __init__(self, directorio: str = MODEL_CACHE_DIR):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+
+    def _ruta_manifiesto(self, nombre: str) -> str:
+        return os.path.join(self.directorio, nombre, "manifest.json")
+
+    def manifiesto(self, nombre: str) -> dict:
+        try:
+            with open(self._ruta_manifiesto(nombre), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"alias": {}, "versiones": {}}
+
+    def _guardar_manifiesto(self, nombre: str, manifiesto: dict):
+        ruta = self._ruta_manifiesto(nombre)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifiesto, f, indent=2)
+        os.replace(tmp, ruta)
+
+    def ruta_local(self, nombre: str, version: str) -> str | None:
+        """Ruta de la versión cacheada si existe y su checksum coincide con el manifiesto."""
+        entrada = self.manifiesto(nombre)["versiones"].get(str(version))
+        if entrada is None:
+            return None
+        ruta = os.path.join(self.directorio, nombre, str(version))
+        if not os.path.isdir(ruta):
+            return None
+        if checksum_directorio(ruta) != entrada["checksum"]:
+            logging.warning(f"Checksum inválido para {nombre} v{version}; se descarta la copia local")
+            return None
+        return ruta
+
+    def version_local(self, nombre: str, alias: str) -> str | None:
+        return self.manifiesto(nombre)["alias"].get(alias)
+
+    def fijar_alias(self, nombre: str, alias: str, version: str):
+        with self._lock:
+            manifiesto = self.manifiesto(nombre)
+            manifiesto["alias"][alias] = str(version)
+            self._guardar_manifiesto(nombre, manifiesto)
+
+    def descargar(self, nombre: str, version: str) -> str:
+        """Descarga la versión del registro a la cache y la registra en el manifiesto."""
+        destino = os.path.join(self.directorio, nombre, str(version))
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f".{version}-", dir=os.path.dirname(destino))
+        import mlflow
+        try:
+            ruta = mlflow.artifacts.download_artifacts(
+                artifact_uri=f"models:/{nombre}/{version}", dst_path=tmp
+            )
+            checksum = checksum_directorio(ruta)
+            if os.path.isdir(destino):
+                shutil.rmtree(destino)
+            os.replace(ruta, destino)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        with self._lock:
+            manifiesto = self.manifiesto(nombre)
+            manifiesto["versiones"][str(version)] = {
+                "checksum": checksum,
+                "descargado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            self._guardar_manifiesto(nombre, manifiesto)
+        return destino
+
+    def resolver(self, nombre: str, alias: str, offline: bool = MODEL_OFFLINE) -> tuple[str, str, str]:
+        """
+        Devuelve (version, ruta_local, origen) para `nombre@alias`.
+
+        Consulta el registro para saber a qué versión apunta el alias y solo
+        descarga si esa versión no está en disco. Si el registro no responde
+        (o `offline`), usa la última versión cacheada para el alias.
+        """
+        if not offline:
+            try:
+                import mlflow
+                client = mlflow.tracking.MlflowClient()
+                version = str(client.get_model_version_by_alias(nombre, alias).version)
+                ruta = self.ruta_local(nombre, version)
+                origen = "cache local"
+                if ruta is None:
+                    ruta = self.descargar(nombre, version)
+                    origen = "registro"
+                self.fijar_alias(nombre, alias, version)
+                return version, ruta, origen
+            except Exception as e:
+                logging.warning(f"Registro MLflow no disponible para {nombre}@{alias}: {e}")
+        version = self.version_local(nombre, alias)
+        ruta = self.ruta_local(nombre, version) if version is not None else None
+        if ruta is None:
+            raise RuntimeError(f"No hay una versión cacheada de {nombre}@{alias}")
+        return version, ruta, "cache local (offline)"
+
+class CargadorModelo:
+    """
+    Carga `nombre@alias` en un hilo de fondo para que el servidor arranque de inmediato.
+
+    `al_cargar(modelo, version)` se llama al terminar la carga para publicar
+    el modelo en el módulo de predicción; debe dejarlo listo (calentado) y
+    reemplazar la referencia activa de forma atómica. Después de la carga
+    inicial, si `intervalo > 0`, el mismo hilo consulta cada `intervalo`
+    segundos a qué versión apunta el alias (en el registro o en
+    `archivo_alias`) y carga la nueva versión junto a la actual sin
+    reiniciar el proceso. `estado()` alimenta liveness y readiness.
+    `descargar()` retira el modelo con `al_descargar()`; un nuevo
+    `iniciar()` lo vuelve a cargar (ver serving/registry.py).
+    `al_leer_artefacto(ruta, version)`, si se indica, recibe el directorio
+    local de cada versión antes de publicarla, para leer los archivos que
+    acompañan al modelo (p. ej. el perfil de drift).
+    Con `dir_ligero` carga artefactos ligeros de `<dir_ligero>/<nombre>/`
+    (serving/slim.py) en lugar de MLflow, y el archivo `ACTUAL` hace de alias.
+    """
+
+    def __init__(self, nombre: str, alias: str, al_cargar, almacen: AlmacenModelos | None = None,
+                 offline: bool = MODEL_OFFLINE, intervalo: float = MODEL_WATCH_INTERVAL,
+                 archivo_alias: str | None = MODEL_ALIAS_FILE, al_descargar=None, al_leer_artefacto=None,
+                 dir_ligero: str | None = MODEL_SLIM_DIR):
+        self.nombre    = nombre
+        self.alias     = alias
+        self.al_cargar = al_cargar
+        self.al_descargar = al_descargar
+        self.al_leer_artefacto = al_leer_artefacto
+        self.almacen   = almacen or AlmacenModelos()
+        self.offline   = offline
+        self.intervalo = intervalo
+        self.archivo_alias = archivo_alias.format(nombre=nombre, alias=alias) if archivo_alias else None
+        self.dir_ligero = os.path.join(dir_ligero, nombre) if dir_ligero else None
+        self.fase      = "pendiente"
+        self.version   = None
+        self.origen    = None
+        self.error     = None
+        self.duracion  = None
+        self.ultimo_cambio = None
+        self.cambios   = 0
+        self._listo    = threading.Event()
+        self._detener  = threading.Event()
+        self._hilo     = None
+        self._lock     = threading.Lock()
+
+    def iniciar(self):
+        """Inicia la carga en segundo plano; no hace nada si el hilo de carga ya está corriendo."""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._detener.clear()
+            self._listo.clear()
+            self._hilo = threading.Thread(target=self._ejecutar, name=f"carga-{self.nombre}", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    @property
+    def activo(self) -> bool:
+        """El hilo de carga o el vigilante siguen corriendo."""
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def descargar(self):
+        """Detiene el vigilante (espera una carga en curso) y retira el modelo publicado."""
+        with self._lock:
+            self._detener.set()
+            if self._hilo is not None:
+                self._hilo.join()
+            if self.al_descargar is not None:
+                self.al_descargar()
+            self.fase, self.version, self.origen, self.error = "descargado", None, None, None
+            logging.info(f"Modelo {self.nombre} descargado")
+
+    def esperar(self, timeout: float | None = None) -> bool:
+        """Bloquea hasta que termine la carga inicial (con o sin éxito)."""
+        return self._listo.wait(timeout)
+
+    def cargar(self) -> bool:
+        """Carga inicial en el hilo que llama, sin vigilante (p. ej. antes de un fork). True si quedó listo."""
+        self._carga_inicial()
+        return self.fase == "listo"
+
+    def _ejecutar(self):
+        # Con el modelo ya publicado (cargado antes del fork por serving/prefork.py) solo se vigila
+        if self.fase == "listo":
+            self._listo.set()
+        else:
+            self._carga_inicial()
+        if self.intervalo <= 0:
+            return
+        while not self._detener.wait(self.intervalo):
+            if self.version is None:
+                self._carga_inicial()
+            else:
+                self.revisar()
+
+    def _version_objetivo(self) -> str:
+        if self.dir_ligero:
+            return version_actual(self.dir_ligero)
+        if self.archivo_alias:
+            with open(self.archivo_alias, encoding="utf-8") as f:
+                return f.read().strip()
+        if self.offline:
+            return self.almacen.version_local(self.nombre, self.alias)
+        import mlflow
+        client = mlflow.tracking.MlflowClient()
+        return str(client.get_model_version_by_alias(self.nombre, self.alias).version)
+
+    def _carga_inicial(self):
+        self.fase = "cargando"
+        try:
+            logging.info(f"Cargando modelo {self.nombre}@{self.alias}...")
+            if self.dir_ligero or self.archivo_alias:
+                version = self._version_objetivo()
+                if version is None:
+                    raise RuntimeError(f"No hay una versión publicada de {self.nombre}@{self.alias}")
+                self._activar(version, *self._ruta(version))
+            else:
+                self._activar(*self.almacen.resolver(self.nombre, self.alias, self.offline))
+        except Exception as e:
+            self.error, self.fase = str(e), "error"
+            logging.error(f"Error cargando el modelo: {e}")
+        finally:
+            self._listo.set()
+
+    def _ruta(self, version: str) -> tuple[str, str]:
+        if self.dir_ligero:
+            return os.path.join(self.dir_ligero, str(version)), "artefacto ligero"
+        ruta = self.almacen.ruta_local(self.nombre, version)
+        if ruta is not None:
+            return ruta, "cache local"
+        return self.almacen.descargar(self.nombre, version), "registro"
+
+    def _activar(self, version: str, ruta: str, origen: str):
+        inicio = time.perf_counter()
+        if self.dir_ligero:
+            modelo = cargar_ligero(ruta)
+        else:
+            import mlflow.sklearn
+            modelo = mlflow.sklearn.load_model(ruta)
+        if self.al_leer_artefacto is not None:
+            self.al_leer_artefacto(ruta, version)
+        self.al_cargar(modelo, version)
+        self.duracion = time.perf_counter() - inicio
+        self.version, self.origen, self.fase, self.error = version, origen, "listo", None
+        self.ultimo_cambio = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.cambios += 1
+        logging.info(f"Modelo {self.nombre} v{version} activo (cargado desde {origen})")
+
+    def revisar(self) -> bool:
+        """Consulta la versión del alias y, si cambió, carga y publica la nueva. True si hubo cambio."""
+        try:
+            objetivo = self._version_objetivo()
+            if objetivo is None or objetivo == self.version:
+                return False
+            logging.info(f"{self.nombre}@{self.alias} apunta a v{objetivo} (activa: v{self.version})")
+            self._activar(objetivo, *self._ruta(objetivo))
+            if not self.dir_ligero:
+                self.almacen.fijar_alias(self.nombre, self.alias, objetivo)
+            return True
+        except Exception as e:
+            # Se mantiene la versión activa y se reintenta en la próxima consulta
+            self.error = str(e)
+            logging.error(f"No se pudo cambiar {self.nombre} de versión: {e}")
+            return False
+
+    def estado(self) -> dict:
+        return {
+            "fase": self.fase,
+            "version": self.version,
+            "origen": self.origen,
+            "error": self.error,
+            "duracion_carga_s": round(self.duracion, 3) if self.duracion is not None else None,
+            "ultimo_cambio": self.ultimo_cambio,
+            "cambios": self.cambios,
+        }
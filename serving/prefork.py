@@ -0,0 +1,326 @@
+"""
+Servidor multi-worker con pre-fork: el proceso padre importa la API y carga
+el modelo una sola vez, y después crea los workers con fork. Los workers
+comparten con el padre, copy-on-write, las páginas del código importado y
+del modelo (el ensamble va empaquetado en un bloque de solo lectura, ver
+`EnsambleCompilado.empaquetar`), así que la memoria total crece poco con
+cada worker y el registro se consulta una vez por despliegue, no una por
+worker.
+
+El padre no atiende solicitudes: reinicia los workers que mueren, vigila
+el alias del modelo y, si cambia de versión, carga la nueva y reemplaza los
+workers de a uno. Con SIGHUP hace el mismo reemplazo sin cambiar de modelo.
+Cada worker agrega a su `/health` el estado de todos (`workers`).
+
+    python -m serving.prefork german --workers 16 --port 8000
+    MODEL_SLIM_DIR=/srv/modelos python -m serving.prefork jira --workers 4 --port 8001
+"""
+import gc
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import typing
+import logging
+import argparse
+import tempfile
+import threading
+import importlib
+from datetime import datetime, timezone
+from serving.tree_engine import EnsambleCompilado
+
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", str(os.cpu_count() or 1)))
+# Segundos entre escrituras del estado de cada worker y del agregado del padre
+PREFORK_HEALTH_INTERVAL = float(os.getenv("PREFORK_HEALTH_INTERVAL", "5"))
+# Segundos que un worker tiene para terminar sus solicitudes antes de SIGKILL
+PREFORK_GRACEFUL_TIMEOUT = float(os.getenv("PREFORK_GRACEFUL_TIMEOUT", "30"))
+ARCHIVO_ESTADO = "prefork.json"
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# nombre -> (carpeta, módulo de la app, módulo de predicción)
+APIS = {
+    "german": ("GermanCreditRiskAPI", "main", "predict_logic"),
+    "jira":   ("JiraTimePredictionAPI", "jira_api", "jira_predict_logic"),
+}
+
+def _escribir_json(ruta: str, datos: dict):
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, default=str)
+    os.replace(tmp, ruta)
+
+def _leer_json(ruta: str) -> dict | None:
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def memoria_proceso(pid: int) -> dict | None:
+    """RSS y PSS del proceso en MB. PSS reparte cada página compartida entre quienes la usan."""
+    memoria = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    memoria["rss_mb"] = round(int(linea.split()[1]) / 1024, 1)
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for linea in f:
+                if linea.startswith("Pss:"):
+                    memoria["pss_mb"] = round(int(linea.split()[1]) / 1024, 1)
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return memoria or None
+    return memoria
+
+def _sumar(total: dict, parcial: dict):
+    # Suma, campo por campo, los contadores numéricos del /health de cada worker
+    for clave, valor in parcial.items():
+        if isinstance(valor, bool):
+            continue
+        if isinstance(valor, (int, float)):
+            total[clave] = round(total.get(clave, 0) + valor, 3)
+        elif isinstance(valor, dict):
+            _sumar(total.setdefault(clave, {}), valor)
+
+def estado_workers() -> dict | None:
+    """Estado agregado de los workers (lo escribe el padre); None si el proceso no es un worker prefork."""
+    directorio = os.getenv("PREFORK_DIR")
+    if not directorio:
+        return None
+    return _leer_json(os.path.join(directorio, ARCHIVO_ESTADO))
+
+class Worker:
+    def __init__(self, pid: int, slot: int):
+        self.pid       = pid
+        self.slot      = slot
+        self.inicio    = time.monotonic()
+        self.iniciado  = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.retirando = False
+
+class ServidorPrefork:
+    """
+    Padre de los workers de una API. `ejecutar` carga el modelo, crea el
+    socket de escucha, hace fork de `workers` procesos que corren uvicorn
+    sobre ese socket y se queda supervisándolos hasta SIGTERM o SIGINT.
+    """
+
+    def __init__(self, api: str, workers: int = PREFORK_WORKERS, host: str = "0.0.0.0", port: int = 8000,
+                 intervalo_estado: float = PREFORK_HEALTH_INTERVAL, timeout_gracia: float = PREFORK_GRACEFUL_TIMEOUT):
+        carpeta, modulo_app, modulo_logica = APIS[api]
+        self.api       = api
+        self.workers   = workers
+        self.host      = host
+        self.port      = port
+        self.intervalo_estado = intervalo_estado
+        self.timeout_gracia   = timeout_gracia
+        self.directorio = tempfile.mkdtemp(prefix=f"prefork-{api}-")
+        # Directorio de estado compartido: los workers lo heredan y su /health lee el agregado de ahí
+        os.environ["PREFORK_DIR"] = self.directorio
+        sys.path[:0] = [RAIZ, os.path.join(RAIZ, carpeta)]
+        self.modulo_app = importlib.import_module(modulo_app)
+        self.logica     = importlib.import_module(modulo_logica)
+        self.cargador   = self.logica.cargador
+        self.activos: dict[int, Worker] = {}
+        self.reinicios = 0
+        self.reemplazos = 0
+        self._socket   = None
+        self._config   = None
+        self._detener  = False
+        self._reemplazar = False
+
+    def _preparar_fork(self):
+        # El ensamble va a páginas propias de solo lectura y gc.freeze saca del
+        # recolector los objetos ya creados: ni el GC ni los contadores de
+        # referencias del modelo ensucian las páginas que comparten los workers
+        motor = self.logica.modelo_activo()[1]
+        if isinstance(motor, EnsambleCompilado):
+            motor.empaquetar()
+        gc.collect()
+        gc.freeze()
+
+    def _crear_worker(self, slot: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            codigo = 1
+            try:
+                self._ejecutar_worker()
+                codigo = 0
+            except BaseException as e:
+                logging.error(f"Worker {os.getpid()} terminó con error: {e}")
+            finally:
+                os._exit(codigo)
+        self.activos[pid] = Worker(pid, slot)
+        logging.info(f"Worker {slot} iniciado (pid {pid})")
+        return pid
+
+    def _ejecutar_worker(self):
+        import uvicorn
+        for senal in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(senal, signal.SIG_DFL)
+        # El padre vigila el alias; el worker ya tiene el modelo publicado
+        self.cargador.intervalo = 0
+        threading.Thread(target=self._publicar_estado_worker, name="prefork-estado", daemon=True).start()
+        uvicorn.Server(self._config).run(sockets=[self._socket])
+
+    def _publicar_estado_worker(self):
+        ruta = os.path.join(self.directorio, f"worker-{os.getpid()}.json")
+        while True:
+            try:
+                estado = self.modulo_app.health()
+                estado.pop("workers", None)
+                _escribir_json(ruta, {"pid": os.getpid(), "ts": time.time(), "health": estado})
+            except Exception as e:
+                logging.error(f"No se pudo publicar el estado del worker: {e}")
+            time.sleep(self.intervalo_estado)
+
+    def _recoger(self):
+        """Recoge los workers terminados y reinicia los que no se estaban retirando."""
+        while True:
+            try:
+                pid, estado = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.activos.pop(pid, None)
+            try:
+                os.unlink(os.path.join(self.directorio, f"worker-{pid}.json"))
+            except FileNotFoundError:
+                pass
+            if worker is None or worker.retirando or self._detener:
+                continue
+            logging.warning(f"Worker {worker.slot} (pid {pid}) murió con estado {estado}; se reinicia")
+            # Un worker que muere al arrancar no se relanza en bucle cerrado
+            if time.monotonic() - worker.inicio < 1:
+                time.sleep(1)
+            self.reinicios += 1
+            self._crear_worker(worker.slot)
+
+    def _terminar(self, pids: list[int]):
+        for pid in pids:
+            if pid in self.activos:
+                self.activos[pid].retirando = True
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        limite = time.monotonic() + self.timeout_gracia
+        while any(p in self.activos for p in pids) and time.monotonic() < limite:
+            time.sleep(0.05)
+            self._recoger()
+        for pid in pids:
+            if pid in self.activos:
+                logging.warning(f"Worker pid {pid} no terminó en {self.timeout_gracia} s; SIGKILL")
+                os.kill(pid, signal.SIGKILL)
+        while any(p in self.activos for p in pids):
+            time.sleep(0.05)
+            self._recoger()
+
+    def reemplazar_workers(self):
+        """Crea un worker nuevo por cada uno de los actuales y retira el viejo, de a uno."""
+        self._preparar_fork()
+        for pid, worker in list(self.activos.items()):
+            if self._detener:
+                return
+            self._crear_worker(worker.slot)
+            self._terminar([pid])
+        self.reemplazos += 1
+        logging.info(f"Workers reemplazados (modelo v{self.cargador.version})")
+
+    def estado(self) -> dict:
+        """Agregado de todos los workers: vivos, memoria, versión y la suma de sus contadores de /health."""
+        detalle, totales = [], {}
+        for worker in sorted(self.activos.values(), key=lambda w: w.slot):
+            publicado = _leer_json(os.path.join(self.directorio, f"worker-{worker.pid}.json")) or {}
+            salud = publicado.get("health") or {}
+            if salud:
+                _sumar(totales, salud)
+            detalle.append({
+                "slot": worker.slot,
+                "pid": worker.pid,
+                "iniciado": worker.iniciado,
+                "version_modelo": (salud.get("model") or {}).get("version"),
+                "estado_hace_s": round(time.time() - publicado["ts"], 1) if publicado else None,
+                **(memoria_proceso(worker.pid) or {}),
+            })
+        padre = memoria_proceso(os.getpid()) or {}
+        return {
+            "api": self.api,
+            "pid_padre": os.getpid(),
+            "workers": self.workers,
+            "vivos": len(detalle),
+            "reinicios": self.reinicios,
+            "reemplazos": self.reemplazos,
+            "version_modelo": self.cargador.version,
+            "rss_padre_mb": padre.get("rss_mb"),
+            "rss_total_mb": round(sum(w.get("rss_mb", 0) for w in detalle), 1),
+            "pss_total_mb": round(padre.get("pss_mb", 0) + sum(w.get("pss_mb", 0) for w in detalle), 1),
+            "actualizado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "detalle": detalle,
+            "totales": totales,
+        }
+
+    def _senal(self, senal, _frame):
+        if senal == signal.SIGHUP:
+            self._reemplazar = True
+        else:
+            self._detener = True
+
+    def ejecutar(self) -> int:
+        inicio = time.perf_counter()
+        if not self.cargador.cargar():
+            logging.error(f"No se pudo cargar el modelo {self.cargador.nombre}: {self.cargador.error}")
+            return 1
+        logging.info(f"Modelo v{self.cargador.version} cargado en el padre en {time.perf_counter() - inicio:.2f} s")
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(2048)
+        self._socket.set_inheritable(True)
+        for senal in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(senal, self._senal)
+
+        # Config.load importa los protocolos HTTP y el loop de uvicorn en el padre, no en cada worker
+        import uvicorn
+        self._config = uvicorn.Config(self.modulo_app.app, lifespan="on", log_level="info")
+        self._config.load()
+        self._preparar_fork()
+        for slot in range(self.workers):
+            self._crear_worker(slot)
+        logging.info(f"{self.workers} workers de {self.api} escuchando en {self.host}:{self.port}")
+        proxima_revision = time.monotonic() + self.cargador.intervalo
+        proximo_estado = 0.0
+        try:
+            while not self._detener:
+                self._recoger()
+                ahora = time.monotonic()
+                if self._reemplazar:
+                    self._reemplazar = False
+                    self.reemplazar_workers()
+                if self.cargador.intervalo > 0 and ahora >= proxima_revision:
+                    proxima_revision = ahora + self.cargador.intervalo
+                    if self.cargador.revisar():
+                        self.reemplazar_workers()
+                if ahora >= proximo_estado:
+                    proximo_estado = ahora + self.intervalo_estado
+                    _escribir_json(os.path.join(self.directorio, ARCHIVO_ESTADO), self.estado())
+                time.sleep(0.1)
+        finally:
+            logging.info("Deteniendo workers...")
+            self._terminar(list(self.activos))
+            self._socket.close()
+        return 0
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Sirve una API con workers pre-fork que comparten el modelo")
+    parser.add_argument("api", choices=sorted(APIS))
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    return ServidorPrefork(args.api, args.workers, args.host, args.port).ejecutar()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import io
+import os
+import sys
+import inspect
+import time
+import uuid
+import marshal
+import pstats
+import random
+import cProfile
+import hmac
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from serving import metrics
+
+# Token que habilita el header X-Profile y los endpoints /admin/profiles; sin token todo queda apagado
+PROFILING_TOKEN        = os.getenv("PROFILING_TOKEN")
+# Fracción de solicitudes que se perfilan solas (0 = solo bajo pedido)
+PROFILE_SAMPLE_RATE    = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Perfiles guardados en memoria para descargar; se descartan los más viejos
+PROFILE_MAX_STORED     = int(os.getenv("PROFILE_MAX_STORED", "20"))
+# "cprofile" (determinista, pstats) o "sample" (muestreo de stacks, formato collapsed)
+PROFILE_MODE           = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "2"))
+
+MODOS = ("cprofile", "sample", "timing")
+
+def _collapsed(frame) -> str:
+    """Stack del frame en formato collapsed (raíz;...;hoja)."""
+    partes = []
+    while frame is not None:
+        codigo = frame.f_code
+        partes.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(partes))
+
+class Perfil:
+    """
+    Perfil de una solicitud. Se usa como context manager alrededor del
+    handler, en el hilo donde corre: con "cprofile" activa cProfile en ese
+    hilo; con "sample" agrega el hilo al muestreo de stacks, que también
+    cubre el hilo del event loop (parseo y validación del cuerpo).
+    """
+
+    def __init__(self, ruta: str, modo: str, intervalo_ms: float = PROFILE_SAMPLE_INTERVAL_MS):
+        self.id       = uuid.uuid4().hex[:12]
+        self.ruta     = ruta
+        self.modo     = modo
+        self.fecha    = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.duracion = None
+        self.etapas   = {}
+        self.datos    = None
+        self._intervalo = intervalo_ms / 1000
+        self._profiler  = cProfile.Profile() if modo == "cprofile" else None
+        self._muestras  = Counter()
+        self._hilos     = set()
+        self._hilo_loop = None
+        self._detener   = threading.Event()
+        self._muestreador = None
+
+    def iniciar(self):
+        if self.modo == "sample":
+            self._hilo_loop = threading.get_ident()
+            self._hilos.add(threading.get_ident())
+            self._muestreador = threading.Thread(target=self._muestrear, name=f"perfil-{self.id}", daemon=True)
+            self._muestreador.start()
+
+    def _muestrear(self):
+        while not self._detener.wait(self._intervalo):
+            frames = sys._current_frames()
+            for hilo in tuple(self._hilos):
+                frame = frames.get(hilo)
+                if frame is not None:
+                    self._muestras[_collapsed(frame)] += 1
+
+    def __enter__(self):
+        if self._profiler is not None:
+            self._profiler.enable()
+        elif self.modo == "sample":
+            self._hilos.add(threading.get_ident())
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler is not None:
+            self._profiler.disable()
+        elif self.modo == "sample" and threading.get_ident() != self._hilo_loop:
+            # El hilo vuelve al thread pool: deja de muestrearse
+            self._hilos.discard(threading.get_ident())
+        return False
+
+    def terminar(self, duracion: float, etapas: dict):
+        self.duracion, self.etapas = duracion, etapas
+        if self._muestreador is not None:
+            self._detener.set()
+            self._muestreador.join()
+            self.datos = "".join(f"{stack} {n}\n" for stack, n in self._muestras.most_common()).encode()
+        elif self._profiler is not None:
+            # Mismo contenido que pstats.Stats.dump_stats: se abre con pstats.Stats(archivo)
+            self._profiler.create_stats()
+            self.datos = marshal.dumps(self._profiler.stats)
+
+    def resumen(self, limite: int = 25) -> str:
+        """Top de funciones por tiempo acumulado (cprofile) o de stacks (sample)."""
+        if self.modo == "cprofile" and self._profiler is not None:
+            salida = io.StringIO()
+            pstats.Stats(self._profiler, stream=salida).sort_stats("cumulative").print_stats(limite)
+            return salida.getvalue()
+        return "".join(f"{n:6d} {stack}\n" for stack, n in self._muestras.most_common(limite))
+
+    def descripcion(self) -> dict:
+        return {
+            "id": self.id,
+            "ruta": self.ruta,
+            "modo": self.modo,
+            "fecha": self.fecha,
+            "duracion_ms": round(self.duracion * 1000, 3) if self.duracion is not None else None,
+            "etapas_ms": {k: round(v * 1000, 3) for k, v in self.etapas.items()},
+            "bytes": len(self.datos) if self.datos else 0,
+        }
+
+class Perfilador:
+    """Decide qué solicitudes se perfilan y guarda los últimos `max_guardados` perfiles."""
+
+    def __init__(self, token: str | None = PROFILING_TOKEN, tasa: float = PROFILE_SAMPLE_RATE,
+                 max_guardados: int = PROFILE_MAX_STORED, modo: str = PROFILE_MODE):
+        self.token = token
+        self.tasa  = tasa
+        self.max_guardados = max(1, max_guardados)
+        self.modo  = modo if modo in MODOS else "cprofile"
+        self._perfiles = OrderedDict()
+        self._armados  = {}   # ruta -> [restantes, modo]
+        self._lock     = threading.Lock()
+
+    def token_valido(self, valor: str | None) -> bool:
+        return bool(self.token) and valor is not None and hmac.compare_digest(valor, self.token)
+
+    def armar(self, ruta: str, cantidad: int, modo: str):
+        with self._lock:
+            if cantidad > 0:
+                self._armados[ruta] = [cantidad, modo]
+            else:
+                self._armados.pop(ruta, None)
+
+    def armados(self) -> dict:
+        with self._lock:
+            return {ruta: {"restantes": n, "modo": modo} for ruta, (n, modo) in self._armados.items()}
+
+    def elegir_modo(self, ruta: str, header: str | None, modo_header: str | None) -> str | None:
+        """Modo de perfilado para la solicitud, o None si no se perfila."""
+        if header is not None and self.token_valido(header):
+            return modo_header if modo_header in MODOS else self.modo
+        if self._armados:
+            with self._lock:
+                armado = self._armados.get(ruta)
+                if armado is not None:
+                    armado[0] -= 1
+                    if armado[0] <= 0:
+                        del self._armados[ruta]
+                    return armado[1]
+        if self.tasa > 0 and random.random() < self.tasa:
+            return self.modo
+        return None
+
+    def guardar(self, perfil: Perfil):
+        if perfil.datos is None:
+            return
+        with self._lock:
+            self._perfiles[perfil.id] = perfil
+            while len(self._perfiles) > self.max_guardados:
+                self._perfiles.popitem(last=False)
+
+    def listar(self) -> list[dict]:
+        with self._lock:
+            return [p.descripcion() for p in reversed(self._perfiles.values())]
+
+    def obtener(self, id_perfil: str) -> Perfil | None:
+        with self._lock:
+            return self._perfiles.get(id_perfil)
+
+def _header(scope, nombre: bytes) -> str | None:
+    for clave, valor in scope.get("headers", []):
+        if clave.lower() == nombre:
+            return valor.decode("latin-1")
+    return None
+
+def _server_timing(etapas: dict) -> bytes:
+    return ", ".join(f"{nombre};dur={duracion * 1000:.3f}" for nombre, duracion in etapas.items()).encode()
+
+class MiddlewareProfiling:
+    """
+    Perfila las solicitudes elegidas por `Perfilador` y agrega a su respuesta
+    `Server-Timing` con el desglose por etapa y `X-Profile-Id` para descargar
+    el perfil. Va dentro de MiddlewareMetricas, que crea el contexto de la
+    solicitud. Las solicitudes no elegidas solo pagan la lectura de un header.
+
+    En las rutas async el handler corre en el hilo del event loop, y cProfile
+    mediría también a todas las solicitudes que se intercalan mientras espera:
+    ahí el modo "cprofile" se reemplaza por "sample", que atribuye cada stack
+    a su hilo y se lee como perfil del loop durante la solicitud.
+    """
+
+    def __init__(self, app, perfilador: Perfilador):
+        self.app = app
+        self.perfilador = perfilador
+        self._asincronas = None
+
+    def _ruta_asincrona(self, scope) -> bool:
+        if self._asincronas is None:
+            self._asincronas = {r.path for r in getattr(scope.get("app"), "routes", [])
+                                if inspect.iscoroutinefunction(getattr(r, "endpoint", None))}
+        return scope["path"] in self._asincronas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        modo = self.perfilador.elegir_modo(metrics.ruta_actual(), _header(scope, b"x-profile"),
+                                           _header(scope, b"x-profile-mode"))
+        if modo is None:
+            await self.app(scope, receive, send)
+            return
+        if modo == "cprofile" and self._ruta_asincrona(scope):
+            modo = "sample"
+
+        perfil = Perfil(metrics.ruta_actual(), modo)
+        if modo != "timing":
+            metrics.asignar_perfil(perfil)
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                metrics.marcar("respuesta")
+                headers = list(mensaje.get("headers", []))
+                headers.append((b"server-timing", _server_timing(metrics.desglose_actual())))
+                if modo != "timing":
+                    headers.append((b"x-profile-id", perfil.id.encode()))
+                mensaje = {**mensaje, "headers": headers}
+            await send(mensaje)
+
+        perfil.iniciar()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            perfil.terminar(time.perf_counter() - inicio, metrics.desglose_actual())
+            self.perfilador.guardar(perfil)
+
+def router_profiling(perfilador: Perfilador) -> APIRouter:
+    """Endpoints de administración de perfiles, protegidos con `X-Admin-Token` = PROFILING_TOKEN."""
+    router = APIRouter(prefix="/admin/profiles", tags=["profiling"])
+
+    def verificar(token: str | None):
+        if not perfilador.token:
+            raise HTTPException(status_code=404, detail="Profiling deshabilitado")
+        if not perfilador.token_valido(token):
+            raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+    @router.get("")
+    def listar_perfiles(x_admin_token: str | None = Header(None)):
+        verificar(x_admin_token)
+        return {"tasa": perfilador.tasa, "armados": perfilador.armados(), "perfiles": perfilador.listar()}
+
+    @router.post("/arm")
+    def armar_perfiles(route: str, count: int = Query(1, ge=0, le=1000),
+                       mode: str = Query(PROFILE_MODE, pattern="^(cprofile|sample|timing)$"),
+                       x_admin_token: str | None = Header(None)):
+        """Perfila las próximas `count` solicitudes a `route` (0 desarma)."""
+        verificar(x_admin_token)
+        perfilador.armar(route, count, mode)
+        return {"armados": perfilador.armados()}
+
+    @router.get("/{id_perfil}")
+    def descargar_perfil(id_perfil: str, formato: str = Query("raw", pattern="^(raw|text)$"),
+                         x_admin_token: str | None = Header(None)):
+        """`raw`: archivo pstats (cprofile) o collapsed stacks (sample); `text`: resumen legible."""
+        verificar(x_admin_token)
+        perfil = perfilador.obtener(id_perfil)
+        if perfil is None:
+            raise HTTPException(status_code=404, detail="Perfil no encontrado")
+        if formato == "text":
+            return Response(perfil.resumen(), media_type="text/plain")
+        extension = "pstats" if perfil.modo == "cprofile" else "collapsed"
+        return Response(perfil.datos, media_type="application/octet-stream", headers={
+            "Content-Disposition": f'attachment; filename="{perfil.id}.{extension}"'
+        })
+
+    return router
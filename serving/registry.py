@@ -0,0 +1,185 @@
+import gc
+import os
+import time
+import pickle
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from serving.tree_engine import EnsambleCompilado
+
+# Segundos sin uso tras los que un modelo puede descargarse
+MODEL_IDLE_SECONDS     = float(os.getenv("MODEL_IDLE_SECONDS", "900"))
+# Presupuesto de memoria de los modelos cargados; 0 = descargar todo modelo inactivo
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+# Cuánto espera la primera solicitud a que termine la carga perezosa (después responde 503)
+MODEL_LOAD_TIMEOUT     = float(os.getenv("MODEL_LOAD_TIMEOUT", "30"))
+
+def memoria_modelo(modelo) -> int:
+    """Bytes estimados del modelo en memoria: los arreglos (artefacto ligero), el booster serializado (XGBoost) o el pickle."""
+    if isinstance(modelo, EnsambleCompilado):
+        return modelo.nbytes
+    try:
+        return len(modelo.get_booster().save_raw("ubj"))
+    except Exception:
+        try:
+            return len(pickle.dumps(modelo))
+        except Exception:
+            return 0
+
+class EntradaModelo:
+    def __init__(self, nombre: str, cargador, activo):
+        self.nombre     = nombre
+        self.cargador   = cargador
+        self.activo     = activo      # () -> modelo publicado o None
+        self.ultimo_uso = None        # time.monotonic() del último uso
+        self.abiertas   = 0           # solicitudes en curso (un stream largo cuenta hasta su último byte)
+        self.desalojos  = 0
+        self.libre      = threading.Event()  # limpio mientras el modelo se está descargando
+        self.libre.set()
+        self._memoria   = (None, 0)   # (id del modelo medido, bytes)
+
+    def memoria(self) -> int:
+        modelo = self.activo()
+        if modelo is None:
+            return 0
+        if self._memoria[0] != id(modelo):
+            self._memoria = (id(modelo), memoria_modelo(modelo))
+        return self._memoria[1]
+
+class RegistroModelos:
+    """
+    Registro de los modelos de un proceso con varias APIs (el gateway).
+
+    Cada modelo se carga con su CargadorModelo recién en la primera solicitud
+    que lo usa (`usar`). Un hilo vigilante descarga los modelos que llevan
+    `inactividad` segundos sin uso: con `presupuesto_mb` > 0 solo mientras
+    la memoria estimada de los modelos cargados supere el presupuesto,
+    empezando por el menos usado recientemente; con 0, todos los inactivos.
+    Un modelo con solicitudes en curso (`en_uso`) no se descarga. Un modelo
+    descargado vuelve a cargarse en la próxima solicitud.
+    """
+
+    def __init__(self, inactividad: float = MODEL_IDLE_SECONDS, presupuesto_mb: float = MODEL_MEMORY_BUDGET_MB,
+                 timeout_carga: float = MODEL_LOAD_TIMEOUT):
+        self.inactividad    = inactividad
+        self.presupuesto_mb = presupuesto_mb
+        self.timeout_carga  = timeout_carga
+        self._entradas = {}
+        self._lock     = threading.Lock()
+        self._detener  = threading.Event()
+        self._hilo     = None
+
+    def registrar(self, nombre: str, cargador, activo):
+        """`activo()` devuelve el modelo publicado por el módulo de predicción (None si no hay)."""
+        self._entradas[nombre] = EntradaModelo(nombre, cargador, activo)
+
+    def __contains__(self, nombre: str) -> bool:
+        return nombre in self._entradas
+
+    def cargar(self, nombre: str):
+        """
+        Inicia la carga del modelo si no está cargado ni cargándose. Si el
+        modelo se está descargando, espera a que termine y lo vuelve a cargar.
+        """
+        entrada = self._entradas[nombre]
+        entrada.ultimo_uso = time.monotonic()
+        entrada.libre.wait()
+        with self._lock:
+            if not entrada.cargador.activo and entrada.cargador.fase != "listo":
+                entrada.cargador.iniciar()
+
+    async def usar(self, nombre: str):
+        """Marca el uso y, si el modelo no está listo, lo carga y espera hasta `timeout_carga`."""
+        entrada = self._entradas[nombre]
+        if entrada.cargador.fase == "listo" and entrada.libre.is_set():
+            entrada.ultimo_uso = time.monotonic()
+            return
+        # Fuera del event loop: cargar puede esperar una descarga en curso
+        await asyncio.to_thread(self.cargar, nombre)
+        if entrada.cargador.fase != "listo":
+            await asyncio.to_thread(entrada.cargador.esperar, self.timeout_carga)
+
+    @contextmanager
+    def en_uso(self, nombre: str):
+        """Marca el modelo en uso mientras dura el bloque: no se descarga en medio de un stream."""
+        entrada = self._entradas[nombre]
+        with self._lock:
+            entrada.abiertas += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entrada.abiertas -= 1
+                entrada.ultimo_uso = time.monotonic()
+
+    def desalojar(self, ahora: float | None = None) -> list[str]:
+        """Descarga los modelos inactivos según el presupuesto; devuelve sus nombres."""
+        ahora = time.monotonic() if ahora is None else ahora
+        # Bajo el lock solo se eligen y marcan las víctimas: descargar() espera al
+        # hilo de carga (que puede estar en una llamada a MLflow) y no debe frenar a cargar()
+        with self._lock:
+            cargados = sorted((e for e in self._entradas.values() if e.activo() is not None and e.libre.is_set()),
+                              key=lambda e: e.ultimo_uso or 0)
+            total = sum(e.memoria() for e in cargados)
+            victimas = []
+            for entrada in cargados:
+                if self.presupuesto_mb > 0 and total <= self.presupuesto_mb * 1024 * 1024:
+                    break
+                if entrada.abiertas or (entrada.ultimo_uso is not None and ahora - entrada.ultimo_uso < self.inactividad):
+                    continue
+                total -= entrada.memoria()
+                entrada.libre.clear()
+                victimas.append(entrada)
+        desalojados = []
+        for entrada in victimas:
+            try:
+                entrada.cargador.descargar()
+                entrada._memoria = (None, 0)
+                entrada.desalojos += 1
+                desalojados.append(entrada.nombre)
+            finally:
+                entrada.libre.set()
+        if desalojados:
+            gc.collect()
+            logging.info(f"Modelos descargados por inactividad: {', '.join(desalojados)}")
+        return desalojados
+
+    def iniciar(self, intervalo: float | None = None):
+        """Revisa la inactividad cada `intervalo` segundos (por defecto, un cuarto de `inactividad`)."""
+        intervalo = intervalo or max(1.0, min(60.0, self.inactividad / 4))
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._vigilar, args=(intervalo,), name="registro-modelos", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        for entrada in self._entradas.values():
+            entrada.cargador.detener()
+
+    def _vigilar(self, intervalo: float):
+        while not self._detener.wait(intervalo):
+            try:
+                self.desalojar()
+            except Exception as e:
+                logging.error(f"Error al desalojar modelos: {e}")
+
+    def estado(self) -> dict:
+        ahora = time.monotonic()
+        modelos = {}
+        for nombre, entrada in self._entradas.items():
+            memoria = entrada.memoria()
+            modelos[nombre] = {
+                **entrada.cargador.estado(),
+                "cargado": entrada.activo() is not None,
+                "memoria_bytes": memoria,
+                "inactivo_s": round(ahora - entrada.ultimo_uso, 1) if entrada.ultimo_uso is not None else None,
+                "en_uso": entrada.abiertas,
+                "desalojos": entrada.desalojos,
+            }
+        return {
+            "inactividad_s": self.inactividad,
+            "presupuesto_mb": self.presupuesto_mb,
+            "memoria_mb": round(sum(m["memoria_bytes"] for m in modelos.values()) / (1024 * 1024), 3),
+            "modelos": modelos,
+        }
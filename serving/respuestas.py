@@ -0,0 +1,57 @@
+import json
+import numpy as np
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:   # sin orjson se usa json estándar: mismos bytes, más lento
+    orjson = None
+
+def json_estandar(contenido) -> bytes:
+    """Los mismos bytes que produce JSONResponse (el encoder por defecto de FastAPI)."""
+    return json.dumps(contenido, ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+def floats_compatibles(valores) -> bool:
+    """
+    orjson y json.dumps escriben igual un float finito si es 0 o si
+    1e-4 <= |x| < 1e16. Fuera de ese rango difiere la notación exponencial
+    (1e-05 frente a 1e-5). Para NaN e infinito, json.dumps falla y orjson
+    escribe null.
+    """
+    a = np.abs(np.asarray(valores, dtype=np.float64))
+    return bool(np.all((a == 0) | ((a >= 1e-4) & (a < 1e16))))
+
+def codificar_lote(predicciones: list[dict], campos_float: tuple = ()) -> bytes:
+    """
+    Cuerpo {"total", "predicciones"} de los endpoints batch, con el mismo
+    formato byte a byte que el response_model. Las filas son dicts con las
+    claves en el orden del schema. Se codifican con orjson salvo que algún
+    valor de `campos_float` se escriba distinto. En ese caso se usa json
+    estándar, que también rechaza NaN como antes.
+    """
+    contenido = {"total": len(predicciones), "predicciones": predicciones}
+    if orjson is not None and all(floats_compatibles([p[c] for p in predicciones]) for c in campos_float):
+        return orjson.dumps(contenido)
+    return json_estandar(contenido)
+
+def codificar(contenido) -> bytes:
+    """JSON compacto con orjson si está instalado; para respuestas sin un formato previo que conservar."""
+    return orjson.dumps(contenido) if orjson is not None else json_estandar(contenido)
+
+class RespuestaJSON(Response):
+    """Respuesta ya codificada con `codificar`, sin pasar por jsonable_encoder."""
+    media_type = "application/json"
+
+    def __init__(self, contenido, **kwargs):
+        super().__init__(codificar(contenido), **kwargs)
+
+class RespuestaLote(Response):
+    """
+    Respuesta batch ya codificada. FastAPI no vuelve a validarla contra el
+    response_model, que sigue declarado en la ruta para el schema OpenAPI.
+    """
+    media_type = "application/json"
+
+    def __init__(self, predicciones: list[dict], campos_float: tuple = (), **kwargs):
+        super().__init__(codificar_lote(predicciones, campos_float), **kwargs)
@@ -0,0 +1,252 @@
+"""
+Reparto de lotes muy grandes entre un pool persistente de procesos.
+
+Un lote con al menos `SHARD_MIN_ROWS` filas se parte en shards contiguos. El
+hilo de la solicitud puntúa el primero y los demás van a los workers del
+pool. Nada se serializa con pickle salvo nombres y offsets:
+
+- la matriz de entrada y el arreglo de salida viven en memoria compartida;
+- el ensamble compilado (serving/tree_engine.py) se publica una vez por
+  versión en su propio bloque compartido, que cada worker mapea sin copiarlo.
+
+Los lotes chicos no pasan por acá y conservan su latencia. Si el pool falla
+(un worker murió, el modelo ya se retiró) el lote se puntúa en el proceso.
+
+Experimental: solo se midió en 1 CPU, donde no acelera nada (ver el README
+de la German Credit Risk API). Por eso `SHARD_MIN_ROWS` es 0 por defecto.
+"""
+import os
+import math
+import time
+import logging
+import threading
+from multiprocessing import get_context, shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from serving.tree_engine import EnsambleCompilado
+
+# Lotes con al menos estas filas se reparten entre procesos; 0 lo desactiva
+SHARD_MIN_ROWS = int(os.getenv("SHARD_MIN_ROWS", "0"))
+# Procesos del pool (además del hilo de la solicitud, que puntúa un shard)
+SHARD_WORKERS  = int(os.getenv("SHARD_WORKERS", str(max(1, (os.cpu_count() or 1) - 1))))
+# Filas por shard; 0 = repartir en partes iguales entre el hilo de la solicitud y los workers
+SHARD_ROWS     = int(os.getenv("SHARD_ROWS", "0"))
+
+def _alinear(n: int) -> int:
+    return -(-n // 64) * 64
+
+def _adjuntar(nombre: str) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(name=nombre)
+
+# --- Lado del worker -------------------------------------------------------
+
+# nombre del bloque -> (memoria compartida, ensamble); los dos últimos modelos
+_modelos_worker = {}
+
+def _ensamble_worker(meta: dict) -> EnsambleCompilado:
+    entrada = _modelos_worker.get(meta["bloque"])
+    if entrada is not None:
+        return entrada[1]
+    shm = _adjuntar(meta["bloque"])
+    arreglos = {}
+    for nombre, dtype, forma, offset in meta["arreglos"]:
+        a = np.ndarray(forma, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+        a.flags.writeable = False
+        arreglos[nombre] = a
+    ensamble = EnsambleCompilado(feature_names=meta["feature_names"], profundidad=meta["profundidad"],
+                                 objetivo=meta["objetivo"], **arreglos)
+    while len(_modelos_worker) >= 2:
+        viejo, ensamble_viejo = _modelos_worker.pop(next(iter(_modelos_worker)))
+        del ensamble_viejo   # las vistas deben soltarse antes de cerrar el bloque
+        viejo.close()
+    _modelos_worker[meta["bloque"]] = (shm, ensamble)
+    return ensamble
+
+def _puntuar_shard(meta: dict, entrada: str, salida: str, forma: tuple, inicio: int, fin: int) -> int:
+    """Escribe en la salida compartida la predicción de las filas [inicio, fin) de la entrada compartida."""
+    ensamble = _ensamble_worker(meta)
+    shm_x, shm_y = _adjuntar(entrada), _adjuntar(salida)
+    try:
+        X = np.ndarray(forma, dtype=np.float32, buffer=shm_x.buf)
+        y = np.ndarray(forma[0], dtype=np.float32, buffer=shm_y.buf)
+        y[inicio:fin] = _prediccion(ensamble, X[inicio:fin])
+        del X, y
+    finally:
+        shm_x.close()
+        shm_y.close()
+    return fin - inicio
+
+def _precargar(meta: dict) -> int:
+    _ensamble_worker(meta)
+    return os.getpid()
+
+def _prediccion(ensamble: EnsambleCompilado, X: np.ndarray) -> np.ndarray:
+    # Probabilidad de la clase 1 o valor de la regresión, en float32 como el ensamble
+    if ensamble.es_clasificador:
+        return ensamble.predict_proba(X)[:, 1]
+    return ensamble.margen(X)
+
+# --- Lado de la API ---------------------------------------------------------
+
+class ModeloCompartido:
+    """Arreglos de un ensamble copiados a un bloque de memoria compartida con nombre."""
+
+    def __init__(self, ensamble: EnsambleCompilado):
+        arreglos = [(a, getattr(ensamble, a)) for a in EnsambleCompilado.ARREGLOS]
+        tamano = sum(_alinear(a.nbytes) for _, a in arreglos)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(tamano, 1))
+        self.ensamble = ensamble
+        ubicaciones, offset = [], 0
+        for nombre, a in arreglos:
+            np.ndarray(a.shape, dtype=a.dtype, buffer=self.shm.buf, offset=offset)[...] = a
+            ubicaciones.append((nombre, a.dtype.str, a.shape, offset))
+            offset += _alinear(a.nbytes)
+        self.meta = {
+            "bloque": self.shm.name,
+            "arreglos": ubicaciones,
+            "feature_names": ensamble.feature_names,
+            "profundidad": ensamble.profundidad,
+            "objetivo": ensamble.objetivo,
+        }
+
+    def liberar(self):
+        self.shm.close()
+        self.shm.unlink()
+
+class PoolShards:
+    """
+    Pool persistente de procesos para los lotes de al menos `min_filas`.
+    Se crea en el primer lote grande; el modelo se publica con `publicar`
+    al activarse (los workers lo mapean de antemano) o en su primer uso.
+    """
+
+    def __init__(self, nombre: str, workers: int = SHARD_WORKERS, min_filas: int = SHARD_MIN_ROWS,
+                 filas_shard: int = SHARD_ROWS):
+        self.nombre      = nombre
+        self.workers     = max(1, workers)
+        self.min_filas   = min_filas
+        self.filas_shard = filas_shard
+        self._pool       = None
+        self._modelos    = {}   # id(ensamble) -> ModeloCompartido; el activo y el saliente
+        self._lock       = threading.Lock()
+        self.lotes = self.filas = self.shards = self.errores = 0
+        self.ultimo_ms = None
+
+    @property
+    def activo(self) -> bool:
+        return self.min_filas > 0
+
+    def aplica(self, filas: int) -> bool:
+        return self.activo and filas >= self.min_filas
+
+    def _pool_activo(self) -> ProcessPoolExecutor:
+        # spawn: los workers arrancan limpios (sin los hilos ni los locks del servidor)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"))
+            logging.info(f"Pool de shards de {self.nombre}: {self.workers} procesos")
+        return self._pool
+
+    def _compartido(self, ensamble: EnsambleCompilado) -> ModeloCompartido:
+        # Con el lock tomado
+        compartido = self._modelos.get(id(ensamble))
+        if compartido is not None and compartido.ensamble is ensamble:
+            return compartido
+        compartido = ModeloCompartido(ensamble)
+        self._modelos[id(ensamble)] = compartido
+        while len(self._modelos) > 2:
+            self._modelos.pop(next(iter(self._modelos))).liberar()
+        return compartido
+
+    def publicar(self, ensamble: EnsambleCompilado | None):
+        """Copia el modelo nuevo a memoria compartida y hace que cada worker lo mapee antes del primer lote."""
+        if not self.activo or ensamble is None:
+            return
+        with self._lock:
+            meta = self._compartido(ensamble).meta
+            pool = self._pool_activo()
+        try:
+            for futuro in [pool.submit(_precargar, meta) for _ in range(self.workers)]:
+                futuro.result()
+        except Exception as e:
+            logging.warning(f"No se pudo precargar el modelo en el pool de shards: {e}")
+
+    def retirar(self):
+        """Libera los modelos compartidos (el modelo se descargó)."""
+        with self._lock:
+            for compartido in self._modelos.values():
+                compartido.liberar()
+            self._modelos.clear()
+
+    def predict_proba(self, ensamble: EnsambleCompilado, X: np.ndarray) -> np.ndarray:
+        """Lo mismo que `ensamble.predict_proba(X)`, repartido entre el pool."""
+        p = self._repartir(ensamble, X)
+        return np.column_stack([np.float32(1.0) - p, p])
+
+    def predict(self, ensamble: EnsambleCompilado, X: np.ndarray) -> np.ndarray:
+        """Lo mismo que `ensamble.predict(X)` para un modelo de regresión, repartido entre el pool."""
+        return self._repartir(ensamble, X)
+
+    def _repartir(self, ensamble: EnsambleCompilado, X: np.ndarray) -> np.ndarray:
+        inicio = time.perf_counter()
+        n = len(X)
+        filas_shard = self.filas_shard or math.ceil(n / (self.workers + 1))
+        limites = list(range(0, n, filas_shard)) + [n]
+        shm_x = shared_memory.SharedMemory(create=True, size=max(X.size * 4, 1))
+        shm_y = shared_memory.SharedMemory(create=True, size=max(n * 4, 1))
+        try:
+            resultado, error = self._puntuar_compartido(ensamble, X, limites, shm_x, shm_y)
+        finally:
+            for shm in (shm_x, shm_y):
+                shm.close()
+                shm.unlink()
+        with self._lock:
+            self.lotes += 1
+            self.filas += n
+            self.shards += len(limites) - 1
+            self.errores += error
+            self.ultimo_ms = round((time.perf_counter() - inicio) * 1000, 3)
+        return resultado
+
+    def _puntuar_compartido(self, ensamble, X, limites, shm_x, shm_y) -> tuple[np.ndarray, bool]:
+        # Las vistas sobre los bloques viven solo acá: al volver se pueden cerrar
+        entrada = np.ndarray(X.shape, dtype=np.float32, buffer=shm_x.buf)
+        np.copyto(entrada, X, casting="unsafe")
+        salida = np.ndarray(len(X), dtype=np.float32, buffer=shm_y.buf)
+        try:
+            with self._lock:
+                meta = self._compartido(ensamble).meta
+                pool = self._pool_activo()
+            futuros = [pool.submit(_puntuar_shard, meta, shm_x.name, shm_y.name, X.shape, a, b)
+                       for a, b in zip(limites[1:-1], limites[2:])]
+            # El hilo de la solicitud no queda ocioso: puntúa el primer shard
+            salida[:limites[1]] = _prediccion(ensamble, entrada[:limites[1]])
+            for futuro in futuros:
+                futuro.result()
+            return salida.copy(), False
+        except Exception as e:
+            logging.warning(f"Pool de shards de {self.nombre} no disponible, se puntúa en el proceso: {e}")
+            self._reiniciar()
+            return _prediccion(ensamble, entrada), True
+
+    def _reiniciar(self):
+        # Un worker caído deja el pool roto: el próximo lote crea uno nuevo
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def cerrar(self):
+        self._reiniciar()
+        self.retirar()
+
+    def estadisticas(self) -> dict:
+        return {
+            "min_filas": self.min_filas,
+            "workers": self.workers,
+            "pool_iniciado": self._pool is not None,
+            "lotes": self.lotes,
+            "filas": self.filas,
+            "shards": self.shards,
+            "errores": self.errores,
+            "ultimo_lote_ms": self.ultimo_ms,
+        }
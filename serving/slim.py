@@ -0,0 +1,165 @@
+"""
+Artefacto ligero de un modelo XGBoost: se sirve solo con NumPy, sin MLflow,
+pandas, scikit-learn ni XGBoost en el proceso de la API.
+
+    python -m serving.slim GermanCreditRisk-XGBoost --destino /srv/modelos
+    MODEL_SLIM_DIR=/srv/modelos uvicorn main:app
+"""
+import os
+import json
+import shutil
+import typing
+import hashlib
+import argparse
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from serving.tree_engine import EnsambleCompilado, compilar_modelo
+
+# Directorio de artefactos ligeros (`<dir>/<modelo>/<version>/`). Definido, ambas
+# APIs cargan de ahí y no importan MLflow, pandas ni XGBoost.
+MODEL_SLIM_DIR = os.getenv("MODEL_SLIM_DIR")
+
+FORMATO          = 1
+ARCHIVO_META     = "artefacto.json"
+ARCHIVO_ARREGLOS = "ensamble.npz"
+ARCHIVO_BOOSTER  = "booster.ubj"
+# Versión que se sirve; el CargadorModelo lo consulta como si fuera un alias
+ARCHIVO_ACTUAL   = "ACTUAL"
+ARREGLOS = EnsambleCompilado.ARREGLOS
+
+def _sha256(ruta: str) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+class ModeloLigero(EnsambleCompilado):
+    """
+    Ensamble compilado leído de un artefacto ligero. Predice con NumPy
+    (`predict_proba`, `predict`). `get_booster()` carga el booster original
+    la primera vez que se pide, para las contribuciones de /predict/explain;
+    recién ahí se importa XGBoost.
+    """
+
+    def __init__(self, ruta: str, meta: dict, **ensamble):
+        super().__init__(**ensamble)
+        self.ruta     = ruta
+        self.meta     = meta
+        self.version  = meta["version"]
+        self._booster = None
+        self._lock    = threading.Lock()
+
+    def get_booster(self):
+        with self._lock:
+            if self._booster is None:
+                import xgboost as xgb
+                booster = xgb.Booster()
+                booster.load_model(os.path.join(self.ruta, ARCHIVO_BOOSTER))
+                self._booster = booster
+            return self._booster
+
+def exportar(modelo, nombre: str, version, destino: str, extras: typing.Iterable[str] = ()) -> str:
+    """
+    Escribe `<destino>/<nombre>/<version>/` con el ensamble compilado, el
+    booster, los archivos de `extras` que existan (p. ej. el perfil de drift)
+    y `artefacto.json` con features, tipos, clases, versión y checksums.
+    Después apunta `ACTUAL` a esa versión. Devuelve la ruta del artefacto.
+    """
+    ensamble = compilar_modelo(modelo)
+    booster = modelo.get_booster()
+    dir_modelo = os.path.join(destino, nombre)
+    os.makedirs(dir_modelo, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f".{version}-", dir=dir_modelo)
+    try:
+        np.savez(os.path.join(tmp, ARCHIVO_ARREGLOS), **{a: getattr(ensamble, a) for a in ARREGLOS})
+        booster.save_model(os.path.join(tmp, ARCHIVO_BOOSTER))
+        for extra in extras:
+            if os.path.isfile(extra):
+                shutil.copy2(extra, tmp)
+        archivos = sorted(os.listdir(tmp))
+        meta = {
+            "formato": FORMATO,
+            "nombre": nombre,
+            "version": str(version),
+            "objetivo": ensamble.objetivo,
+            "features": ensamble.feature_names,
+            "tipos_features": booster.feature_types,
+            "clases": ensamble.classes_.tolist() if ensamble.classes_ is not None else None,
+            "profundidad": int(ensamble.profundidad),
+            "arboles": int(ensamble.roots.size - 1),
+            "exportado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "checksums": {f: _sha256(os.path.join(tmp, f)) for f in archivos},
+        }
+        with open(os.path.join(tmp, ARCHIVO_META), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        final = os.path.join(dir_modelo, str(version))
+        if os.path.isdir(final):
+            shutil.rmtree(final)
+        os.replace(tmp, final)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    fijar_actual(dir_modelo, version)
+    logging.info(f"Artefacto ligero de {nombre} v{version} en {final}")
+    return final
+
+def fijar_actual(dir_modelo: str, version):
+    tmp = os.path.join(dir_modelo, f".{ARCHIVO_ACTUAL}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(version))
+    os.replace(tmp, os.path.join(dir_modelo, ARCHIVO_ACTUAL))
+
+def version_actual(dir_modelo: str) -> str | None:
+    try:
+        with open(os.path.join(dir_modelo, ARCHIVO_ACTUAL), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def cargar_ligero(ruta: str) -> ModeloLigero:
+    """Lee un artefacto ligero y verifica sus checksums. Solo usa NumPy."""
+    with open(os.path.join(ruta, ARCHIVO_META), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("formato") != FORMATO:
+        raise ValueError(f"Formato de artefacto ligero no soportado: {meta.get('formato')}")
+    for archivo, checksum in meta["checksums"].items():
+        if _sha256(os.path.join(ruta, archivo)) != checksum:
+            raise ValueError(f"Checksum inválido en {archivo} de {ruta}")
+    with np.load(os.path.join(ruta, ARCHIVO_ARREGLOS)) as arreglos:
+        ensamble = {a: np.ascontiguousarray(arreglos[a]) for a in ARREGLOS}
+    clases = np.asarray(meta["clases"]) if meta["clases"] is not None else None
+    return ModeloLigero(ruta, meta, feature_names=meta["features"], profundidad=meta["profundidad"],
+                        objetivo=meta["objetivo"], classes=clases, **ensamble)
+
+def main(argv: typing.Sequence[str] | None = None) -> str:
+    parser = argparse.ArgumentParser(description="Exporta un modelo del registro MLflow como artefacto ligero")
+    parser.add_argument("nombre", help="Modelo registrado, p. ej. GermanCreditRisk-XGBoost o JiraTimePrediction")
+    parser.add_argument("--alias", default="production")
+    parser.add_argument("--version", help="Versión a exportar en lugar de la del alias")
+    parser.add_argument("--destino", default=MODEL_SLIM_DIR, required=MODEL_SLIM_DIR is None,
+                        help="Directorio de artefactos ligeros (MODEL_SLIM_DIR)")
+    parser.add_argument("--tracking-uri", default=os.getenv("MLFLOW_TRACKING_URI"))
+    args = parser.parse_args(argv)
+    # La exportación sí usa MLflow: corre fuera de las APIs (CI o un job de despliegue)
+    import mlflow
+    import mlflow.sklearn
+    from serving.model_store import AlmacenModelos
+    from serving.drift import PERFIL_DRIFT
+    if args.tracking_uri:
+        mlflow.set_tracking_uri(args.tracking_uri)
+    almacen = AlmacenModelos()
+    if args.version:
+        version = args.version
+        ruta = almacen.ruta_local(args.nombre, version) or almacen.descargar(args.nombre, version)
+    else:
+        version, ruta, _ = almacen.resolver(args.nombre, args.alias)
+    modelo = mlflow.sklearn.load_model(ruta)
+    final = exportar(modelo, args.nombre, version, args.destino, [os.path.join(ruta, PERFIL_DRIFT)])
+    print(final)
+    return final
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import json
+import mmap
+import numpy as np
+
+# Objetivos soportados y la transformación de margen a predicción
+OBJETIVOS_LOGISTICOS = {"binary:logistic", "reg:logistic"}
+OBJETIVOS_IDENTIDAD  = {"reg:squarederror", "reg:linear", "reg:absoluteerror", "reg:pseudohubererror"}
+
+class EnsambleCompilado:
+    """
+    Ensamble de árboles XGBoost aplanado en arreglos NumPy contiguos.
+
+    Todos los nodos de todos los árboles viven en los mismos arreglos. Las
+    hojas apuntan a sí mismas como hijo izquierdo y derecho, de modo que el
+    recorrido nivel por nivel avanza todas las filas y todos los árboles a la
+    vez durante `profundidad` pasos, sin ramas por fila. `hijos` intercala
+    (derecho, izquierdo) por nodo, así el siguiente nodo es
+    `hijos[2 * nodo + va_a_la_izquierda]`. El nodo 0 es una hoja
+    suelta con el margen base, para que la suma empiece por él igual que en
+    XGBoost.
+    """
+
+    def __init__(self, feature_names, feature, threshold, hijos, default_left,
+                 value, roots, profundidad, objetivo, classes=None):
+        self.feature_names = feature_names
+        self.feature      = feature
+        self.threshold    = threshold
+        self.hijos        = hijos
+        self.default_left = default_left
+        self.value        = value
+        self.roots        = roots
+        self.profundidad  = profundidad
+        self.objetivo     = objetivo
+        self.classes_     = classes
+
+    ARREGLOS = ("feature", "threshold", "hijos", "default_left", "value", "roots")
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria de los arreglos del ensamble."""
+        return sum(getattr(self, a).nbytes for a in self.ARREGLOS)
+
+    def empaquetar(self):
+        """
+        Copia los arreglos a un solo bloque de memoria anónima, alineados a
+        página, y los deja de solo lectura. Ningún objeto de Python comparte
+        esas páginas, así que después de un fork (serving/prefork.py) los
+        workers las leen sin copiarlas.
+        """
+        if getattr(self, "_bloque", None) is not None:
+            return
+        tamanos = [-(-getattr(self, a).nbytes // mmap.PAGESIZE) * mmap.PAGESIZE for a in self.ARREGLOS]
+        bloque = mmap.mmap(-1, max(sum(tamanos), mmap.PAGESIZE))
+        offset = 0
+        for nombre, tamano in zip(self.ARREGLOS, tamanos):
+            original = getattr(self, nombre)
+            vista = np.frombuffer(bloque, dtype=original.dtype, count=original.size, offset=offset)
+            vista = vista.reshape(original.shape)
+            vista[...] = original
+            vista.flags.writeable = False
+            setattr(self, nombre, vista)
+            offset += tamano
+        self._bloque = bloque
+
+    @property
+    def es_clasificador(self) -> bool:
+        return self.objetivo in OBJETIVOS_LOGISTICOS
+
+    def margen(self, X: np.ndarray) -> np.ndarray:
+        """Margen base más la suma de hojas, en float32 y en el orden de los árboles como XGBoost."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        n, n_features = X.shape
+        plano  = X.ravel()
+        filas  = (np.arange(n, dtype=np.intp) * n_features)[:, None]
+        nodos  = np.broadcast_to(self.roots, (n, self.roots.size))
+        hay_nan = bool(np.isnan(plano).any())
+        for _ in range(self.profundidad):
+            x = plano[filas + self.feature[nodos]]
+            izquierda = x < self.threshold[nodos]
+            if hay_nan:
+                izquierda = np.where(np.isnan(x), self.default_left[nodos], izquierda)
+            nodos = self.hijos[2 * nodos + izquierda]
+        # cumsum acumula en orden; el primer "árbol" es una hoja con el margen base
+        return np.cumsum(self.value[nodos], axis=1)[:, -1]
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        if not self.es_clasificador:
+            raise AttributeError("predict_proba solo aplica a modelos de clasificación")
+        p = np.float32(1.0) / (np.float32(1.0) + np.exp(-self.margen(X)))
+        return np.column_stack([np.float32(1.0) - p, p])
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        if self.es_clasificador:
+            clases = self.classes_ if self.classes_ is not None else np.array([0, 1])
+            return clases[(self.predict_proba(X)[:, 1] > 0.5).astype(np.intp)]
+        return self.margen(X)
+
+class IndiceUmbrales:
+    """
+    Discretiza cada feature según los umbrales de split del ensamble.
+
+    XGBoost va a la izquierda si `x < umbral` (en float32), así que dos filas
+    con el mismo número de umbrales `<= x` en cada feature caen en las mismas
+    hojas de todos los árboles y tienen exactamente la misma predicción. El
+    vector de bins sirve entonces como clave de cache sin aproximación.
+    """
+
+    def __init__(self, feature_names, umbrales: list):
+        self.feature_names = feature_names
+        self.umbrales = umbrales
+
+    @property
+    def total_bins(self) -> int:
+        return int(sum(u.size + 1 for u in self.umbrales))
+
+    def bins(self, X: np.ndarray) -> np.ndarray:
+        """Índice de bin por fila y feature; -1 para valores faltantes."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        resultado = np.empty(X.shape, dtype=np.int32)
+        for j, umbrales in enumerate(self.umbrales):
+            columna = X[:, j]
+            resultado[:, j] = np.searchsorted(umbrales, columna, side="right")
+            resultado[np.isnan(columna), j] = -1
+        return resultado
+
+    def claves(self, X: np.ndarray) -> list:
+        return [tuple(fila) for fila in self.bins(X).tolist()]
+
+def _learner(model) -> dict:
+    if not hasattr(model, "get_booster"):
+        raise ValueError(f"{type(model).__name__} no es un modelo XGBoost")
+    return json.loads(model.get_booster().save_raw("json"))["learner"]
+
+def indexar_umbrales(model) -> IndiceUmbrales:
+    """Junta los umbrales de split de todos los árboles, por feature, ordenados y sin repetir."""
+    if isinstance(model, EnsambleCompilado):
+        return _indexar_compilado(model)
+    learner = _learner(model)
+    n_features = int(learner["learner_model_param"]["num_feature"])
+    por_feature = [[] for _ in range(n_features)]
+    for tree in learner["gradient_booster"]["model"]["trees"]:
+        if any(tree.get("split_type", [])):
+            raise ValueError("Splits categóricos no soportados")
+        internos = np.asarray(tree["left_children"]) != -1
+        features = np.asarray(tree["split_indices"])[internos]
+        umbrales = np.asarray(tree["split_conditions"], dtype=np.float32)[internos]
+        for f, u in zip(features.tolist(), umbrales):
+            por_feature[f].append(u)
+    return IndiceUmbrales(
+        feature_names=learner.get("feature_names") or None,
+        umbrales=[np.unique(np.asarray(u, dtype=np.float32)) for u in por_feature],
+    )
+
+def _indexar_compilado(ensamble: EnsambleCompilado) -> IndiceUmbrales:
+    # Las hojas apuntan a sí mismas; el resto de los nodos son splits
+    internos = ensamble.hijos[0::2] != np.arange(ensamble.feature.size)
+    n_features = (len(ensamble.feature_names) if ensamble.feature_names
+                  else int(ensamble.feature[internos].max(initial=-1)) + 1)
+    return IndiceUmbrales(
+        feature_names=ensamble.feature_names,
+        umbrales=[np.unique(ensamble.threshold[internos & (ensamble.feature == j)]) for j in range(n_features)],
+    )
+
+def compilar_modelo(model) -> EnsambleCompilado:
+    """
+    Convierte un estimador XGBoost (wrapper sklearn) en un `EnsambleCompilado`.
+
+    Lanza `ValueError` si el modelo no es un gbtree binario o de regresión
+    soportado; quien llama debe seguir usando el modelo original en ese caso.
+    Un ensamble ya compilado (p. ej. un artefacto ligero) se devuelve tal cual.
+    """
+    if isinstance(model, EnsambleCompilado):
+        return model
+    learner = _learner(model)
+    gbm = learner["gradient_booster"]
+    if gbm["name"] != "gbtree":
+        raise ValueError(f"Booster '{gbm['name']}' no soportado")
+    objetivo = learner["objective"]["name"]
+    if objetivo not in OBJETIVOS_LOGISTICOS | OBJETIVOS_IDENTIDAD:
+        raise ValueError(f"Objetivo '{objetivo}' no soportado")
+    if int(learner["learner_model_param"].get("num_class", "0")) > 1:
+        raise ValueError("Modelos multiclase no soportados")
+
+    trees = gbm["model"]["trees"]
+    # Igual que el wrapper sklearn: si hubo early stopping se usa best_iteration
+    try:
+        parallel = int(gbm["model"]["gbtree_model_param"].get("num_parallel_tree", "1"))
+        trees = trees[:(int(model.best_iteration) + 1) * parallel]
+    except AttributeError:
+        pass
+    if not trees:
+        raise ValueError("El modelo no tiene árboles")
+
+    base_score = float(learner["learner_model_param"]["base_score"])
+    if objetivo in OBJETIVOS_LOGISTICOS:
+        base_margin = np.log(base_score / (1 - base_score))
+    else:
+        base_margin = base_score
+
+    # Nodo 0: hoja con el margen base
+    feature, threshold = [np.zeros(1, np.int32)], [np.zeros(1, np.float32)]
+    left, right = [np.zeros(1, np.int32)], [np.zeros(1, np.int32)]
+    default_left, value = [np.zeros(1, bool)], [np.array([base_margin], np.float32)]
+    roots, profundidad, offset = [0], 0, 1
+    for tree in trees:
+        if any(tree.get("split_type", [])):
+            raise ValueError("Splits categóricos no soportados")
+        hijos_izq = np.asarray(tree["left_children"], dtype=np.int32)
+        hijos_der = np.asarray(tree["right_children"], dtype=np.int32)
+        n = hijos_izq.size
+        propio = np.arange(n, dtype=np.int32)
+        es_hoja = hijos_izq == -1
+        condiciones = np.asarray(tree["split_conditions"], dtype=np.float32)
+        feature.append(np.where(es_hoja, 0, np.asarray(tree["split_indices"], dtype=np.int32)))
+        threshold.append(np.where(es_hoja, np.float32(0), condiciones))
+        left.append(np.where(es_hoja, propio, hijos_izq) + offset)
+        right.append(np.where(es_hoja, propio, hijos_der) + offset)
+        default_left.append(np.asarray(tree["default_left"], dtype=bool))
+        # En las hojas, split_conditions guarda el valor de la hoja
+        value.append(np.where(es_hoja, condiciones, np.float32(0)))
+        roots.append(offset)
+        profundidad = max(profundidad, _profundidad(hijos_izq, hijos_der))
+        offset += n
+
+    return EnsambleCompilado(
+        feature_names=learner.get("feature_names") or None,
+        feature=np.ascontiguousarray(np.concatenate(feature), dtype=np.intp),
+        threshold=np.ascontiguousarray(np.concatenate(threshold)),
+        hijos=np.ascontiguousarray(np.column_stack([np.concatenate(right), np.concatenate(left)]).ravel(), dtype=np.intp),
+        default_left=np.ascontiguousarray(np.concatenate(default_left)),
+        value=np.ascontiguousarray(np.concatenate(value)),
+        roots=np.asarray(roots, dtype=np.intp),
+        profundidad=profundidad,
+        objetivo=objetivo,
+        classes=getattr(model, "classes_", None),
+    )
+
+def _profundidad(left: np.ndarray, right: np.ndarray) -> int:
+    profundidad, nivel = 0, [0]
+    while True:
+        siguiente = [h for n in nivel for h in (left[n], right[n]) if h != -1]
+        if not siguiente:
+            return profundidad
+        profundidad, nivel = profundidad + 1, siguiente
@@ -0,0 +1,241 @@
+"""
+Canal WebSocket de puntuación para clientes internos de alto volumen.
+
+Una conexión larga reemplaza miles de POST por segundo: cada frame trae una
+entrada o un lote chico con un id de correlación, y la respuesta vuelve por
+la misma conexión con ese id. Frames de texto o binarios, con JSON:
+
+    -> {"id": "a1", "input": {...}}            una entrada
+    -> {"id": "a2", "inputs": [{...}, ...]}    un lote chico
+    <- {"id": "a1", "result": {...}}
+    <- {"id": "a2", "results": [{...}, ...]}
+    <- {"id": "a3", "error": "..."}            frame inválido o falla del modelo; la conexión sigue
+
+Los frames que llegan juntos se agrupan en un solo llamado al modelo, igual
+que el coalescer de /predict: el primero espera a lo sumo `WS_MAX_WAIT_MS`,
+o menos si ya se juntaron `WS_MAX_BATCH_ROWS` filas. Con `WS_MAX_INFLIGHT`
+lotes en vuelo por conexión las respuestas pueden llegar fuera de orden, y
+los errores de validación se responden apenas se lee el frame.
+
+Control de flujo: con `WS_MAX_PENDING` frames sin responder el servidor deja
+de leer la conexión, y el cliente queda frenado por TCP en lugar de llenar
+la memoria del proceso.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from serving.metrics import observar_lote
+from serving.respuestas import orjson, codificar
+
+# Entradas máximas por frame
+WS_MAX_FRAME_ROWS = int(os.getenv("WS_MAX_FRAME_ROWS", "1000"))
+# Filas máximas de un lote agrupado (un frame más grande va solo)
+WS_MAX_BATCH_ROWS = int(os.getenv("WS_MAX_BATCH_ROWS", "512"))
+# Espera máxima del primer frame de un lote antes de puntuarlo
+WS_MAX_WAIT_MS    = float(os.getenv("WS_MAX_WAIT_MS", "2"))
+# Frames aceptados y sin responder por conexión; al llegar al máximo se deja de leer
+WS_MAX_PENDING    = int(os.getenv("WS_MAX_PENDING", "1024"))
+# Lotes puntuándose a la vez por conexión
+WS_MAX_INFLIGHT   = int(os.getenv("WS_MAX_INFLIGHT", "2"))
+
+_cargar = orjson.loads if orjson is not None else json.loads
+
+class FrameInvalido(Exception):
+    def __init__(self, id_, detalle: str):
+        super().__init__(detalle)
+        self.id = id_
+        self.detalle = detalle
+
+def describir_error(e: ValidationError, prefijo: str = "") -> str:
+    return "; ".join(
+        f"{prefijo}{'.'.join(str(p) for p in err['loc']) or 'entrada'}: {err['msg']}" for err in e.errors()
+    )
+
+class CanalPuntuacion:
+    """
+    Endpoint WebSocket de una API. `funcion_filas` puntúa una lista de
+    entradas ya validadas con una sola llamada al modelo y devuelve una fila
+    (dict) por entrada, como `filas_clientes` o `filas_tiempo_jira`.
+    `antes_de_lote`, si se asigna, se espera antes de cada lote: el gateway
+    lo usa para que el registro cargue el modelo y marque su uso.
+    """
+
+    def __init__(self, nombre: str, modelo_entrada, funcion_filas, max_filas_frame: int = WS_MAX_FRAME_ROWS,
+                 max_filas_lote: int = WS_MAX_BATCH_ROWS, max_wait_ms: float = WS_MAX_WAIT_MS,
+                 max_pendientes: int = WS_MAX_PENDING, max_en_vuelo: int = WS_MAX_INFLIGHT):
+        self.nombre          = nombre
+        self.modelo_entrada  = modelo_entrada
+        self.funcion_filas   = funcion_filas
+        self.max_filas_frame = max(1, max_filas_frame)
+        self.max_filas_lote  = max(1, max_filas_lote)
+        self.max_wait        = max(0.0, max_wait_ms) / 1000
+        self.max_pendientes  = max(1, max_pendientes)
+        self.max_en_vuelo    = max(1, max_en_vuelo)
+        self.antes_de_lote   = None
+        self._lock  = threading.Lock()
+        self._stats = {"conexiones_activas": 0, "conexiones": 0, "frames": 0, "filas": 0,
+                       "lotes": 0, "max_lote": 0, "errores": 0}
+
+    def _sumar(self, **campos):
+        with self._lock:
+            for campo, valor in campos.items():
+                self._stats[campo] += valor
+
+    async def atender(self, websocket):
+        """Acepta la conexión y la atiende hasta que el cliente la cierra."""
+        await websocket.accept()
+        self._sumar(conexiones=1, conexiones_activas=1)
+        try:
+            await _Conexion(self, websocket).correr()
+        finally:
+            self._sumar(conexiones_activas=-1)
+
+    def frame(self, mensaje: dict) -> tuple:
+        """Valida un mensaje recibido; devuelve (id, entradas, es_lote) o levanta FrameInvalido."""
+        datos = mensaje.get("text")
+        if datos is None:
+            datos = mensaje.get("bytes")
+        try:
+            frame = _cargar(datos)
+        except (TypeError, ValueError):
+            raise FrameInvalido(None, "El frame no es JSON válido")
+        if not isinstance(frame, dict):
+            raise FrameInvalido(None, "El frame debe ser un objeto JSON")
+        id_ = frame.get("id")
+        if id_ is None or isinstance(id_, (dict, list)):
+            raise FrameInvalido(None, "Falta el id de correlación (string o número)")
+        if ("input" in frame) == ("inputs" in frame):
+            raise FrameInvalido(id_, "El frame debe traer 'input' o 'inputs'")
+        es_lote = "inputs" in frame
+        crudos = frame["inputs"] if es_lote else [frame["input"]]
+        if not isinstance(crudos, list) or not crudos:
+            raise FrameInvalido(id_, "'inputs' debe ser una lista no vacía")
+        if len(crudos) > self.max_filas_frame:
+            raise FrameInvalido(id_, f"'inputs' admite hasta {self.max_filas_frame} entradas por frame")
+        entradas = []
+        for i, crudo in enumerate(crudos):
+            try:
+                entradas.append(self.modelo_entrada.model_validate(crudo))
+            except ValidationError as e:
+                raise FrameInvalido(id_, describir_error(e, f"inputs[{i}]." if es_lote else ""))
+        return id_, entradas, es_lote
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s["lote_promedio"] = round(s["filas"] / s["lotes"], 2) if s["lotes"] else 0.0
+        s.update(max_filas_lote=self.max_filas_lote, max_wait_ms=self.max_wait * 1000,
+                 max_pendientes=self.max_pendientes, max_en_vuelo=self.max_en_vuelo)
+        return s
+
+class _Conexion:
+    """Estado de una conexión: lectura con control de flujo, agrupación y envío."""
+
+    def __init__(self, canal: CanalPuntuacion, websocket):
+        self.canal = canal
+        self.ws    = websocket
+        self.cola  = deque()         # (id, entradas, es_lote, llegada)
+        self.filas_en_cola = 0
+        self.hay   = asyncio.Event()  # la cola tiene frames
+        self.lleno = asyncio.Event()  # la cola completa un lote
+        self.pendientes = asyncio.Semaphore(canal.max_pendientes)
+        self.en_vuelo   = asyncio.Semaphore(canal.max_en_vuelo)
+        self.lock_envio = asyncio.Lock()
+        self.tareas = set()
+
+    async def correr(self):
+        agrupador = asyncio.create_task(self._agrupar())
+        try:
+            await self._recibir()
+        finally:
+            agrupador.cancel()
+            for tarea in list(self.tareas):
+                tarea.cancel()
+
+    async def _recibir(self):
+        canal = self.canal
+        while True:
+            await self.pendientes.acquire()
+            mensaje = await self.ws.receive()
+            if mensaje["type"] == "websocket.disconnect":
+                return
+            canal._sumar(frames=1)
+            try:
+                id_, entradas, es_lote = canal.frame(mensaje)
+            except FrameInvalido as e:
+                canal._sumar(errores=1)
+                await self._enviar([{"id": e.id, "error": e.detalle}])
+                continue
+            self.cola.append((id_, entradas, es_lote, time.monotonic()))
+            self.filas_en_cola += len(entradas)
+            self.hay.set()
+            if self.filas_en_cola >= canal.max_filas_lote:
+                self.lleno.set()
+
+    async def _agrupar(self):
+        canal = self.canal
+        while True:
+            # Mientras todos los lotes están en vuelo los frames se acumulan y el próximo lote crece
+            await self.en_vuelo.acquire()
+            while not self.cola:
+                self.hay.clear()
+                await self.hay.wait()
+            restante = self.cola[0][3] + canal.max_wait - time.monotonic()
+            if self.filas_en_cola < canal.max_filas_lote and restante > 0:
+                self.lleno.clear()
+                try:
+                    await asyncio.wait_for(self.lleno.wait(), restante)
+                except asyncio.TimeoutError:
+                    pass
+            lote, filas = [], 0
+            while self.cola and (not lote or filas + len(self.cola[0][1]) <= canal.max_filas_lote):
+                frame = self.cola.popleft()
+                lote.append(frame)
+                filas += len(frame[1])
+            self.filas_en_cola -= filas
+            tarea = asyncio.create_task(self._puntuar(lote))
+            self.tareas.add(tarea)
+            tarea.add_done_callback(self.tareas.discard)
+
+    async def _puntuar(self, lote: list):
+        canal = self.canal
+        entradas = [e for _, es, _, _ in lote for e in es]
+        try:
+            if canal.antes_de_lote is not None:
+                await canal.antes_de_lote()
+            observar_lote(len(entradas))
+            filas = await run_in_threadpool(canal.funcion_filas, entradas)
+        except Exception as e:
+            detalle = getattr(e, "detail", None) or "Error interno en la predicción"
+            logging.error(f"Error en el canal WebSocket de {canal.nombre}: {e}")
+            canal._sumar(errores=len(lote))
+            respuestas = [{"id": id_, "error": detalle} for id_, _, _, _ in lote]
+        else:
+            canal._sumar(lotes=1, filas=len(entradas))
+            with canal._lock:
+                canal._stats["max_lote"] = max(canal._stats["max_lote"], len(entradas))
+            respuestas, i = [], 0
+            for id_, es, es_lote, _ in lote:
+                parte = filas[i:i + len(es)]
+                i += len(es)
+                respuestas.append({"id": id_, "results": parte} if es_lote else {"id": id_, "result": parte[0]})
+        finally:
+            self.en_vuelo.release()
+        await self._enviar(respuestas)
+
+    async def _enviar(self, respuestas: list[dict]):
+        async with self.lock_envio:
+            for respuesta in respuestas:
+                try:
+                    await self.ws.send_text(codificar(respuesta).decode())
+                except Exception:
+                    # El cliente se fue: la lectura lo detecta y cierra la conexión
+                    return
+                finally:
+                    self.pendientes.release()
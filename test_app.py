@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import threading
+import time
+import signal
+import socket
+import subprocess
+import urllib.request
+import numpy as np
+import pandas as pd
+import mlflow.sklearn
+import pytest
+from fastapi.testclient import TestClient
+from xgboost import XGBClassifier, XGBRegressor
+import app as gateway
+from serving.model_store import AlmacenModelos, checksum_directorio
+from serving.slim import exportar
+
+CLIENTE = {"Age": 35, "Sex": 1, "Job": 2, "Housing": 1, "Saving_accounts": 1,
+           "Checking_account": 1, "Credit_amount": 1500.0, "Duration": 12, "Purpose": 4}
+ISSUE = {"team": "ADP", "tipo_de_issue": "Historia", "story_points": 5.0, "sprint_numbers": 1}
+
+def _cachear(almacen, nombre, modelo):
+    ruta = f"{almacen.directorio}/{nombre}/1"
+    mlflow.sklearn.save_model(modelo, ruta)
+    with open(f"{almacen.directorio}/{nombre}/manifest.json", "w") as f:
+        json.dump({"alias": {"production": "1"}, "versiones": {"1": {"checksum": checksum_directorio(ruta)}}}, f)
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Gateway con ambos modelos en una cache local offline; ninguno cargado al empezar."""
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({f: rng.integers(0, 3, 200) for f in gateway.predict_logic.FEATURES})
+    X["Age"] += 18
+    X["Credit_amount"] = rng.uniform(250, 20000, 200)
+    XJ = pd.DataFrame({f: rng.integers(0, 4, 200).astype(float) for f in gateway.jira_predict_logic.JIRA_FEATURES})
+    almacen = AlmacenModelos(str(tmp_path))
+    _cachear(almacen, gateway.predict_logic.MODEL_NAME, XGBClassifier(n_estimators=5).fit(X, X["Sex"]))
+    _cachear(almacen, gateway.jira_predict_logic.MODEL_NAME, XGBRegressor(n_estimators=5).fit(XJ, XJ.sum(axis=1) * 24))
+    for modulo in (gateway.predict_logic, gateway.jira_predict_logic):
+        monkeypatch.setattr(modulo.cargador, "almacen", almacen)
+        monkeypatch.setattr(modulo.cargador, "offline", True)
+        monkeypatch.setattr(modulo.cargador, "intervalo", 0)
+        modulo.cargador.descargar()
+    with TestClient(gateway.app) as c:
+        yield c
+    for modulo in (gateway.predict_logic, gateway.jira_predict_logic):
+        modulo.cargador.descargar()
+
+def test_gateway_carga_perezosa_por_api(client):
+    modelos = client.get("/health").json()["registro"]["modelos"]
+    assert not modelos["german"]["cargado"] and not modelos["jira"]["cargado"]
+    response = client.post("/predict", json=CLIENTE)
+    assert response.status_code == 200 and "risk" in response.json()
+    # Solo se cargó el modelo que se usó; cada API conserva su propio /health
+    assert client.get("/german/health").json()["model"]["version"] == "1"
+    assert client.get("/jira/health").json()["model_loaded"] is False
+    assert client.get("/info/teams").json() == {"teams": ["ADP", "TRX", "EFI"]}
+    assert client.get("/jira/health").json()["model_loaded"] is False
+    response = client.post("/predict/time/batch", json=[ISSUE, ISSUE])
+    assert response.status_code == 200 and response.json()["total"] == 2
+    modelos = client.get("/health").json()["registro"]["modelos"]
+    assert modelos["german"]["cargado"] and modelos["jira"]["cargado"]
+    assert modelos["german"]["memoria_bytes"] > 0
+    assert client.get("/german/openapi.json").json()["info"]["title"] == "German Credit Risk API"
+    texto = client.get("/metrics").text
+    assert 'model_registry_loaded{model="jira"} 1' in texto
+    # Las rutas que ambas APIs tienen se distinguen por la etiqueta api
+    for api in ("german", "jira"):
+        assert f'http_requests_total{{api="{api}",route="/health",method="GET",status="200"}}' in texto
+
+def test_gateway_websocket_carga_el_modelo_en_el_primer_lote(client):
+    with client.websocket_connect("/predict/time/ws") as ws:
+        assert client.get("/jira/health").json()["model_loaded"] is False
+        ws.send_json({"id": 1, "inputs": [ISSUE, ISSUE]})
+        respuesta = ws.receive_json()
+    assert respuesta["id"] == 1 and len(respuesta["results"]) == 2
+    assert client.get("/health").json()["registro"]["modelos"]["jira"]["cargado"]
+
+def test_gateway_desaloja_modelos_inactivos(client, monkeypatch):
+    registro = gateway.registro_modelos
+    client.post("/predict", json=CLIENTE)
+    client.post("/predict/time", json=ISSUE)
+    # Con presupuesto holgado no se descarga nada aunque estén inactivos
+    monkeypatch.setattr(registro, "inactividad", 0)
+    monkeypatch.setattr(registro, "presupuesto_mb", 100)
+    assert registro.desalojar() == []
+    # Sobre el presupuesto se descarga el menos usado recientemente
+    monkeypatch.setattr(registro, "presupuesto_mb", 1e-9)
+    client.post("/predict/time", json=ISSUE)
+    assert registro.desalojar()[0] == "german"
+    assert client.get("/german/health/ready").status_code == 503
+    assert client.get("/health/ready").status_code == 200
+    # La próxima solicitud lo vuelve a cargar
+    assert client.post("/predict/batch", json=[CLIENTE]).status_code == 200
+    assert client.get("/health").json()["registro"]["modelos"]["german"]["desalojos"] == 1
+
+def test_gateway_no_desaloja_modelos_en_uso(client, monkeypatch):
+    registro = gateway.registro_modelos
+    client.post("/predict", json=CLIENTE)
+    monkeypatch.setattr(registro, "inactividad", 0)
+    # Un stream abierto cuenta como uso aunque su última solicitud sea vieja
+    with registro.en_uso("german"):
+        assert "german" not in registro.desalojar()
+        assert client.get("/health").json()["registro"]["modelos"]["german"]["en_uso"] == 1
+    # La descarga no toma el lock del registro: cargar() no la espera bajo el lock
+    entrada = registro._entradas["german"]
+    bloqueo, liberar = threading.Event(), threading.Event()
+    original = entrada.cargador.descargar
+    def descargar_lento():
+        bloqueo.set()
+        liberar.wait(5)
+        original()
+    monkeypatch.setattr(entrada.cargador, "descargar", descargar_lento)
+    hilo = threading.Thread(target=registro.desalojar)
+    hilo.start()
+    try:
+        assert bloqueo.wait(5)
+        assert registro._lock.acquire(timeout=1)
+        registro._lock.release()
+        assert client.get("/jira/health").status_code == 200
+    finally:
+        liberar.set()
+        hilo.join()
+    assert client.get("/german/health/ready").status_code == 503
+    assert client.post("/predict", json=CLIENTE).status_code == 200
+
+def _health(puerto):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/health", timeout=5) as r:
+            return json.load(r)
+    except OSError:
+        return None
+
+def _esperar_workers(puerto, condicion, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        workers = (_health(puerto) or {}).get("workers")
+        if workers and condicion(workers):
+            return workers
+        time.sleep(0.1)
+    raise AssertionError("Los workers no llegaron al estado esperado")
+
+def test_prefork_comparte_modelo_y_reinicia_workers(tmp_path):
+    rng = np.random.default_rng(1)
+    X = pd.DataFrame({f: rng.integers(0, 3, 200) for f in gateway.predict_logic.FEATURES})
+    exportar(XGBClassifier(n_estimators=5).fit(X, X["Sex"] > 0), gateway.predict_logic.MODEL_NAME, "1", str(tmp_path))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    entorno = {**os.environ, "MODEL_SLIM_DIR": str(tmp_path), "MODEL_WATCH_INTERVAL": "0",
+               "PREFORK_HEALTH_INTERVAL": "0.2"}
+    padre = subprocess.Popen([sys.executable, "-m", "serving.prefork", "german", "--workers", "2",
+                              "--host", "127.0.0.1", "--port", str(puerto)], env=entorno,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        workers = _esperar_workers(puerto, lambda w: w["vivos"] == 2 and all(d["estado_hace_s"] is not None
+                                                                           for d in w["detalle"]))
+        # El modelo lo cargó el padre: los workers no lo vuelven a cargar
+        assert [d["version_modelo"] for d in workers["detalle"]] == ["1", "1"]
+        assert workers["totales"]["model"]["cambios"] == 2
+        pedido = urllib.request.Request(f"http://127.0.0.1:{puerto}/predict", data=json.dumps(CLIENTE).encode(),
+                                        headers={"Content-Type": "application/json"})
+        assert "risk" in json.load(urllib.request.urlopen(pedido, timeout=10))
+        os.kill(workers["detalle"][0]["pid"], signal.SIGKILL)
+        workers = _esperar_workers(puerto, lambda w: w["reinicios"] == 1 and w["vivos"] == 2)
+        assert workers["pss_total_mb"] < workers["rss_total_mb"] + workers["rss_padre_mb"]
+    finally:
+        padre.terminate()
+        assert padre.wait(60) == 0